@@ -1,17 +1,20 @@
+import functools
 import json
 import sys
 import singer
 import time
 import traceback
 import boto3
+from concurrent.futures import ThreadPoolExecutor
 
 from singer import metadata
 from tap_s3_csv.discover import discover_streams
 from tap_s3_csv import s3
-from tap_s3_csv.sync import sync_stream
+from tap_s3_csv.sync import STATE_LOCK, sync_stream
 from tap_s3_csv.config import CONFIG_CONTRACT
-from tap_s3_csv import dialect
+from tap_s3_csv import dialect, discovery_cache, messages, pipeline, spill
 from tap_s3_csv.symon_exception import SymonException
+from tap_s3_csv.utils import IMPORT_PERF_METRICS_LOG_PREFIX
 
 LOGGER = singer.get_logger()
 
@@ -19,8 +22,6 @@ REQUIRED_CONFIG_KEYS = ["bucket"]
 REQUIRED_CONFIG_KEYS_EXTERNAL_SOURCE = [
     "bucket", "account_id", "external_id", "role_name"]
 
-IMPORT_PERF_METRICS_LOG_PREFIX = "IMPORT_PERF_METRICS:"
-
 # for symon error logging
 ERROR_START_MARKER = '[tap_error_start]'
 ERROR_END_MARKER = '[tap_error_end]'
@@ -51,10 +52,10 @@ def write_export_metrics(bucket, key, row_count, col_count):
         return False
 
 
-def do_discover(config):
+def do_discover(config, cache=None):
     LOGGER.info("Starting discover")
 
-    streams = discover_streams(config)
+    streams = discover_streams(config, cache)
     if not streams:
         raise Exception("No streams found")
     catalog = {"streams": streams}
@@ -66,6 +67,27 @@ def stream_is_selected(mdata):
     return mdata.get((), {}).get('selected', False)
 
 
+def sync_selected_stream(config, state, start_byte, end_byte, range_size, json_lib, table_spec, stream):
+    stream_name = stream['tap_stream_id']
+    mdata = metadata.to_map(stream['metadata'])
+
+    with STATE_LOCK:
+        messages.write_state(state)
+
+    key_properties = mdata.get((), {}).get('table-key-properties', [])
+    messages.write_schema(stream_name, stream['schema'], key_properties)
+
+    LOGGER.info("%s: Starting sync", stream_name)
+    with s3.count_skipped_files() as skipped_files:
+        counter_value = sync_stream(
+            config, state, table_spec, stream, start_byte, end_byte, range_size, json_lib)
+    if skipped_files.count:
+        LOGGER.warn("%s files got skipped during the last sync.",
+                    skipped_files.count)
+    LOGGER.info("%s: Completed sync (%s rows)", stream_name, counter_value)
+    return counter_value
+
+
 def do_sync(config, catalog, state):
     start_byte = config.get('start_byte')
     end_byte = config.get('end_byte')
@@ -87,6 +109,7 @@ def do_sync(config, catalog, state):
 
     LOGGER.info(f'Starting sync ({start_byte}-{end_byte}).')
 
+    selected_streams = []
     for stream in catalog['streams']:
         stream_name = stream['tap_stream_id']
         mdata = metadata.to_map(stream['metadata'])
@@ -95,24 +118,30 @@ def do_sync(config, catalog, state):
         if not stream_is_selected(mdata):
             LOGGER.info("%s: Skipping - not selected", stream_name)
             continue
-
-        singer.write_state(state)
-
-        key_properties = mdata.get((), {}).get('table-key-properties', [])
-        singer.write_schema(stream_name, stream['schema'], key_properties)
-
-        LOGGER.info("%s: Starting sync", stream_name)
-        counter_value = sync_stream(
-            config, state, table_spec, stream, start_byte, end_byte, range_size, json_lib)
+        selected_streams.append((table_spec, stream))
+
+    sync_selected = functools.partial(
+        sync_selected_stream, config, state, start_byte, end_byte, range_size, json_lib)
+    max_workers = config.get('sync_max_workers', 1)
+    if max_workers > 1 and len(selected_streams) > 1:
+        # streams are synced concurrently, map keeps the counts in the order of the catalog
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            counter_values = list(executor.map(lambda selected: sync_selected(*selected), selected_streams))
+        finally:
+            # stop syncing the remaining streams once one of them failed
+            executor.shutdown(cancel_futures=True)
+    else:
+        counter_values = [sync_selected(table_spec, stream) for table_spec, stream in selected_streams]
+
+    for (_, stream), counter_value in zip(selected_streams, counter_values):
         # Exports logs for row and col count
         if "properties" in stream['schema']:
             current_col_count = len(stream['schema']["properties"].items())
             total_col_count += current_col_count
-            json_row_col = {"name": name, "stream_id":stream_name, "row": counter_value, "col": current_col_count}
+            json_row_col = {"name": name, "stream_id":stream['tap_stream_id'], "row": counter_value, "col": current_col_count}
             grouped_logs.append("individual_file_data_props: " + str(json_row_col))
         total_row_count += counter_value
-        LOGGER.info("%s: Completed sync (%s rows)", stream_name, counter_value)
-        
 
     # import performance logging - left here for convenience
     # timers_str = ', '.join(f'"{k}": {v:.0f}' for k, v in timers.items())
@@ -190,6 +219,7 @@ def main():
             external_source = True
 
         config['tables'] = validate_table_config(config)
+        spill.set_memory_budget(config.get('memory_budget_bytes'))
 
         # If external_id is provided, we are trying to access files in another AWS account, and need to assume the role
         if external_source:
@@ -202,12 +232,27 @@ def main():
             except BaseException as err:
                 LOGGER.error(err)
 
+        # tables found in the discovery cache skip dialect detection and sampling, files whose dialect was detected
+        # by an earlier run (e.g. the discover run of a sync) skip dialect detection
+        cache = discovery_cache.get_discovery_cache(config)
+        cached_tables = cache.load_tables(config) if cache and args.discover else set()
+
+        if not external_source:
             # If not external source, it is from importing csv (replacement for tap-csv)
-            dialect.detect_tables_dialect(config)
+            dialect.detect_tables_dialect(config, cached_tables, cache)
         if args.discover:
-            do_discover(args.config)
+            do_discover(args.config, cache)
         elif args.properties:
-            do_sync(config, args.properties, args.state)
+            # records, schemas and states are all written by the background writer, in order
+            with messages.redirect_output(config.get('output_path')), \
+                    messages.compressed_output(config.get('output_compression'), config.get('output_compression_level')), \
+                    messages.background_writer(config.get('background_writer', True)), \
+                    messages.batch_output(config):
+                try:
+                    do_sync(config, args.properties, args.state)
+                finally:
+                    pipeline.shutdown_transform_workers()
+        spill.log_metrics()
     except SymonException as e:
         exc_type, exc_value, exc_traceback = sys.exc_info()
         error_info = {
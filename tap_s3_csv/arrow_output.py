@@ -0,0 +1,236 @@
+import io
+import itertools
+
+import simplejson as json
+
+from tap_s3_csv import spill
+from tap_s3_csv.symon_exception import SymonException
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# With output_mode 'arrow', records are written as Arrow IPC record batches of up to ARROW_BATCH_ROWS rows.
+ARROW_BATCH_ROWS = 65536
+
+# The Arrow schema of every IPC stream names the Singer stream its records belong to
+STREAM_METADATA_KEY = b'singer.stream'
+
+# Singer messages are json lines starting with '{', IPC streams start with the 0xFFFFFFFF continuation marker
+MESSAGE_START = b'{'
+
+_JSON_ENCODER = json.JSONEncoder(use_decimal=True)
+
+
+def check_pyarrow():
+    if pa is None:
+        raise SymonException('The arrow output mode requires the pyarrow package to be installed.',
+                             'ArrowOutputUnavailable')
+
+
+def get_arrow_type(property_schema):
+    # the first non null type of the column, values that do not fit it are written as text
+    if 'anyOf' in property_schema:
+        return pa.string()
+    types = property_schema.get('type', [])
+    if isinstance(types, str):
+        types = [types]
+    types = [datatype for datatype in types if datatype != 'null']
+    if not types:
+        return pa.string()
+    return {
+        'integer': pa.int64(),
+        'number': pa.float64(),
+        'boolean': pa.bool_(),
+    }.get(types[0], pa.string())
+
+
+def get_arrow_schema(stream_name, schema):
+    """
+    Builds the Arrow schema of a stream from its json schema, with the columns in the order of the schema
+    properties (the discovered column_order).
+    """
+    fields = [pa.field(str(name), get_arrow_type(property_schema))
+              for name, property_schema in schema.get('properties', {}).items()]
+    return pa.schema(fields, metadata={STREAM_METADATA_KEY: stream_name.encode('utf-8')})
+
+
+def _to_text(value):
+    if value is None or isinstance(value, str):
+        return value
+    return _JSON_ENCODER.encode(value)
+
+
+def to_record_batch(records, schema):
+    """
+    Converts records to a record batch of the schema. Keys that are not in the schema are added as string
+    columns, and a column whose values do not all fit its type is written as text for this batch.
+    """
+    names = set(schema.names)
+    if not names.issuperset(set().union(*records)):
+        for name in dict.fromkeys(itertools.chain.from_iterable(records)):
+            if name not in names:
+                schema = schema.append(pa.field(str(name), pa.string()))
+
+    try:
+        return pa.RecordBatch.from_pylist(records, schema=schema)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        pass
+
+    fields = []
+    columns = []
+    for field in schema:
+        values = [record.get(field.name) for record in records]
+        try:
+            column = pa.array(values, type=field.type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+            field = field.with_type(pa.string())
+            column = pa.array(map(_to_text, values), type=pa.string(), size=len(values))
+        fields.append(field)
+        columns.append(column)
+    return pa.RecordBatch.from_arrays(columns, schema=pa.schema(fields, metadata=schema.metadata))
+
+
+class OutputSink:
+    """
+    File object the IPC stream writer writes to. Its many small writes are collected and passed on as one
+    chunk per record batch.
+    """
+    closed = False
+
+    def __init__(self, write_bytes):
+        self.write_bytes = write_bytes
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        if self.chunks:
+            self.write_bytes(b''.join(self.chunks))
+            self.chunks = []
+
+
+class StagedStream:
+    """
+    Pending records and open IPC stream writer of a Singer stream. The IPC stream is written to the output, or
+    to a spill buffer when another stream is already writing to the output, and copied to it once ended.
+    """
+
+    def __init__(self, stream_name, write_bytes, buffered):
+        self.stream_name = stream_name
+        self.buffer = spill.SpillBuffer() if buffered else None
+        self.sink = OutputSink(self.buffer.write if buffered else write_bytes)
+        self.records = []
+        self.writer = None
+        self.writer_schema = None
+
+    def write_batch(self, schema):
+        batch = to_record_batch(self.records, schema)
+        self.records = []
+
+        if self.writer is not None and not self.writer_schema.equals(batch.schema):
+            self.close_writer()
+        if self.writer is None:
+            self.writer = pa.ipc.new_stream(self.sink, batch.schema)
+            self.writer_schema = batch.schema
+        self.writer.write_batch(batch)
+        self.sink.drain()
+
+    def close_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.sink.drain()
+
+    def end(self, write_bytes):
+        self.close_writer()
+        if self.buffer is not None:
+            buffer = self.buffer.getfile()
+            for block in iter(lambda: buffer.read(spill.COPY_SIZE), b''):
+                write_bytes(block)
+            self.buffer.close()
+
+    def discard(self):
+        self.writer = None
+        if self.buffer is not None:
+            self.buffer.close()
+
+
+class ArrowStager:
+    """
+    Writes the records of each stream as an Arrow IPC stream between the Singer messages, after the SCHEMA
+    message of the stream. Records of concurrently synced streams are staged per stream, so each IPC stream
+    holds full batches of a single stream; the first stream staged writes straight to the output and the others
+    to spill buffers. Every IPC stream is ended before any other message is written (a new one is started when
+    the types of the next batch of a stream differ), so the output is a sequence of json lines and complete IPC
+    streams.
+    """
+
+    def __init__(self, write_bytes, batch_rows=ARROW_BATCH_ROWS):
+        check_pyarrow()
+        self.write_bytes = write_bytes
+        self.batch_rows = batch_rows
+        self.schemas = {}
+        # stream name -> StagedStream, in the order their first records were added
+        self.staged = {}
+
+    def set_schema(self, stream_name, schema):
+        self.schemas[stream_name] = get_arrow_schema(stream_name, schema)
+
+    def add(self, stream_name, records, json_lib=None):
+        staged = self.staged.get(stream_name)
+        if staged is None:
+            staged = self.staged[stream_name] = StagedStream(stream_name, self.write_bytes, bool(self.staged))
+        staged.records.extend(records)
+        if len(staged.records) >= self.batch_rows:
+            self._write_batch(staged)
+
+    def flush(self):
+        for staged in self.staged.values():
+            if staged.records:
+                self._write_batch(staged)
+            staged.end(self.write_bytes)
+        self.staged = {}
+
+    def discard(self):
+        # a failed sync leaves the current IPC stream unterminated, like a partial RECORD line
+        for staged in self.staged.values():
+            staged.discard()
+        self.staged = {}
+
+    def _write_batch(self, staged):
+        schema = self.schemas.get(staged.stream_name)
+        if schema is None:
+            schema = get_arrow_schema(staged.stream_name, {})
+        staged.write_batch(schema)
+
+
+def read_arrow_output(file_handle):
+    """
+    Reads the output of the arrow output mode from a binary file object. Yields the Singer messages as dicts
+    and each record batch as {'type': 'RECORD_BATCH', 'stream': ..., 'batch': pyarrow.RecordBatch}.
+    """
+    check_pyarrow()
+    if not hasattr(file_handle, 'peek'):
+        file_handle = io.BufferedReader(file_handle)
+
+    while True:
+        head = file_handle.peek(1)[:1]
+        if not head:
+            return
+        if head == MESSAGE_START or head.isspace():
+            line = file_handle.readline()
+            if line.strip():
+                yield json.loads(line)
+            continue
+
+        reader = pa.ipc.open_stream(file_handle)
+        stream_name = (reader.schema.metadata or {}).get(STREAM_METADATA_KEY, b'').decode('utf-8')
+        for batch in reader:
+            yield {'type': 'RECORD_BATCH', 'stream': stream_name, 'batch': batch}
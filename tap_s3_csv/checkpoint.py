@@ -0,0 +1,122 @@
+import collections
+import itertools
+import re
+import time
+
+import singer
+
+from tap_s3_csv.file_manifest import get_etag
+
+LOGGER = singer.get_logger()
+
+# same line endings as decoding.split_lines
+_LINE_END = re.compile(rb'\r\n|\r|\n')
+
+
+class LineOffsets:
+    """
+    Readable wrapper counting the line endings of the bytes read through it, so that the byte offset a line starts
+    at can be found from the number of lines before it. Blocks are kept until release() is called with a line
+    after them.
+    """
+
+    def __init__(self, file_handle, offset=0):
+        self.file_handle = file_handle
+        self.start = offset
+        self.offset = offset
+        self.lines = 0
+        # (offset, lines before the block, block, whether the block starts with the \n of a \r\n split across blocks)
+        self.blocks = collections.deque()
+        # offsets are looked up for lines further and further in the file, each search continues from the last
+        # line found: (offset of its block, line, position in the block)
+        self.cursor = (None, 0, 0)
+
+    def read(self, size=-1):
+        block = self.file_handle.read(size)
+        if block:
+            split_line_end = bool(self.blocks) and self.blocks[-1][2].endswith(b'\r') and block.startswith(b'\n')
+            self.blocks.append((self.offset, self.lines, block, split_line_end))
+            self.offset += len(block)
+            self.lines += block.count(b'\n') + block.count(b'\r') - block.count(b'\r\n') - split_line_end
+        return block
+
+    def release(self, line):
+        # keeps the block holding the end of the given line and the ones after it
+        while len(self.blocks) > 1 and self.blocks[1][1] < line:
+            self.blocks.popleft()
+
+    def get_offset(self, line):
+        """
+        Byte offset of the start of the line following the first given number of lines.
+        """
+        if line == 0:
+            return self.start
+        self.release(line)
+        offset, lines_before, block, split_line_end = self.blocks[0]
+        cursor_offset, cursor_line, cursor_position = self.cursor
+        if cursor_offset == offset and cursor_line < line:
+            position, skipped = cursor_position, line - cursor_line - 1
+        else:
+            position, skipped = 0, line - lines_before - 1 + split_line_end
+        match = next(itertools.islice(_LINE_END.finditer(block, position), skipped, None), None)
+        if match is None:
+            # the last line of the file has no line ending
+            return self.offset
+        end = match.end()
+        self.cursor = (offset, line, end)
+        if end == len(block) and match.group() == b'\r' and len(self.blocks) > 1 and self.blocks[1][3]:
+            end += 1
+        return offset + end
+
+
+class FileCheckpoint:
+    """
+    Position of a csv file being synced: the byte offset of the record boundary after the last written record, the
+    number of rows written before it and the ETag of the file. The position of each batch of rows is recorded when
+    it is parsed, and a checkpoint is written with write(bookmark) once a batch is written and interval seconds
+    (sync_checkpoint_seconds) passed since the last one. A sync resuming from a checkpoint of the same key and ETag
+    starts at its offset.
+    """
+
+    def __init__(self, s3_file, write, interval, bookmark=None):
+        self.key = s3_file['key']
+        self.etag = get_etag(s3_file)
+        self.size = s3_file.get('size')
+        self.write = write
+        self.interval = interval
+        self.offset = 0
+        self.rows = 0
+        if bookmark and bookmark.get('key') == self.key and bookmark.get('etag') == self.etag:
+            self.offset = bookmark['offset']
+            self.rows = bookmark['rows']
+            LOGGER.info('Resuming "%s" at byte %s after %s rows', self.key, self.offset, self.rows)
+        self.offsets = None
+        self.positions = collections.deque()
+        self.last_write = time.monotonic()
+
+    def is_at_end(self):
+        # the checkpoint written after the last batch of a file is at its end
+        return self.offset > 0 and self.size is not None and self.offset >= self.size
+
+    def track(self, file_handle):
+        self.offsets = LineOffsets(file_handle, self.offset)
+        return self.offsets
+
+    def iter_batches(self, batches, get_line):
+        # get_line gives the number of lines of the file (since the offset) parsed after the last row of a batch
+        for batch in batches:
+            self.positions.append(get_line())
+            yield batch
+
+    def written(self, rows):
+        self.rows += rows
+        line = self.positions.popleft()
+        if time.monotonic() - self.last_write < self.interval:
+            self.offsets.release(line)
+            return
+        self.offset = self.offsets.get_offset(line)
+        self.write(self.to_bookmark())
+        self.last_write = time.monotonic()
+
+    def to_bookmark(self):
+        return {'key': self.key, 'etag': self.etag, 'offset': self.offset, 'rows': self.rows}
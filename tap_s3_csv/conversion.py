@@ -1,7 +1,13 @@
+import functools
+import itertools
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
 import singer
 import pandas as pd
 import numpy as np
 from datetime import datetime
+from pandas.api.types import infer_dtype
 
 LOGGER = singer.get_logger()
 
@@ -25,7 +31,40 @@ TIME_SUFFIXES = [
     '.%f%z',    # 23:45:12.123456+05:00
 ]
 
+# Number of leading values used to narrow down the date formats that are tried on a column
+DATE_CLASSIFY_VALUES = 5
+
+# Strings pd.to_datetime accepts whatever the format (as NaT or the current time), they don't narrow down formats
+PANDAS_DATE_STRINGS = frozenset(['', 'NaN', 'nan', 'NAN', 'NaT', 'nat', 'NAT', 'today', 'now'])
+
+# Records buffered before they are folded into the column states during schema inference
+INFERENCE_BATCH_SIZE = 10000
+
+# Tables with at least this many columns have their columns inferred on a process pool when inference_max_workers
+# is above 1. Each task gets a contiguous slice of the columns, so only the values of those columns are sent to it.
+PARALLEL_INFERENCE_MIN_COLUMNS = 1000
+PARALLEL_INFERENCE_TASKS_PER_WORKER = 4
+
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+NUMBER_TYPES = {int, float, type(None)}
+
+# Permissive pattern per strptime directive. A format is only tried on a column when its first values match the
+# format's pattern, the patterns accept a superset of what pandas and datetime.strptime parse.
+DIRECTIVE_PATTERNS = {
+    '%Y': r'\d+',
+    '%m': r'\d+',
+    '%d': r'\d+',
+    '%H': r'\d+',
+    '%M': r'\d+',
+    '%S': r'\d+',
+    '%f': r'\d+',
+    '%z': r'(?:z|[+-]\d[\d:.]*)',
+}
+
+
 # generate all possible datetime formatting we support
+@functools.lru_cache(maxsize=None)
 def generate_date_format_mapping():
     mapping = {}
     
@@ -42,58 +81,90 @@ def generate_date_format_mapping():
     return mapping
 
 
-def infer_column(column, dateFormatMap, lengths):
-    if column.isnull().all():
-        lengths[column.name] = 0
-        return 'string'
+def _format_pattern(fmt):
+    parts = re.split(r'(%.)', fmt)
+    pattern = ''.join(DIRECTIVE_PATTERNS[part] if part in DIRECTIVE_PATTERNS
+                      else r'\s+' if part == ' ' else re.escape(part) for part in parts if part)
+    return re.compile(rf'\s*{pattern}\s*', re.IGNORECASE)
 
-    lengths[column.name] = column.apply(lambda x: len(str(x))).max()
 
-    if column.dtype.name == 'object':
-        # Check for list types (occurs from csv.DictReader if data row has more columns than headers)
-        if column.apply(lambda x: isinstance(x, list)).any():
-            return 'list'
+@functools.lru_cache(maxsize=None)
+def get_date_format_patterns():
+    return [(fmt, name, _format_pattern(fmt)) for fmt, name in generate_date_format_mapping().items()]
 
-        if infer_number(column):
-            return 'number'
-        elif infer_datetime(column, dateFormatMap):
-            return 'date-time'
-        elif infer_boolean(column):
-            return 'boolean'
-        else:
-            return 'string'
 
-    if column.dtype.name in ['int32', 'int64', 'float32']:
-        return 'number'
+def get_candidate_date_formats(column):
+    """
+    Returns the supported date formats, in order, that the first values of the column can match. Every value has to
+    parse for a format to be accepted, so formats the first values cannot match are never tried.
+    """
+    values = list(itertools.islice((value for value in column
+                                    if not (isinstance(value, str) and value in PANDAS_DATE_STRINGS)),
+                                   DATE_CLASSIFY_VALUES))
+    if not all(isinstance(value, str) for value in values):
+        return [(fmt, name) for fmt, name, _ in get_date_format_patterns()]
+    return [(fmt, name) for fmt, name, pattern in get_date_format_patterns()
+            if all(pattern.fullmatch(value) for value in values)]
+
+
+def is_string_column(column):
+    # all values are strings or missing, so the vectorized .str methods give the same results as per value calls
+    return column.dtype.name == 'object' and infer_dtype(column, skipna=True) == 'string'
+
+
+def contains_text(column, text):
+    # a single search over the joined strings instead of a check per value
+    return text in '\0'.join(column.dropna())
+
+
+def get_max_length(column):
+    if not is_string_column(column):
+        return column.apply(lambda x: len(str(x))).max()
+
+    present = column.dropna()
+    length = max(map(len, present), default=0)
+    if len(present) < len(column):
+        # None and NaN are measured as their str() like other values
+        length = max(length, column[column.isna()].map(lambda x: len(str(x))).max())
+    return np.int64(length)
+
 
 def infer_number(column):
-    tmpCol = column.copy()
-    tmpCol = tmpCol.apply(lambda x: x.replace(',', '') if isinstance(x, str) else x)
+    numbers = to_numbers(column)
     # empty strings are converted to NaN, which is a valid number
     # but if entire column is NaN, we want it to be inferred as string
+    return numbers is not None and numbers.dtype.name in ['float64', 'int64'] and not numbers.dropna().empty
+
+
+def to_numbers(column):
+    # Returns the column converted by pd.to_numeric, or None if it has values that are not numbers
+    if is_string_column(column):
+        tmpCol = column.str.replace(',', '', regex=False) if contains_text(column, ',') else column
+    else:
+        tmpCol = column.apply(lambda x: x.replace(',', '') if isinstance(x, str) else x)
     try:
-        tmpResult = pd.to_numeric(tmpCol)
-        if tmpResult.dropna().empty:
-            return False
+        return pd.to_numeric(tmpCol)
     except Exception:
-        return False
+        return None
 
-    if tmpResult.dtype.name in ['float64', 'int64']:
-        return True
-    else:
-        return False
 
 def infer_datetime(column, dateFormatMap):
-    tmpCol = column.copy()
-    # SalesForce exports empty dates as <NULL>
-    tmpCol.replace('(?i)<null>', '', inplace=True, regex=True)
+    tmpCol = get_date_values(column)
     # if entire column is empty string, we want it to be inferred as string
-    tmpCol = tmpCol.replace('', np.nan).dropna()
     if tmpCol.empty:
         return False
     # pandas does not check the format properly
     return infer_datetime_and_format(tmpCol, dateFormatMap)
 
+
+def get_date_values(column):
+    # SalesForce exports empty dates as <NULL>
+    if is_string_column(column):
+        tmpCol = column.str.replace('(?i)<null>', '', regex=True) if contains_text(column, '<') else column
+    else:
+        tmpCol = column.replace('(?i)<null>', '', regex=True)
+    return tmpCol.replace('', np.nan).dropna()
+
 def _all_values_match_format(column, fmt):
     # Validates fmt against failed rows individually. Uses datetime.strptime (year 1-9999)
     # instead of pandas, out of bounds dates are accepted. Target to detect format mismatches here.
@@ -110,22 +181,27 @@ def _all_values_match_format(column, fmt):
 def infer_datetime_and_format(column, dateFormatMap):
     column = column[column.astype(bool)] # Ignore empty strings/blank rows - they fail parsing for all but the first format
 
-    for k, v in generate_date_format_mapping().items():
-        try:
-            column = pd.to_datetime(column, format=k)
+    for k, v in get_candidate_date_formats(column):
+        if matches_date_format(column, k):
             dateFormatMap[column.name] = v
             return True
-        except Exception as e:
-            if 'Out of bounds' in str(e):
-                if _all_values_match_format(column, k):
-                    LOGGER.debug("Column '%s': accepted format '%s' with out-of-bounds dates", column.name, k)
-                    dateFormatMap[column.name] = v
-                    return True
 
     LOGGER.debug("Column '%s': no matching date format found", column.name)
     return False
 
 
+def matches_date_format(column, fmt):
+    try:
+        pd.to_datetime(column, format=fmt)
+        return True
+    except Exception as e:
+        if 'Out of bounds' in str(e):
+            if _all_values_match_format(column, fmt):
+                LOGGER.debug("Column '%s': accepted format '%s' with out-of-bounds dates", column.name, fmt)
+                return True
+    return False
+
+
 def infer_boolean(column):
     column = column.replace('', np.nan) # Replace empty strings with NaN so they are properly handled
     unique_values = column.unique()
@@ -158,21 +234,228 @@ def is_boolean_value(value):
     return False
 
 
+class ColumnState:
+    """
+    Summary of the values seen so far in one column. It holds what is needed to infer the column type a
+    DataFrame of all the values would get, without keeping the values.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.value_types = set()
+        self.has_null = False
+        self.has_non_null = False
+        self.has_big_int = False
+        self.length = np.int64(0)
+        self.float_length = 0
+        # a number column needs every batch convertible and at least one actual number
+        self.numbers_ok = True
+        self.number_dtypes = set()
+        self.has_number = False
+        # date formats every value parsed with so far, None until the first date value
+        self.has_date_values = False
+        self.date_formats = None
+        self.boolean_ok = True
+        self.has_boolean = False
+
+    def update(self, values):
+        types = set(map(type, values))
+        self.value_types |= types
+        column = pd.Series(values, dtype=object, name=self.name)
+        nulls = column.isnull()
+        self.has_null = self.has_null or nulls.any()
+        self.has_non_null = self.has_non_null or not nulls.all()
+        self.length = max(self.length, get_max_length(column))
+
+        if int in types:
+            self.has_big_int = self.has_big_int or any(
+                not INT64_MIN <= value <= INT64_MAX for value in values if type(value) is int)
+        if types <= NUMBER_TYPES:
+            # lengths as a float64 column would print its values
+            self.float_length = max(self.float_length, max(
+                3 if value is None else len(str(float(value))) for value in values))
+
+        # Lists occur from csv.DictReader if data row has more columns than headers
+        if list in self.value_types:
+            return
+
+        if self.numbers_ok:
+            numbers = to_numbers(column)
+            # booleans convert to a bool column on their own, but to numbers together with numbers or missing values
+            self.numbers_ok = numbers is not None and numbers.dtype.name in ['float64', 'int64', 'bool']
+            if self.numbers_ok:
+                self.number_dtypes.add(numbers.dtype.name)
+                self.has_number = self.has_number or not numbers.dropna().empty
+
+        if self.date_formats != []:
+            self._update_date_formats(column)
+
+        if self.boolean_ok:
+            for value in column.replace('', np.nan).unique():
+                if pd.isna(value):
+                    continue
+                if is_boolean_value(value):
+                    self.has_boolean = True
+                else:
+                    self.boolean_ok = False
+                    break
+
+    def _update_date_formats(self, column):
+        dates = get_date_values(column)
+        if dates.empty:
+            return
+        self.has_date_values = True
+        dates = dates[dates.astype(bool)]
+        if dates.empty:
+            return
+        candidates = get_candidate_date_formats(dates)
+        if self.date_formats is not None:
+            candidates = [candidate for candidate in candidates if candidate in self.date_formats]
+        self.date_formats = [(fmt, name) for fmt, name in candidates if matches_date_format(dates, fmt)]
+
+    def get_dtype(self):
+        # dtype pandas gives the column in a DataFrame of all the values
+        if self.value_types == {bool}:
+            return 'bool'
+        # ints outside of int64 make an object column, whatever else the column holds
+        if self.value_types <= NUMBER_TYPES and self.value_types & {int, float} and not self.has_big_int:
+            if self.value_types == {int}:
+                return 'int64'
+            return 'float64'
+        return 'object'
+
+    def get_type(self, date_format_map):
+        dtype = self.get_dtype()
+        if dtype == 'int64':
+            return 'number'
+        if dtype != 'object':
+            return None
+
+        if list in self.value_types:
+            return 'list'
+        if self.numbers_ok and self.has_number and self.number_dtypes != {'bool'}:
+            return 'number'
+        if self.has_date_values and self.date_formats != []:
+            formats = self.date_formats if self.date_formats is not None else list(generate_date_format_mapping().items())
+            date_format_map[self.name] = formats[0][1]
+            return 'date-time'
+        # All values must be boolean or blank/missing, and not all of them blank/missing
+        if self.boolean_ok and self.has_boolean:
+            return 'boolean'
+        return 'string'
+
+    def get_length(self):
+        if not self.has_non_null:
+            return 0
+        return np.int64(self.float_length) if self.get_dtype() == 'float64' else self.length
+
+
+class SchemaInferrer:
+    """
+    Infers the schema of records in a single pass. Records are buffered in batches of batch_size and folded into
+    per column states, so memory stays bounded however many records are inferred from. With max_workers above 1,
+    the columns of wide tables are updated on a process pool. Every column state only depends on the values of its
+    own column, so the result is the same as the serial one.
+    """
+
+    def __init__(self, batch_size=INFERENCE_BATCH_SIZE, max_workers=1):
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.pool = None
+        self.batch = []
+        self.columns = {}
+        self.row_count = 0
+
+    def update(self, record):
+        self.batch.append(record)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def update_batch(self, records):
+        for record in records:
+            self.update(record)
+
+    def flush(self):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+
+        columns = get_batch_columns(batch)
+
+        # columns are kept in the order they first appear in, like in a DataFrame
+        for record in batch:
+            for col_name in record:
+                if col_name not in self.columns:
+                    self.columns[col_name] = ColumnState(col_name)
+                    if self.row_count:
+                        # the column is missing from the rows of the previous batches
+                        self.columns[col_name].update([np.nan])
+
+        values = [columns[col_name] if col_name in columns else [np.nan] * len(batch) for col_name in self.columns]
+        if self.max_workers > 1 and len(self.columns) >= PARALLEL_INFERENCE_MIN_COLUMNS:
+            states = self._update_parallel(list(self.columns.values()), values)
+        else:
+            states = update_column_states(list(self.columns.values()), values)
+        self.columns = {state.name: state for state in states}
+        self.row_count += len(batch)
+
+    def _update_parallel(self, states, values):
+        if self.pool is None:
+            # spawn rather than fork, discovery samples tables on threads
+            self.pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+            LOGGER.info('Inferring %s columns on %s processes', len(states), self.max_workers)
+
+        chunk_size = -(-len(states) // (self.max_workers * PARALLEL_INFERENCE_TASKS_PER_WORKER))
+        chunks = range(0, len(states), chunk_size)
+        futures = [self.pool.submit(update_column_states, states[i:i + chunk_size], values[i:i + chunk_size])
+                   for i in chunks]
+        # merged in submission order, so the columns keep their order whichever task finishes first
+        return [state for future in futures for state in future.result()]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    def get_schema(self, string_max_length: bool):
+        self.flush()
+        self.close()
+        schema = {}
+        date_format_map = {} # Stores date formats for any columns that can be interpretted as dates
+        for col_name, state in self.columns.items():
+            datatype = state.get_type(date_format_map) if state.has_non_null else 'string'
+            # Ignore list datatypes (autogenerated if rows have more columns than header row)
+            if datatype != 'list':
+                schema[col_name] = datatype_schema(datatype, state.get_length(), string_max_length)
+
+        return schema, date_format_map
+
+
+def update_column_states(states, values):
+    for state, column in zip(states, values):
+        state.update(column)
+    return states
+
+
+def get_batch_columns(records):
+    keys = list(records[0])
+    if all(list(record) == keys for record in records):
+        # csv rows all have the same columns in the same order, transpose them in one go
+        return dict(zip(keys, map(list, zip(*[record.values() for record in records]))))
+
+    # missing values are NaN, as in a DataFrame
+    columns = {}
+    for record in records:
+        for key in record:
+            if key not in columns:
+                columns[key] = [row.get(key, np.nan) for row in records]
+    return columns
+
+
 def generate_schema(samples, table_spec, string_max_length: bool):
-    df = pd.DataFrame(samples)
-    col_types = {}
-    date_format_map = {} # Stores date formats for any columns that can be interpretted as dates
-    lengths = {} # Stores the maximum length of strings in each column
-    for col_name in df.columns:
-        col_types[col_name] = infer_column(df[col_name], date_format_map, lengths)
-
-    schema = {}
-    for col_name, datatype in col_types.items():
-        # Ignore list datatypes (autogenerated if rows have more columns than header row)
-        if datatype != 'list':
-            schema[col_name] = datatype_schema(datatype, lengths[col_name], string_max_length)
-
-    return schema, date_format_map
+    inferrer = SchemaInferrer()
+    inferrer.update_batch(samples)
+    return inferrer.get_schema(string_max_length)
 
 
 def datatype_schema(datatype, length, string_max_length: bool):
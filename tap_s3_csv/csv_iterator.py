@@ -1,21 +1,25 @@
-import codecs
 import csv
 from tap_s3_csv.symon_exception import SymonException
+from tap_s3_csv import decoding
 import itertools
+import operator
 
 MAX_COL_LENGTH = 150
 
 
-def get_row_iterator(iterable, options=None, fieldnames=None, row_limit=None):
+def get_row_iterator(iterable, options=None, fieldnames=None, row_limit=None, excluded_fields=None):
+    """
+    Returns a csv.DictReader over the file. With excluded_fields (e.g. columns deselected in the catalog), a
+    ProjectedReader is returned instead whose records never hold those columns.
+    """
     options = options or {}
-    iterable_lines = itertools.islice(iterable.iter_lines(), row_limit) if row_limit is not None else iterable.iter_lines()
+    # Lines are decoded and stripped of NULL bytes a block at a time before reaching the DictReader
+    file_stream = decoding.iter_text_lines(iterable, options.get('encoding', 'utf-8'))
+    if row_limit is not None:
+        file_stream = itertools.islice(file_stream, row_limit)
 
-    file_stream = codecs.iterdecode(
-        iterable_lines, encoding=options.get('encoding', 'utf-8'), errors='replace')
-
-    # Replace any NULL bytes in the line given to the DictReader
     reader = csv.DictReader(
-        (line.replace('\0', '') for line in file_stream),
+        file_stream,
         fieldnames=fieldnames,
         delimiter=options.get('delimiter', ','),
         escapechar=options.get('escape_char', '\\'),
@@ -44,9 +48,58 @@ def get_row_iterator(iterable, options=None, fieldnames=None, row_limit=None):
             raise Exception('CSV file missing date_overrides headers: {}, file only contains headers for fields: {}'
                             .format(date_overrides - headers, headers))
 
+    if excluded_fields:
+        selected_fields = [fieldname for fieldname in reader.fieldnames if fieldname not in excluded_fields]
+        # records without any field would be taken for empty lines
+        if selected_fields and len(selected_fields) < len(reader.fieldnames):
+            return ProjectedReader(reader, selected_fields)
+
     return reader
 
 
+class ProjectedReader:
+    """
+    Reads the records of a csv.DictReader restricted to selected_fields. Only the values of the selected columns
+    are taken from each parsed row, records are otherwise the ones the DictReader gives with the other fields
+    removed, including the values of rows longer than the header under the restkey.
+    """
+
+    def __init__(self, reader, selected_fields):
+        self.reader = reader
+        selected_fields = set(selected_fields)
+        self.indices = [index for index, fieldname in enumerate(reader.fieldnames) if fieldname in selected_fields]
+        self.fieldnames = [reader.fieldnames[index] for index in self.indices]
+        self.field_count = len(reader.fieldnames)
+        if len(self.indices) == 1:
+            index = self.indices[0]
+            self.get_values = lambda row: (row[index],)
+        else:
+            self.get_values = operator.itemgetter(*self.indices)
+
+    @property
+    def line_num(self):
+        return self.reader.line_num
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = next(self.reader.reader)
+        # csv.DictReader skips rows of empty lines
+        while row == []:
+            row = next(self.reader.reader)
+
+        row_length = len(row)
+        if row_length == self.field_count:
+            return dict(zip(self.fieldnames, self.get_values(row)))
+
+        record = {fieldname: row[index] if index < row_length else self.reader.restval
+                  for fieldname, index in zip(self.fieldnames, self.indices)}
+        if row_length > self.field_count:
+            record[self.reader.restkey] = row[self.field_count:]
+        return record
+
+
 # truncate headers that are longer than MAX_COL_LENGTH, then handle duplicates
 def truncate_headers(fieldnames):
     # trim white spaces before checking for duplicates.
@@ -0,0 +1,118 @@
+import codecs
+import functools
+import itertools
+import re
+
+# Size of the byte blocks pulled from file handles. Decoding, NUL stripping and line splitting all
+# run once per block in C rather than once per line in Python.
+BLOCK_SIZE = 1024 * 1024
+
+# Only \r\n, \r and \n end a line. str.splitlines would also split on \x0b, \x0c, \x1c-\x1e, \x85,
+# \u2028 and \u2029, which can legitimately appear inside csv fields.
+_TEXT_LINE_END = re.compile(r'\r\n|\r|\n')
+_BYTES_LINE_END = re.compile(rb'\r\n|\r|\n')
+
+
+@functools.lru_cache(maxsize=None)
+def nul_is_single_byte(encoding):
+    # For ascii compatible encodings (utf-8, latin-1, cp1252, shift_jis...) a 0x00 byte is always a NUL
+    # character, so NULs can be dropped from the raw bytes before decoding. In utf-16/utf-32 0x00 bytes
+    # are part of ordinary characters and NULs have to be stripped from the decoded text instead.
+    try:
+        return b'\0'.decode(encoding) == '\0'
+    except UnicodeDecodeError:
+        return False
+
+
+def iter_blocks(file_handle, block_size=BLOCK_SIZE):
+    """
+    Yields raw byte blocks from a file handle. Readable handles (StreamingBody, files extracted from
+    zip/gz) are read directly. Line based sources (GetFileRangeStream, lists of lines) are regrouped
+    into blocks with their line endings restored.
+    """
+    if hasattr(file_handle, 'read'):
+        while True:
+            block = file_handle.read(block_size)
+            if not block:
+                return
+            yield block
+
+    lines = file_handle.iter_lines() if hasattr(file_handle, 'iter_lines') else file_handle
+    batch = []
+    batch_bytes = 0
+    for line in lines:
+        batch.append(line)
+        batch_bytes += len(line)
+        if batch_bytes >= block_size:
+            batch.append(b'')
+            yield b'\n'.join(batch)
+            batch = []
+            batch_bytes = 0
+    if batch:
+        batch.append(b'')
+        yield b'\n'.join(batch)
+
+
+def decode_blocks(blocks, encoding='utf-8'):
+    """
+    Incrementally decodes byte blocks into text blocks with NUL characters removed. Multi-byte
+    characters split across blocks are handled by the incremental decoder.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    strip_bytes = nul_is_single_byte(encoding)
+
+    for block in itertools.chain(blocks, [None]):
+        final = block is None
+        if final:
+            block = b''
+        elif strip_bytes and b'\0' in block:
+            block = block.translate(None, b'\0')
+
+        text = decoder.decode(block, final=final)
+        if not strip_bytes and '\0' in text:
+            text = text.replace('\0', '')
+        if text:
+            yield text
+
+
+def _split_line_batches(blocks):
+    pending = None
+    for block in blocks:
+        if isinstance(block, bytes):
+            line_end, carriage_return = _BYTES_LINE_END, b'\r'
+        else:
+            line_end, carriage_return = _TEXT_LINE_END, '\r'
+
+        if pending:
+            block = pending + block
+
+        # hold back a trailing \r so that a \r\n split across two blocks is treated as one line ending
+        tail = block[:0]
+        if block.endswith(carriage_return):
+            block, tail = block[:-1], carriage_return
+
+        lines = line_end.split(block)
+        pending = lines.pop() + tail
+        if lines:
+            yield lines
+
+    if pending:
+        lines = line_end.split(pending)
+        if not lines[-1]:
+            lines.pop()
+        yield lines
+
+
+def split_lines(blocks):
+    """
+    Splits text or byte blocks into lines without their line endings, matching bytes.splitlines().
+    Lines are produced in lists per block and flattened in C, so there is no per-line Python call.
+    """
+    return itertools.chain.from_iterable(_split_line_batches(blocks))
+
+
+def iter_text_lines(file_handle, encoding='utf-8', block_size=BLOCK_SIZE):
+    # streams that already decode their content (PreprocessStream) hand their lines straight through
+    if getattr(file_handle, 'is_decoded', False):
+        return file_handle.iter_lines()
+    return split_lines(decode_blocks(iter_blocks(file_handle, block_size), encoding))
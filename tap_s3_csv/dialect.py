@@ -8,26 +8,29 @@ import chardet
 import clevercsv
 from clevercsv.dialect import SimpleDialect
 
-from tap_s3_csv import s3, preprocess
+from tap_s3_csv import s3, preprocess, spill
 
 # We started using tap_s3_csv in 3.4 for both s3 and csv imports. Dialect detection
 # is only run for csv imports
 
 LOGGER = singer.get_logger()
 
-def detect_tables_dialect(config):
+def detect_tables_dialect(config, skip_tables=(), cache=None):
     # there is only one table in the array
     for table in config['tables']:
+        # dialect of tables found in the discovery cache is restored from the cache
+        if table['table_name'] in skip_tables:
+            continue
         # set is_csv_connector_import to True for imports from csv connector in Symon
         table['is_csv_connector_import'] = True
         # will return all matching files in s3 with given prefix and table name in config
         s3_files = s3.get_input_files_for_table(config, table)
 
         for s3_file in s3_files:
-            detect_dialect(config, s3_file, table)
+            detect_dialect(config, s3_file, table, cache)
 
 
-def detect_dialect(config, s3_file, table):
+def detect_dialect(config, s3_file, table, cache=None):
     config_delimiter = table.get('delimiter', '')
     config_quotechar = table.get('quotechar', '')
     config_encoding = table.get('encoding', '')
@@ -41,12 +44,20 @@ def detect_dialect(config, s3_file, table):
     if not detect_encoding and not detect_delimiter and not detect_quotechar:
         return
 
+    # the dialect detected for a file is cached by its key and ETag, for the discover and sync runs of an import
+    cache_key = cache.get_dialect_key(config, table, s3_file) if cache else None
+    cached = cache.load_dialect(cache_key) if cache_key else None
+    if cached is not None:
+        LOGGER.info(f"Dialect cache hit for s3file: {s3_file.get('key')}: {cached}")
+        table.update(cached)
+        return
+
     # clevercsv is good but slow - we cap it at 2000 rows, which is 1s of runtime on my machine
     MAX_DIALECT_LINES = 2000
     MAX_ENCODING_LINES = 30000
     MAX_LINES = MAX_ENCODING_LINES if detect_encoding else MAX_DIALECT_LINES
 
-    # max bytes we want to cache in memory
+    # max bytes of lines we want to cache, kept in memory within the memory budget and spilled to disk above it
     MAX_LINES_BYTES = 25 * 1024 ** 2
 
     # max bytes for each line read
@@ -70,38 +81,43 @@ def detect_dialect(config, s3_file, table):
     interesting = []
     interesting_map = {}
 
-    lines = []
+    lines = spill.SpillLines()
     lines_read = 0
 
     file_key = s3_file.get('key')
-    file_handle = s3.get_file_handle(config, file_key)
-    # iterator that handles skip/ignore rows, need it for detecting delimiter, quotechars correctly
-    preprocess_file_handle = preprocess.PreprocessStream(file_handle, table, False)
-    file_iter = preprocess_file_handle.iter_lines()
-    bytes_read = 0
-    for i in range(MAX_LINES):
-        try:
-            line = next(file_iter)
-            line_bytes = len(line)
-
-            if line_bytes >= MAX_LINE_BYTES:
-                raise Exception('Too many bytes in one line')
-
-            lines_read += 1
-            if bytes_read + line_bytes <= MAX_LINES_BYTES:
-                lines.append(line)
-                bytes_read += line_bytes
-
-            if detect_encoding:
-                if len(interesting) < MAX_CHARDET_LINES and (len(interesting) < FIRST_CHARDET_LINES or DETECT_CHARDET_LINE.search(line)):
-                    interesting.append(i)
-
-                #  keep line that is not appended to lines array
-                if bytes_read + line_bytes > MAX_LINES_BYTES:
-                    interesting_map[i] = line
-
-        except StopIteration:
-            break
+    # ranged GETs starting with a small head range that only grows while more lines are needed
+    file_handle = s3.get_file_handle(config, file_key, ranged=True, size=s3_file.get('size'))
+    try:
+        # iterator that handles skip/ignore rows, need it for detecting delimiter, quotechars correctly
+        preprocess_file_handle = preprocess.PreprocessStream(file_handle, table, False, decode=False)
+        file_iter = preprocess_file_handle.iter_lines()
+        bytes_read = 0
+        for i in range(MAX_LINES):
+            try:
+                line = next(file_iter)
+                line_bytes = len(line)
+
+                if line_bytes >= MAX_LINE_BYTES:
+                    raise Exception('Too many bytes in one line')
+
+                lines_read += 1
+                if bytes_read + line_bytes <= MAX_LINES_BYTES:
+                    lines.append(line)
+                    bytes_read += line_bytes
+
+                if detect_encoding:
+                    if len(interesting) < MAX_CHARDET_LINES and (len(interesting) < FIRST_CHARDET_LINES or DETECT_CHARDET_LINE.search(line)):
+                        interesting.append(i)
+
+                    #  keep line that is not appended to lines array
+                    if bytes_read + line_bytes > MAX_LINES_BYTES:
+                        interesting_map[i] = line
+
+            except StopIteration:
+                break
+    finally:
+        # drop the rest of the in-flight range
+        file_handle.close()
 
     if detect_encoding:
         # finish preparing interesting lines - pad with non-interesting lines, keep original file order
@@ -216,3 +232,9 @@ def detect_dialect(config, s3_file, table):
             table['quotechar'] = quotechar
 
         LOGGER.info(f"Detected delimiter: {delimiter} and quotechar: {quotechar} for s3file: {file_key}")
+
+    lines.close()
+
+    if cache_key:
+        detected = [('encoding', detect_encoding), ('delimiter', detect_delimiter), ('quotechar', detect_quotechar)]
+        cache.save_dialect(cache_key, {name: table[name] for name, is_detected in detected if is_detected})
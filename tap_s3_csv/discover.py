@@ -1,15 +1,35 @@
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from singer import metadata
 from tap_s3_csv import s3
 
+# Number of tables that are discovered at the same time
+DISCOVER_TABLE_WORKERS = 4
 
-def discover_streams(config):
-    streams = []
 
-    for table_spec in config['tables']:
-        schema, date_format_map = discover_schema(config, table_spec)
-        streams.append({'stream': table_spec['table_name'], 'tap_stream_id': table_spec['table_name'], 'schema': schema, 'metadata': load_metadata(
-            table_spec, schema), 'column_date_format': date_format_map, 'column_order': [str(column) for column in schema['properties']]})
-    return streams
+def discover_streams(config, cache=None):
+    executor = ThreadPoolExecutor(max_workers=config.get('discover_max_workers', DISCOVER_TABLE_WORKERS))
+    try:
+        # tables are discovered concurrently, map keeps the streams in the order of the tables in the config
+        return list(executor.map(functools.partial(discover_stream, config, cache=cache), config['tables']))
+    finally:
+        # stop discovering the remaining tables once one of them failed
+        executor.shutdown(cancel_futures=True)
+
+
+def discover_stream(config, table_spec, cache=None):
+    if cache is not None:
+        stream = cache.get_stream(table_spec)
+        if stream is not None:
+            return stream
+
+    schema, date_format_map = discover_schema(config, table_spec)
+    stream = {'stream': table_spec['table_name'], 'tap_stream_id': table_spec['table_name'], 'schema': schema, 'metadata': load_metadata(
+        table_spec, schema), 'column_date_format': date_format_map, 'column_order': [str(column) for column in schema['properties']]}
+
+    if cache is not None:
+        cache.save_stream(table_spec, stream)
+    return stream
 
 
 def discover_schema(config, table_spec):
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import boto3
+import singer
+from botocore.exceptions import ClientError
+
+from tap_s3_csv import s3
+
+LOGGER = singer.get_logger()
+
+# Bump when the cached entry format or the discovery output changes, so entries of older versions are not used
+CACHE_VERSION = 1
+
+# table_spec keys set by dialect detection, restored from the cache on a hit
+DETECTED_TABLE_KEYS = ['encoding', 'delimiter', 'quotechar', 'is_csv_connector_import']
+
+# table_spec keys used to detect the dialect of a file, part of its dialect entry key
+DIALECT_OPTION_KEYS = ['encoding', 'delimiter', 'quotechar', 'skip_header_row', 'skip_footer_row']
+
+# config keys that change the discovered schema
+SCHEMA_CONFIG_KEYS = ['sampling_strategy', 'sample_max_records', 'sample_max_files', 'sample_probe_count',
+                      'sample_probe_bytes', 'string_max_length']
+
+
+def get_discovery_cache(config):
+    location = config.get('discovery_cache_path')
+    if not location:
+        return None
+    return DiscoveryCache(location, config.get('discovery_cache_invalidate', False))
+
+
+def _json_default(value):
+    # numpy scalars (e.g. maxLength) are stored as plain numbers
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+class DiscoveryCache:
+    """
+    Caches the discovered stream and the detected dialect of each table in a local directory or under an S3 prefix
+    (s3://bucket/prefix). Entries are keyed by the table_spec as configured, the config options that change the
+    schema and the bucket, key, ETag and size of every file matching the table, so any change to the files or to
+    the options is a miss.
+
+    The dialect detected for each file is also cached on its own, keyed by the bucket, key, ETag and size of the
+    file and the dialect options of the table, so that the sync run of an import skips detection as well.
+    """
+
+    def __init__(self, location, invalidate=False):
+        self.location = location
+        self.invalidate = invalidate
+        self.keys = {}
+        self.entries = {}
+
+    def load_tables(self, config):
+        """
+        Looks up every table of the config before dialect detection and restores the detected dialect of the
+        tables that are found. Returns the names of those tables.
+        """
+        for table_spec in config['tables']:
+            table_name = table_spec['table_name']
+            key = self.get_key(config, table_spec)
+            self.keys[table_name] = key
+
+            if self.invalidate:
+                LOGGER.info('Discovery cache invalidated for table "%s" (%s)', table_name, key)
+                continue
+
+            entry = self._read(key)
+            if entry is None or entry.get('version') != CACHE_VERSION:
+                LOGGER.info('Discovery cache miss for table "%s" (%s)', table_name, key)
+                continue
+
+            LOGGER.info('Discovery cache hit for table "%s" (%s)', table_name, key)
+            table_spec.update(entry['table'])
+            self.entries[table_name] = entry
+
+        return set(self.entries)
+
+    def get_stream(self, table_spec):
+        entry = self.entries.get(table_spec['table_name'])
+        return entry['stream'] if entry else None
+
+    def save_stream(self, table_spec, stream):
+        key = self.keys.get(table_spec['table_name'])
+        if key is None or table_spec['table_name'] in self.entries:
+            return
+        entry = {
+            'version': CACHE_VERSION,
+            'stream': stream,
+            'table': {name: table_spec[name] for name in DETECTED_TABLE_KEYS if name in table_spec},
+        }
+        self._write(key, json.dumps(entry, default=_json_default))
+
+    @staticmethod
+    def get_dialect_key(config, table_spec, s3_file):
+        # without an ETag a changed file could not be told apart
+        if not s3_file.get('etag'):
+            return None
+        key_data = {
+            'version': CACHE_VERSION,
+            'bucket': config['bucket'],
+            'file': [s3_file['key'], s3_file['etag'], s3_file.get('size')],
+            'options': {name: table_spec[name] for name in DIALECT_OPTION_KEYS if name in table_spec},
+        }
+        digest = hashlib.sha256(json.dumps(key_data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        return f'dialect-{digest}'
+
+    def load_dialect(self, key):
+        if self.invalidate:
+            return None
+        entry = self._read(key)
+        if entry is None or entry.get('version') != CACHE_VERSION:
+            return None
+        return entry['table']
+
+    def save_dialect(self, key, detected):
+        self._write(key, json.dumps({'version': CACHE_VERSION, 'table': detected}))
+
+    @staticmethod
+    def get_key(config, table_spec):
+        files = [[s3_file['key'], s3_file.get('etag'), s3_file.get('size')]
+                 for s3_file in s3.get_input_files_for_table(config, table_spec)]
+        key_data = {
+            'version': CACHE_VERSION,
+            'bucket': config['bucket'],
+            'table': table_spec,
+            'config': {name: config[name] for name in SCHEMA_CONFIG_KEYS if name in config},
+            'files': files,
+        }
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def _read(self, key):
+        try:
+            if self.location.startswith('s3://'):
+                bucket, prefix = self._split_s3_location()
+                try:
+                    body = boto3.client('s3').get_object(Bucket=bucket, Key=f'{prefix}{key}.json')['Body'].read()
+                except ClientError as err:
+                    if err.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                        return None
+                    raise
+                return json.loads(body)
+
+            path = os.path.join(self.location, f'{key}.json')
+            if not os.path.exists(path):
+                return None
+            with open(path, 'r', encoding='utf-8') as cache_file:
+                return json.load(cache_file)
+        except Exception as err:
+            # the cache is only an optimization, discovery runs as usual when it cannot be read
+            LOGGER.warning('Failed to read discovery cache entry %s: %s', key, err)
+            return None
+
+    def _write(self, key, body):
+        try:
+            if self.location.startswith('s3://'):
+                bucket, prefix = self._split_s3_location()
+                boto3.client('s3').put_object(Bucket=bucket, Key=f'{prefix}{key}.json', Body=body,
+                                              ContentType='application/json')
+                return
+
+            os.makedirs(self.location, exist_ok=True)
+            # write to a temporary file first so concurrent runs never read a partial entry
+            with tempfile.NamedTemporaryFile('w', dir=self.location, suffix='.tmp', delete=False,
+                                             encoding='utf-8') as cache_file:
+                cache_file.write(body)
+            os.replace(cache_file.name, os.path.join(self.location, f'{key}.json'))
+        except Exception as err:
+            LOGGER.warning('Failed to write discovery cache entry %s: %s', key, err)
+
+    def _split_s3_location(self):
+        bucket, _, prefix = self.location[len('s3://'):].partition('/')
+        if prefix and not prefix.endswith('/'):
+            prefix += '/'
+        return bucket, prefix
@@ -0,0 +1,102 @@
+import os
+import time
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# Bump when the encoding of the manifest bookmark changes; manifests of other versions are ignored
+MANIFEST_VERSION = 1
+
+COMPLETED = 'c'
+PARTIAL = 'p'
+
+# With 100k+ files a manifest is a few MB of state, so it is written at most every STATE_INTERVAL_SECONDS while a
+# table is synced, and once more when the table is done. Files completed since the last write are synced again if
+# the run fails.
+STATE_INTERVAL_SECONDS = 10
+
+
+def get_etag(s3_file):
+    return (s3_file.get('etag') or '').strip('"')
+
+
+def encode_keys(keys):
+    """
+    Front codes sorted keys: the length of the prefix each key shares with the key before it, and the rest of it.
+    """
+    prefix_lengths = []
+    suffixes = []
+    previous = ''
+    for key in keys:
+        length = len(os.path.commonprefix([previous, key]))
+        prefix_lengths.append(length)
+        suffixes.append(key[length:])
+        previous = key
+    return prefix_lengths, suffixes
+
+
+def decode_keys(prefix_lengths, suffixes):
+    keys = []
+    previous = ''
+    for length, suffix in zip(prefix_lengths, suffixes):
+        previous = previous[:length] + suffix
+        keys.append(previous)
+    return keys
+
+
+class FileManifest:
+    """
+    ETag, size and sync status of every file of a table, kept in the 'files' bookmark of the table. A file whose
+    ETag and size match a completed entry is skipped; partially synced, changed and new files are synced.
+    """
+
+    def __init__(self, entries=None):
+        # key -> (etag, size, status)
+        self.entries = entries if entries is not None else {}
+        self.last_write = time.monotonic()
+
+    @classmethod
+    def from_bookmark(cls, bookmark):
+        if not bookmark:
+            return cls()
+        if bookmark.get('version') != MANIFEST_VERSION:
+            LOGGER.warning('Ignoring file manifest of version %s', bookmark.get('version'))
+            return cls()
+        keys = decode_keys(bookmark['key_prefix_lengths'], bookmark['key_suffixes'])
+        return cls(dict(zip(keys, zip(bookmark['etags'], bookmark['sizes'], bookmark['statuses']))))
+
+    def to_bookmark(self):
+        keys = sorted(self.entries)
+        prefix_lengths, suffixes = encode_keys(keys)
+        entries = [self.entries[key] for key in keys]
+        self.last_write = time.monotonic()
+        return {
+            'version': MANIFEST_VERSION,
+            'key_prefix_lengths': prefix_lengths,
+            'key_suffixes': suffixes,
+            'etags': [etag for etag, _, _ in entries],
+            'sizes': [size for _, size, _ in entries],
+            # one character per file
+            'statuses': ''.join(status for _, _, status in entries),
+        }
+
+    def __len__(self):
+        return len(self.entries)
+
+    def is_synced(self, s3_file):
+        return self.entries.get(s3_file['key']) == (get_etag(s3_file), s3_file.get('size'), COMPLETED)
+
+    def start(self, s3_file):
+        self.entries[s3_file['key']] = (get_etag(s3_file), s3_file.get('size'), PARTIAL)
+
+    def complete(self, s3_file):
+        self.entries[s3_file['key']] = (get_etag(s3_file), s3_file.get('size'), COMPLETED)
+
+    def retain(self, keys):
+        # files that don't match the table anymore are dropped
+        keys = set(keys)
+        self.entries = {key: entry for key, entry in self.entries.items() if key in keys}
+
+    def is_write_due(self):
+        return time.monotonic() - self.last_write >= STATE_INTERVAL_SECONDS
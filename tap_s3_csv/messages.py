@@ -1,4 +1,16 @@
+import codecs
+import contextlib
+import functools
+import gzip
+import os
+import pathlib
+import queue
+import re
 import sys
+import tempfile
+import threading
+import time
+import uuid
 
 import pytz
 import simplejson as json
@@ -8,8 +20,33 @@ import ciso8601
 import singer.utils as u
 import singer
 
+from tap_s3_csv import arrow_output, output_compression
+from tap_s3_csv.symon_exception import SymonException
+from tap_s3_csv.utils import IMPORT_PERF_METRICS_LOG_PREFIX
+
 LOGGER = singer.get_logger()
 
+# During sync, serialized messages are written by a background thread. It takes them from a queue of at most
+# WRITER_QUEUE_SIZE items, and writes them in chunks of WRITER_FLUSH_BYTES, or whatever it has after
+# WRITER_FLUSH_SECONDS.
+WRITER_QUEUE_SIZE = 64
+WRITER_FLUSH_BYTES = 1024 * 1024
+WRITER_FLUSH_SECONDS = 1.0
+
+# With output_mode 'batch', records are staged in gzip compressed jsonl files announced by BATCH messages. A file is
+# closed once it holds BATCH_MAX_ROWS records or BATCH_MAX_BYTES uncompressed bytes, or before any other message.
+BATCH_MAX_ROWS = 1000000
+BATCH_MAX_BYTES = 256 * 1024 * 1024
+BATCH_COMPRESS_LEVEL = 6
+
+_writer = None
+_batch_stager = None
+_output = None
+
+# Streams synced in parallel write from several threads. Writing to the output directly and staging records are
+# serialized, the background writer queue is thread safe on its own.
+_write_lock = threading.RLock()
+
 
 class Message():
     '''Base class for messages.'''
@@ -128,6 +165,32 @@ class StateMessage(Message):
         }
 
 
+class BatchMessage(Message):
+    '''BATCH message.
+    The BATCH message has these fields:
+      * stream (string) - The name of the stream the records belong to.
+      * encoding (dict) - The format and compression of the files.
+      * manifest (list of strings) - URIs of the files holding the records, one record per line.
+    msg = BatchMessage(
+        stream='users',
+        encoding={'format': 'jsonl', 'compression': 'gzip'},
+        manifest=['file:///tmp/users-1.jsonl.gz'])
+    '''
+
+    def __init__(self, stream, encoding, manifest):
+        self.stream = stream
+        self.encoding = encoding
+        self.manifest = manifest
+
+    def asdict(self):
+        return {
+            'type': 'BATCH',
+            'stream': self.stream,
+            'encoding': self.encoding,
+            'manifest': self.manifest
+        }
+
+
 class ActivateVersionMessage(Message):
     '''ACTIVATE_VERSION message (EXPERIMENTAL).
     The ACTIVATE_VERSION messages has these fields:
@@ -210,14 +273,23 @@ def parse_message(msg):
 
 def format_message(message, json_lib='simple'):
     if json_lib == 'orjson':
-        return orjson.dumps(message.asdict()).decode('utf-8')
+        try:
+            return orjson.dumps(message.asdict()).decode('utf-8')
+        except orjson.JSONEncodeError:
+            return json.dumps(message.asdict(), use_decimal=True)
     else:
         return json.dumps(message.asdict(), use_decimal=True)
 
 
 def write_message(message, json_lib='simple'):
-    sys.stdout.write(f'{format_message(message, json_lib)}\n')
-    sys.stdout.flush()
+    data = f'{format_message(message, json_lib)}\n'.encode('utf-8')
+    if _batch_stager is not None:
+        with _write_lock:
+            # records staged before the message have to be announced first
+            _batch_stager.flush()
+            write_bytes(data)
+        return
+    write_bytes(data)
 
 
 def record_message(stream_name, record, stream_alias=None, time_extracted=None):
@@ -232,16 +304,331 @@ def write_record(stream_name, record, stream_alias=None, time_extracted=None, js
     write_message(message, json_lib)
 
 
+@functools.lru_cache(maxsize=None)
+def get_record_envelope(stream_name, json_lib='simple'):
+    """
+    Returns the bytes format_message writes before and after the record of a RECORD message of the stream, so
+    only the records themselves have to be serialized.
+    """
+    if json_lib == 'orjson':
+        return b'{"type":"RECORD","stream":' + orjson.dumps(stream_name) + b',"record":', b'}\n'
+    prefix = '{"type": "RECORD", "stream": ' + json.dumps(stream_name) + ', "record": '
+    return prefix.encode('utf-8'), b'}\n'
+
+
+_SIMPLEJSON_ENCODER = json.JSONEncoder(use_decimal=True)
+
+
+def serialize_records(stream_name, records, json_lib='simple'):
+    """
+    Serializes the RECORD messages of records into one bytes buffer, byte for byte the lines write_message writes.
+    """
+    if not records:
+        return b''
+    prefix, suffix = get_record_envelope(stream_name, json_lib)
+    if json_lib == 'orjson':
+        try:
+            return prefix + (suffix + prefix).join(map(orjson.dumps, records)) + suffix
+        except orjson.JSONEncodeError:
+            # orjson rejects ints outside of 64 bits (kept exact when jsonl lines are parsed), the batch is
+            # serialized by simplejson instead
+            return serialize_records(stream_name, records)
+    # simplejson escapes non ascii characters, the lines are ascii
+    separator = (suffix + prefix).decode('utf-8')
+    return prefix + separator.join(map(_SIMPLEJSON_ENCODER.encode, records)).encode('utf-8') + suffix
+
+
+def get_stdout_buffer():
+    # the file the output is redirected to, or the binary buffer of stdout when bytes can be written to it as
+    # utf-8 text
+    if _output is not None:
+        return _output
+    buffer = getattr(sys.stdout, 'buffer', None)
+    encoding = getattr(sys.stdout, 'encoding', None)
+    if buffer is None or not encoding or codecs.lookup(encoding).name != 'utf-8':
+        return None
+    return buffer
+
+
+def write_bytes(data):
+    if _writer is not None:
+        _writer.write(data)
+        return
+
+    with _write_lock:
+        # messages written as text before have to reach stdout first
+        sys.stdout.flush()
+        buffer = get_stdout_buffer()
+        if buffer is None:
+            sys.stdout.write(data.decode('utf-8'))
+            sys.stdout.flush()
+            return
+        buffer.write(data)
+        buffer.flush()
+
+
+class BackgroundWriter:
+    """
+    Writes serialized messages to a binary stream on a separate thread, so parsing and transforming go on while
+    the target is reading. Messages are written in the order they are queued. Time spent writing to the stream
+    (waiting on the target) and time spent waiting on a full queue (waiting on the writer) are both recorded.
+    """
+
+    def __init__(self, stream, queue_size=WRITER_QUEUE_SIZE, flush_bytes=WRITER_FLUSH_BYTES,
+                 flush_seconds=WRITER_FLUSH_SECONDS):
+        self.stream = stream
+        self.queue = queue.Queue(queue_size)
+        self.flush_bytes = flush_bytes
+        self.flush_seconds = flush_seconds
+        self.bytes_written = 0
+        self.writes = 0
+        self.write_blocked_seconds = 0.0
+        self.queue_blocked_seconds = 0.0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name='output-writer', daemon=True)
+        self.thread.start()
+
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        try:
+            self.queue.put_nowait(data)
+        except queue.Full:
+            start = time.perf_counter()
+            self.queue.put(data)
+            self.queue_blocked_seconds += time.perf_counter() - start
+
+    def close(self):
+        # None tells the writer to write what it has left and stop
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        pending = []
+        pending_bytes = 0
+        deadline = None
+        while True:
+            try:
+                data = self.queue.get(timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                data = b''
+
+            if data:
+                pending.append(data)
+                pending_bytes += len(data)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_seconds
+
+            if pending and (data is None or pending_bytes >= self.flush_bytes or time.monotonic() >= deadline):
+                self._write(b''.join(pending))
+                pending = []
+                pending_bytes = 0
+                deadline = None
+
+            if data is None:
+                return
+
+    def _write(self, data):
+        if self.error is not None:
+            # the output is broken, the rest is dropped so the producer never blocks on a full queue
+            return
+        start = time.perf_counter()
+        try:
+            self.stream.write(data)
+            self.stream.flush()
+        except BaseException as err:
+            self.error = err
+            return
+        self.write_blocked_seconds += time.perf_counter() - start
+        self.bytes_written += len(data)
+        self.writes += 1
+
+    def get_metrics(self):
+        return {
+            'output_bytes': self.bytes_written,
+            'output_writes': self.writes,
+            'output_write_blocked_seconds': round(self.write_blocked_seconds, 3),
+            'output_queue_blocked_seconds': round(self.queue_blocked_seconds, 3),
+        }
+
+
+@contextlib.contextmanager
+def background_writer(enabled=True):
+    """
+    Writes the messages of the block on a BackgroundWriter over stdout and logs its metrics at the end. Messages
+    are written directly when disabled or when stdout has no utf-8 binary buffer.
+    """
+    global _writer  # pylint: disable=global-statement
+    buffer = get_stdout_buffer() if enabled else None
+    if buffer is None:
+        yield
+        return
+
+    sys.stdout.flush()
+    writer = _writer = BackgroundWriter(buffer)
+    try:
+        yield
+    except BaseException:
+        _writer = None
+        try:
+            writer.close()
+        except BaseException as err:
+            LOGGER.warning('Failed to write output: %s', err)
+        raise
+    _writer = None
+    writer.close()
+    LOGGER.info('%s %s', IMPORT_PERF_METRICS_LOG_PREFIX, json.dumps(writer.get_metrics()))
+
+
 def write_records(stream_name, records, json_lib='simple'):
     """Write a list of records for the given stream.
     chris = {"id": 1, "email": "chris@stitchdata.com"}
     mike = {"id": 2, "email": "mike@stitchdata.com"}
     write_records("users", [chris, mike])
     """
-    for r in records:
-        message = record_message(stream_name, r)
-        sys.stdout.write(f'{format_message(message, json_lib)}\n')
+    if _batch_stager is not None:
+        with _write_lock:
+            _batch_stager.add(stream_name, records, json_lib)
+        return
+    write_bytes(serialize_records(stream_name, records, json_lib))
+
+
+def serialize_batch_lines(records, json_lib='simple'):
+    # the record alone on each line, serialized the same way as in the RECORD messages
+    if json_lib == 'orjson':
+        try:
+            return b'\n'.join(map(orjson.dumps, records)) + b'\n'
+        except orjson.JSONEncodeError:
+            return serialize_batch_lines(records)
+    return ('\n'.join(map(_SIMPLEJSON_ENCODER.encode, records)) + '\n').encode('utf-8')
+
+
+class BatchStager:
+    """
+    Stages the records of each stream in local gzip compressed jsonl files and writes a BATCH message for each
+    file once it is closed, so targets can load whole files instead of parsing RECORD messages.
+    """
+    encoding = {'format': 'jsonl', 'compression': 'gzip'}
+
+    def __init__(self, root, max_rows=BATCH_MAX_ROWS, max_bytes=BATCH_MAX_BYTES):
+        self.root = root
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        # stream name: [path, gzip file, rows, uncompressed bytes]
+        self.files = {}
+        os.makedirs(root, exist_ok=True)
+
+    def add(self, stream_name, records, json_lib='simple'):
+        if not records:
+            return
+        if stream_name not in self.files:
+            file_name = f"{re.sub(r'[^A-Za-z0-9_.-]', '_', stream_name)}-{uuid.uuid4().hex}.jsonl.gz"
+            path = os.path.join(self.root, file_name)
+            self.files[stream_name] = [path, gzip.open(path, 'wb', compresslevel=BATCH_COMPRESS_LEVEL), 0, 0]
+
+        staged = self.files[stream_name]
+        data = serialize_batch_lines(records, json_lib)
+        staged[1].write(data)
+        staged[2] += len(records)
+        staged[3] += len(data)
+        if staged[2] >= self.max_rows or staged[3] >= self.max_bytes:
+            self._close(stream_name)
+
+    def set_schema(self, stream_name, schema):
+        # the SCHEMA message is written as usual, the files only hold the records
+        pass
+
+    def flush(self):
+        for stream_name in list(self.files):
+            self._close(stream_name)
+
+    def discard(self):
+        for path, batch_file, _, _ in self.files.values():
+            batch_file.close()
+            os.remove(path)
+        self.files.clear()
+
+    def _close(self, stream_name):
+        path, batch_file, _, _ = self.files.pop(stream_name)
+        batch_file.close()
+        message = BatchMessage(stream_name, self.encoding, [pathlib.Path(path).absolute().as_uri()])
+        write_bytes(f'{format_message(message)}\n'.encode('utf-8'))
+
+
+@contextlib.contextmanager
+def batch_output(config):
+    """
+    Stages the records written in the block when the output_mode config is 'batch' (batch files under batch_root,
+    a temporary directory by default) or 'arrow' (Arrow IPC streams written between the other messages).
+    """
+    global _batch_stager  # pylint: disable=global-statement
+    output_mode = config.get('output_mode', 'records')
+    if output_mode == 'batch':
+        root = config.get('batch_root') or tempfile.mkdtemp(prefix='tap-s3-csv-batches-')
+        stager = BatchStager(
+            root, config.get('batch_max_rows', BATCH_MAX_ROWS), config.get('batch_max_bytes', BATCH_MAX_BYTES))
+        LOGGER.info('Staging records in batch files under %s', root)
+    elif output_mode == 'arrow':
+        if _writer is None and get_stdout_buffer() is None:
+            raise SymonException('The arrow output mode needs a binary output, set output_path or use a utf-8 stdout.',
+                                 'ArrowOutputUnavailable')
+        stager = arrow_output.ArrowStager(write_bytes, config.get('arrow_batch_rows', arrow_output.ARROW_BATCH_ROWS))
+    else:
+        yield
+        return
+
+    _batch_stager = stager
+    try:
+        yield
+    except BaseException:
+        _batch_stager = None
+        stager.discard()
+        raise
+    _batch_stager = None
+    stager.flush()
+
+
+@contextlib.contextmanager
+def compressed_output(compression, level=None):
+    """
+    Compresses the messages of the block with gzip or zstd. The compressed stream is flushed whenever the output
+    is flushed, after every chunk of the background writer, so the target never waits long for the messages.
+    """
+    global _output  # pylint: disable=global-statement
+    if not compression:
+        yield
+        return
+
     sys.stdout.flush()
+    output = output_compression.CompressedOutput(_output or sys.stdout.buffer, compression, level)
+    previous, _output = _output, output
+    try:
+        yield
+    finally:
+        _output = previous
+        # the frame is ended even when the sync failed, so what was written can be decoded
+        output.close()
+    LOGGER.info('%s %s', IMPORT_PERF_METRICS_LOG_PREFIX, json.dumps(output.get_metrics()))
+
+
+@contextlib.contextmanager
+def redirect_output(path):
+    """
+    Writes the messages of the block to the file or named pipe at path instead of stdout.
+    """
+    global _output  # pylint: disable=global-statement
+    if not path:
+        yield
+        return
+
+    with open(path, 'wb') as output:
+        _output = output
+        try:
+            yield
+        finally:
+            _output = None
 
 
 def write_schema(stream_name, schema, key_properties, bookmark_properties=None, stream_alias=None):
@@ -262,6 +649,9 @@ def write_schema(stream_name, schema, key_properties, bookmark_properties=None,
             schema=schema,
             key_properties=key_properties,
             bookmark_properties=bookmark_properties))
+    if _batch_stager is not None:
+        with _write_lock:
+            _batch_stager.set_schema(stream_alias or stream_name, schema)
 
 
 def write_state(value):
@@ -0,0 +1,107 @@
+import sys
+import zlib
+
+from tap_s3_csv.symon_exception import SymonException
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# The output is a single gzip member or zstd frame, flushed (Z_SYNC_FLUSH / zstd block flush) every time the
+# output is flushed, so everything written so far can be decoded by gzip -dc / zstd -dc or decompress() below.
+# gzip level 1 compresses csv derived records almost as well as level 6 at less than half the CPU time
+COMPRESSION_LEVELS = {'gzip': 1, 'zstd': 3}
+
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+READ_SIZE = 64 * 1024
+
+
+def _check_compression(compression):
+    if compression not in COMPRESSION_LEVELS:
+        raise SymonException(f'Unsupported output compression "{compression}", use gzip or zstd.',
+                             'UnsupportedOutputCompression')
+    if compression == 'zstd' and zstandard is None:
+        raise SymonException('zstd output compression requires the zstandard package to be installed.',
+                             'UnsupportedOutputCompression')
+
+
+class CompressedOutput:
+    """
+    Binary file object compressing everything written to it into stream. Data is only guaranteed to reach
+    stream on flush(), which ends the current compressed block; close() ends the gzip member / zstd frame.
+    """
+
+    def __init__(self, stream, compression, level=None):
+        _check_compression(compression)
+        self.stream = stream
+        self.compression = compression
+        level = COMPRESSION_LEVELS[compression] if level is None else level
+        if compression == 'gzip':
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+            self.flush_mode = zlib.Z_SYNC_FLUSH
+            self.finish_mode = zlib.Z_FINISH
+        else:
+            self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+            self.flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+            self.finish_mode = zstandard.COMPRESSOBJ_FLUSH_FINISH
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def write(self, data):
+        self.bytes_in += len(data)
+        self._write(self.compressor.compress(data))
+        return len(data)
+
+    def flush(self):
+        self._write(self.compressor.flush(self.flush_mode))
+        self.stream.flush()
+
+    def close(self):
+        self._write(self.compressor.flush(self.finish_mode))
+        self.stream.flush()
+
+    def _write(self, data):
+        if data:
+            self.stream.write(data)
+            self.bytes_out += len(data)
+
+    def get_metrics(self):
+        return {
+            'output_compression': self.compression,
+            'output_uncompressed_bytes': self.bytes_in,
+            'output_compressed_bytes': self.bytes_out,
+        }
+
+
+def _get_decompressor(compression):
+    if compression == 'gzip':
+        return zlib.decompressobj(GZIP_WBITS)
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+def decompress(input_stream, output_stream, compression):
+    """
+    Decompresses the output of the tap from input_stream to output_stream as it arrives: every flushed block is
+    written out as soon as it is read. Concatenated gzip members / zstd frames are decoded one after the other.
+    """
+    _check_compression(compression)
+    read = getattr(input_stream, 'read1', input_stream.read)
+    decompressor = _get_decompressor(compression)
+    while True:
+        data = read(READ_SIZE)
+        if not data:
+            return
+        while data:
+            output_stream.write(decompressor.decompress(data))
+            data = b''
+            if decompressor.eof:
+                data = decompressor.unused_data
+                decompressor = _get_decompressor(compression)
+        output_stream.flush()
+
+
+if __name__ == '__main__':
+    # python -m tap_s3_csv.output_compression gzip|zstd < compressed > messages
+    decompress(sys.stdin.buffer, sys.stdout.buffer, sys.argv[1])
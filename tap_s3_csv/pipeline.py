@@ -0,0 +1,278 @@
+import collections
+import itertools
+import multiprocessing
+import pickle
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import simplejson as json
+import singer
+
+from tap_s3_csv import decoding
+from tap_s3_csv.utils import IMPORT_PERF_METRICS_LOG_PREFIX
+
+LOGGER = singer.get_logger()
+
+# A file is synced in stages joined by bounded queues: a download thread reads the S3 body ahead into up to
+# PREFETCH_BLOCKS blocks, rows are decoded, parsed and transformed in batches (on worker processes with
+# sync_transform_workers), and messages are written by the background writer. A full queue blocks the stage
+# before it, so no stage runs more than a few blocks or batches ahead of the next one.
+PREFETCH_BLOCKS = 4
+
+# Batches of rows handed to each transform worker at a time
+TRANSFORM_BATCHES_PER_WORKER = 2
+
+# Starting a spawned worker process takes about a second, so the worker processes are started once per run and
+# transform the batches of every file. Each worker keeps the row transformers of the last TRANSFORMERS_PER_WORKER
+# files it transformed batches of, one is built again if it was dropped while its file is still synced.
+TRANSFORMERS_PER_WORKER = 8
+
+STAGES = ['download', 'parse', 'transform', 'write']
+
+
+class PipelineMetrics:
+    """
+    Time each stage of a file sync spends working and waiting on the stage before it (starved) or after it
+    (blocked), reported as the share of the wall time of the file each stage was busy.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.busy_seconds = dict.fromkeys(STAGES, 0.0)
+        self.starved_seconds = dict.fromkeys(STAGES, 0.0)
+        self.blocked_seconds = dict.fromkeys(STAGES, 0.0)
+
+    def log(self, s3_path, rows):
+        wall_seconds = time.perf_counter() - self.start
+        stages = {}
+        for stage in STAGES:
+            busy_seconds = self.busy_seconds[stage]
+            stages[stage] = {
+                'busy_seconds': round(busy_seconds, 3),
+                'starved_seconds': round(self.starved_seconds[stage], 3),
+                'blocked_seconds': round(self.blocked_seconds[stage], 3),
+                'utilization': round(busy_seconds / wall_seconds, 3) if wall_seconds else 0.0,
+            }
+        LOGGER.info('%s %s', IMPORT_PERF_METRICS_LOG_PREFIX, json.dumps(
+            {'file': s3_path, 'rows': rows, 'wall_seconds': round(wall_seconds, 3), 'stages': stages}))
+
+
+class PrefetchReader:
+    """
+    Reads a file handle ahead on a download thread, so waiting on the network overlaps with parsing. Blocks are
+    handed over through a queue of queue_size blocks; reads made by the parse stage while the queue is empty are
+    recorded as parse starved time, and the download blocked on a full queue as download blocked time.
+    """
+
+    def __init__(self, file_handle, metrics, queue_size=PREFETCH_BLOCKS, block_size=decoding.BLOCK_SIZE):
+        self.file_handle = file_handle
+        self.metrics = metrics
+        self.block_size = block_size
+        self.queue = queue.Queue(queue_size)
+        self.stopped = threading.Event()
+        self.buffer = b''
+        self.eof = False
+        self.thread = threading.Thread(target=self._run, name='download', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            while not self.stopped.is_set():
+                start = time.perf_counter()
+                block = self.file_handle.read(self.block_size)
+                self.metrics.busy_seconds['download'] += time.perf_counter() - start
+                self._put(block)
+                if not block:
+                    return
+        except BaseException as err:  # pylint: disable=broad-except
+            # raised to the reader on its next read
+            self._put(err)
+
+    def _put(self, item):
+        start = time.perf_counter()
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self.metrics.blocked_seconds['download'] += time.perf_counter() - start
+
+    def _next_block(self):
+        try:
+            block = self.queue.get_nowait()
+        except queue.Empty:
+            start = time.perf_counter()
+            block = self.queue.get()
+            self.metrics.starved_seconds['parse'] += time.perf_counter() - start
+        if isinstance(block, BaseException):
+            self.eof = True
+            raise block
+        if not block:
+            self.eof = True
+        return block
+
+    def read(self, size=-1):
+        if not self.buffer and not self.eof:
+            self.buffer = self._next_block()
+        if size is None or size < 0:
+            blocks = [self.buffer]
+            while not self.eof:
+                blocks.append(self._next_block())
+            self.buffer = b''
+            return b''.join(blocks)
+        if size >= len(self.buffer):
+            data, self.buffer = self.buffer, b''
+            return data
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def __iter__(self):
+        # jsonl files are iterated by line
+        return decoding.split_lines(decoding.iter_blocks(self))
+
+    def close(self):
+        self.stopped.set()
+        # unblock the download thread if it waits on a full queue
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.thread.join()
+
+
+def iter_batches(rows, batch_size, metrics):
+    """
+    Groups the non empty rows of the parse stage in batches of batch_size rows.
+    """
+    rows = iter(rows)
+    busy_seconds = metrics.busy_seconds
+    starved_seconds = metrics.starved_seconds
+    while True:
+        start = time.perf_counter()
+        starved = starved_seconds['parse']
+        batch = []
+        for row in rows:
+            # Skipping the empty rows
+            if len(row) == 0:
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                break
+        # time spent waiting on the download is not parsing
+        busy_seconds['parse'] += time.perf_counter() - start - (starved_seconds['parse'] - starved)
+        if not batch:
+            return
+        yield batch
+
+
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+# stage id -> (row transformer, transform plan), in the worker processes
+_worker_transforms = collections.OrderedDict()
+
+_stage_ids = itertools.count()
+
+
+def get_transform_executor(workers):
+    """
+    Process pool of the given number of workers shared by the transform stages of the run.
+    """
+    global _executor, _executor_workers  # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is not None and _executor_workers != workers:
+            _executor.shutdown(cancel_futures=True)
+            _executor = None
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _executor_workers = workers
+        return _executor
+
+
+def shutdown_transform_workers():
+    global _executor  # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(cancel_futures=True)
+            _executor = None
+
+
+def _get_worker_transform(stage_id, get_row_transformer, args):
+    if stage_id in _worker_transforms:
+        _worker_transforms.move_to_end(stage_id)
+    else:
+        _worker_transforms[stage_id] = get_row_transformer(*pickle.loads(args))
+        if len(_worker_transforms) > TRANSFORMERS_PER_WORKER:
+            _worker_transforms.popitem(last=False)
+    return _worker_transforms[stage_id]
+
+
+def _transform_batch(stage_id, get_row_transformer, args, rows):
+    start = time.perf_counter()
+    transform_row, plan = _get_worker_transform(stage_id, get_row_transformer, args)
+    records = [transform_row(row) for row in rows]
+    # the memos of the worker are not seen by the plan of the file
+    return records, time.perf_counter() - start, plan.get_memo_counts()
+
+
+class TransformStage:
+    """
+    Transforms batches of rows in the calling thread, or on the worker processes of the run when workers > 1.
+    Each worker builds its own row transformer and transform plan with get_row_transformer(*args), which has to
+    be a module level function, and sends back the memo hits of the plan with every batch, summed in memo_counts.
+    Batches are handed out in order and their results returned in the same order, with at most
+    TRANSFORM_BATCHES_PER_WORKER batches per worker in flight.
+    """
+
+    def __init__(self, transform_row, metrics, workers=1, get_row_transformer=None, args=()):
+        self.transform_row = transform_row
+        self.metrics = metrics
+        self.executor = None
+        self.max_pending = workers * TRANSFORM_BATCHES_PER_WORKER
+        self.pending = collections.deque()
+        self.memo_counts = {}
+        if workers > 1:
+            self.executor = get_transform_executor(workers)
+            # the arguments are pickled once instead of with every batch
+            self.task = (next(_stage_ids), get_row_transformer, pickle.dumps(args))
+
+    def map(self, batches):
+        if self.executor is None:
+            transform_row = self.transform_row
+            busy_seconds = self.metrics.busy_seconds
+            for batch in batches:
+                start = time.perf_counter()
+                records = [transform_row(row) for row in batch]
+                busy_seconds['transform'] += time.perf_counter() - start
+                yield records
+            return
+
+        pending = self.pending
+        for batch in batches:
+            if len(pending) >= self.max_pending:
+                # every worker is busy, parsing waits for the oldest batch
+                yield self._result(pending.popleft(), self.metrics.blocked_seconds, 'parse')
+            pending.append(self.executor.submit(_transform_batch, *self.task, batch))
+        while pending:
+            yield self._result(pending.popleft(), self.metrics.starved_seconds, 'write')
+
+    def _result(self, future, waits, stage):
+        start = time.perf_counter()
+        records, transform_seconds, memo_counts = future.result()
+        waits[stage] += time.perf_counter() - start
+        for key, (hits, lookups) in memo_counts.items():
+            total_hits, total_lookups = self.memo_counts.get(key, (0, 0))
+            self.memo_counts[key] = (total_hits + hits, total_lookups + lookups)
+        # summed over the workers, so the utilization of the stage can reach the number of workers
+        self.metrics.busy_seconds['transform'] += transform_seconds
+        return records
+
+    def close(self):
+        # the workers are left running for the next file, the batches of a failed file are dropped
+        while self.pending:
+            self.pending.popleft().cancel()
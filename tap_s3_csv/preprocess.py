@@ -1,17 +1,54 @@
 from queue import Queue
 import csv
-import codecs
-from tap_s3_csv import s3
+import itertools
+from tap_s3_csv import decoding
 from tap_s3_csv.symon_exception import SymonException
 
+
+# Block iterator that keeps the blocks it hands out until released, so they can be replayed.
+# Used to re-read the start of a file after header detection without fetching the file again.
+class RewindableBlocks():
+    def __init__(self, blocks):
+        self.blocks = iter(blocks)
+        self.consumed = []
+        self.recording = True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        block = next(self.blocks)
+        if self.recording:
+            self.consumed.append(block)
+        return block
+
+    # returns an iterator that replays every block handed out so far, then continues with the source
+    def rewind(self):
+        replay = self.consumed
+        self.release()
+        return itertools.chain(replay, self)
+
+    # stop keeping blocks once the start of the file no longer needs to be replayed
+    def release(self):
+        self.consumed = []
+        self.recording = False
+
+
 # Wrapper class for file streams. Handles preprocessing (skipping header rows, footer rows, detecting headers)
+# Lines are decoded with the table encoding unless decode is False, in which case raw byte lines are produced
+# (used by dialect detection before the encoding is known, without handle_first_row).
 class PreprocessStream():
-    def __init__(self, file_handle, table_spec, handle_first_row, s3_path=None, config=None):
-        self.file_iterator = file_handle.iter_lines()
+    def __init__(self, file_handle, table_spec, handle_first_row, decode=True):
+        self.is_decoded = decode
+        self.encoding = table_spec.get('encoding', 'utf-8')
+        self.blocks = RewindableBlocks(decoding.iter_blocks(file_handle))
+        self.file_iterator = self._get_line_iterator(self.blocks)
         self.first_row = None
         self.queue = None
         self.header = None
         self.skip_header_row = table_spec.get('skip_header_row', 0)
+        # lines of the file read before the first line of iter_lines()
+        self.lines_skipped = self.skip_header_row
 
         skip_footer_row = table_spec.get('skip_footer_row', 0)
 
@@ -19,7 +56,8 @@ class PreprocessStream():
         if skip_footer_row > 0:
             self.queue = Queue(maxsize=skip_footer_row)
         if handle_first_row:
-            self._handle_first_row(table_spec, s3_path, config)
+            self._handle_first_row(table_spec)
+        self.blocks.release()
 
     def _skip_header_rows(self):
         try:
@@ -30,30 +68,33 @@ class PreprocessStream():
                 f"We can't find any data after the skipped rows in the header. Please check skip/ignore configuration.", 'PreprocessError')
 
     # skips empty rows and process first non-empty row as header row or first record row depending on has_header
-    def _handle_first_row(self, table_spec, s3_path=None, config=None):
+    def _handle_first_row(self, table_spec):
         has_header = table_spec.get('has_header', True)
         first_row_parsed = self._get_first_row(table_spec)
 
         # first row is header row
         if has_header:
             self.header = first_row_parsed
+            self.lines_skipped += self.first_row_lines
             return
 
         # first row is a record, generate headers
         self.header = [f'col_{i}' for i in range(len(first_row_parsed))]
-        # first row has been iterated already, reset file handle so that we don't lose first row and yield it
-        if s3_path is not None and config is not None:
-            self._reset_file_iterator(s3_path, config)
-
-    # resets file_handle and skips header rows
-    def _reset_file_iterator(self, s3_path, config):
-        file_handle = s3.get_file_handle(config, s3_path)
-        self.file_iterator = file_handle.iter_lines()
+        # first row has been iterated already, replay the buffered start of the file so that we don't lose first row and yield it
+        self._reset_file_iterator()
+
+    def _get_line_iterator(self, blocks):
+        if self.is_decoded:
+            blocks = decoding.decode_blocks(blocks, self.encoding)
+        return decoding.split_lines(blocks)
+
+    # rewinds to the start of the file from the buffered blocks and skips header rows
+    def _reset_file_iterator(self):
+        self.file_iterator = self._get_line_iterator(self.blocks.rewind())
         self._skip_header_rows()
 
     # grabs first non empty row using csv.DictReader
     def _get_first_row(self, table_spec):
-        encoding = table_spec.get('encoding', 'utf-8')
         delimiter = table_spec.get('delimiter', ',')
         quotechar = table_spec.get('quotechar', '"')
         escapechar = table_spec.get('escape_char', '\\')
@@ -62,10 +103,8 @@ class PreprocessStream():
         # if fieldnames passed in is None. Use csv.DictReader to grab the first row as it handles corner cases for row such as:
         # - fields in first row contain newline char wrapped with quotechar or escaped with escapechar
         # - fields in first row contain delimiter wrapped with quotechar or escaped with escapechar
-        file_stream = codecs.iterdecode(
-            self.file_iterator, encoding=encoding, errors='replace')
         reader = csv.DictReader(
-            (line.replace('\0', '') for line in file_stream),
+            self.file_iterator,
             fieldnames=None,
             delimiter=delimiter,
             escapechar=escapechar,
@@ -75,13 +114,17 @@ class PreprocessStream():
             raise SymonException(
                 "We can't find any data. Please check skip/ignore configuration.", 'PreprocessError')
 
+        self.first_row_lines = reader.line_num
         return reader.fieldnames
 
     def iter_lines(self):
+        # without footer rows to hold back, lines are handed through without a per-line generator step
+        if self.queue is None:
+            return self.file_iterator
+        return self._iter_lines_without_footer()
+
+    def _iter_lines_without_footer(self):
         for row in self.file_iterator:
-            if self.queue is None:
-                yield row
-            else:
-                if self.queue.full():
-                    yield self.queue.get()
-                self.queue.put(row)
+            if self.queue.full():
+                yield self.queue.get()
+            self.queue.put(row)
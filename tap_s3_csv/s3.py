@@ -1,3 +1,5 @@
+import contextlib
+import contextvars
 import itertools
 import re
 import io
@@ -5,10 +7,12 @@ import json
 import os
 import gzip
 import sys
+import threading
 import backoff
 import boto3
 import singer
 from enum import Enum
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from botocore.credentials import (
     AssumeRoleCredentialFetcher,
@@ -23,23 +27,82 @@ from tap_s3_csv import (
     utils,
     conversion,
     csv_iterator,
-    preprocess
+    preprocess,
+    sampling,
+    spill
 )
 from tap_s3_csv.symon_exception import SymonException
 
 LOGGER = singer.get_logger()
 
 skipped_files_count = 0
-
-
-def retry_pattern():
+_skipped_files_lock = threading.Lock()
+# Tables are discovered and synced concurrently, the files skipped for each of them are also counted in the
+# SkippedFiles of the table (see count_skipped_files)
+_table_skipped_files = contextvars.ContextVar('table_skipped_files', default=None)
+# creating resources on the shared default boto3 session is not thread-safe
+_boto3_lock = threading.Lock()
+
+# Number of files of a table that are sampled at the same time during discovery
+SAMPLE_FILE_WORKERS = 4
+
+# Discovery reads files with ranged GETs: the first range is SAMPLE_RANGE_SIZE bytes and each following
+# range doubles up to SAMPLE_MAX_RANGE_SIZE, until enough rows have been sampled.
+SAMPLE_RANGE_SIZE = 1024 * 1024
+SAMPLE_MAX_RANGE_SIZE = 64 * 1024 * 1024
+SAMPLE_READ_BUFFER_SIZE = 64 * 1024
+# bytes read from the start of a gzip file to get the original file name from its header
+GZIP_HEADER_READ_SIZE = 64 * 1024
+
+
+def retry_pattern(giveup=lambda err: False):
     return backoff.on_exception(backoff.expo,
                                 ClientError,
                                 max_tries=5,
+                                giveup=giveup,
                                 on_backoff=log_backoff_attempt,
                                 factor=10)
 
 
+def is_invalid_range(err):
+    # the range starts past the end of the object, retrying it gives the same answer
+    return err.response.get('Error', {}).get('Code') == 'InvalidRange'
+
+
+class SkippedFiles:
+    def __init__(self):
+        self.count = 0
+
+
+@contextlib.contextmanager
+def count_skipped_files():
+    """
+    Counts the files skipped in the block, and by the sampling threads it starts, apart from those of the tables
+    discovered or synced at the same time.
+    """
+    skipped_files = SkippedFiles()
+    token = _table_skipped_files.set(skipped_files)
+    try:
+        yield skipped_files
+    finally:
+        _table_skipped_files.reset(token)
+
+
+# pylint: disable=global-statement
+def count_skipped_file():
+    global skipped_files_count
+    with _skipped_files_lock:
+        skipped_files_count = skipped_files_count + 1
+        table_skipped_files = _table_skipped_files.get()
+        if table_skipped_files is not None:
+            table_skipped_files.count += 1
+
+
+def get_s3_resource():
+    with _boto3_lock:
+        return boto3.resource('s3')
+
+
 def log_backoff_attempt(details):
     LOGGER.info(
         "Error detected communicating with Amazon, triggering backoff: %d try", details.get("tries"))
@@ -120,18 +183,36 @@ def get_sampled_schema_for_table(config, table_spec):
 
     s3_files_gen = get_input_files_for_table(config, table_spec)
 
-    samples = [sample for sample in sample_files(
-        config, table_spec, s3_files_gen)]
-
-    if skipped_files_count:
+    sampling_options = {
+        'max_records': config.get('sample_max_records', 1000),
+        'max_files': config.get('sample_max_files', 5),
+        'max_workers': config.get('discover_max_workers', SAMPLE_FILE_WORKERS),
+    }
+    if config.get('sampling_strategy', 'head') == 'probes':
+        sampling_options['probe_count'] = config.get(
+            'sample_probe_count', sampling.SAMPLE_PROBE_COUNT)
+        sampling_options['probe_bytes'] = config.get(
+            'sample_probe_bytes', sampling.SAMPLE_PROBE_BYTES)
+
+    # samples are folded into the inferred schema as they are read instead of being collected first
+    inferrer = conversion.SchemaInferrer(max_workers=config.get('inference_max_workers', 1))
+    try:
+        with count_skipped_files() as skipped_files:
+            inferrer.update_batch(sample_files(
+                config, table_spec, s3_files_gen, **sampling_options))
+        inferrer.flush()
+    finally:
+        inferrer.close()
+
+    if skipped_files.count:
         LOGGER.warning(
-            "%s files got skipped during the last sampling.", skipped_files_count)
+            "%s files got skipped during the last sampling.", skipped_files.count)
 
-    if not samples:
+    if not inferrer.row_count:
         raise SymonException('File is empty', 'EmptyFile')
 
-    data_schema, date_format_map = conversion.generate_schema(
-        samples, table_spec, config.get('string_max_length', False))
+    data_schema, date_format_map = inferrer.get_schema(
+        config.get('string_max_length', False))
 
     sampled_schema = {
         'type': 'object',
@@ -249,59 +330,67 @@ def check_key_properties_and_date_overrides_for_jsonl_file(table_spec, jsonl_sam
 # pylint: disable=global-statement
 
 
-def sampling_gz_file(table_spec, s3_path, file_handle, sample_rate):
-    global skipped_files_count
+def sampling_gz_file(table_spec, s3_path, file_handle, sample_rate, max_records=None):
     if s3_path.endswith(".tar.gz"):
         LOGGER.warning(
             'Skipping "%s" file as .tar.gz extension is not supported', s3_path)
-        skipped_files_count = skipped_files_count + 1
+        count_skipped_file()
         return []
 
-    file_bytes = file_handle.read()
-    gz_file_obj = gzip.GzipFile(fileobj=io.BytesIO(file_bytes))
+    if hasattr(file_handle, "seekable") and file_handle.seekable():
+        # read the file name from the gzip header, then decompress straight from the handle so that only the part
+        # of the file that gets sampled is downloaded
+        start = file_handle.tell()
+        header_handle = io.BytesIO(file_handle.read(GZIP_HEADER_READ_SIZE))
+    else:
+        # the buffer stays open while the records sampled from it are iterated, and is released once collected
+        file_handle = spill.SpillBuffer().copy_from(file_handle).getfile()
+        start = 0
+        header_handle = file_handle
 
     try:
         gz_file_name = utils.get_file_name_from_gzfile(
-            fileobj=io.BytesIO(file_bytes))
+            fileobj=header_handle)
     except AttributeError as err:
         # If a file is compressed using gzip command with --no-name attribute,
         # It will not return the file name and timestamp. Hence we will skip such files.
         # We also seen this issue occur when tar is used to compress the file
         LOGGER.warning(
             'Skipping "%s" file as we did not get the original file name', s3_path)
-        skipped_files_count = skipped_files_count + 1
+        count_skipped_file()
         return []
 
     if gz_file_name:
         if gz_file_name.endswith(".gz"):
             LOGGER.warning(
                 'Skipping "%s" file as it contains nested compression.', s3_path)
-            skipped_files_count = skipped_files_count + 1
+            count_skipped_file()
             return []
 
+        file_handle.seek(start)
+        gz_file_obj = gzip.GzipFile(fileobj=file_handle)
         gz_file_extension = gz_file_name.split(".")[-1].lower()
-        return sample_file(table_spec, s3_path + "/" + gz_file_name, io.BytesIO(gz_file_obj.read()), sample_rate, gz_file_extension)
+        return sample_file(table_spec, s3_path + "/" + gz_file_name, gz_file_obj, sample_rate, gz_file_extension, max_records=max_records)
 
     raise Exception('"{}" file has some error(s)'.format(s3_path))
 
 # pylint: disable=global-statement
 
 
-def sample_file(table_spec, s3_path, file_handle, sample_rate, extension, config=None):
-    global skipped_files_count
+def sample_file(table_spec, s3_path, file_handle, sample_rate, extension, config=None, max_records=None):
 
     # Check whether file is without extension or not
     if not extension or s3_path.lower() == extension:
         LOGGER.warning('"%s" without extension will not be sampled.', s3_path)
-        skipped_files_count = skipped_files_count + 1
+        count_skipped_file()
         return []
     if extension in ["csv", "txt"]:
         # file_hanedle: If file object read from s3 bucket file else use extracted file object from zip or gz
         # preprocess: For discovery, we need to set handle_first_row param to True so that we can set column headers
-        # correctly. Need to pass in s3_path and config for resetting the file handle so that we don't lose first row
-        # after parsing it to generate headers if table_spec.has_header == False
+        # correctly. If table_spec.has_header == False, the first row is replayed from the bytes buffered while
+        # parsing it to generate headers, so the file is only fetched once
         preprocess_file_handle = preprocess.PreprocessStream(
-            file_handle, table_spec, True, s3_path, config)
+            file_handle, table_spec, True)
         fieldnames = preprocess_file_handle.header
         iterator = csv_iterator.get_row_iterator(
             preprocess_file_handle, table_spec, fieldnames)
@@ -310,10 +399,10 @@ def sample_file(table_spec, s3_path, file_handle, sample_rate, extension, config
             csv_records = get_records_for_csv(s3_path, sample_rate, iterator)
         else:
             LOGGER.warning('Skipping "%s" file as it is empty', s3_path)
-            skipped_files_count = skipped_files_count + 1
+            count_skipped_file()
         return csv_records
     if extension == "gz":
-        return sampling_gz_file(table_spec, s3_path, file_handle, sample_rate)
+        return sampling_gz_file(table_spec, s3_path, file_handle, sample_rate, max_records)
     if extension == "jsonl":
         # If file object read from s3 bucket file else use extracted file object from zip or gz
         file_handle = file_handle._raw_stream if hasattr(
@@ -322,10 +411,12 @@ def sample_file(table_spec, s3_path, file_handle, sample_rate, extension, config
             s3_path, sample_rate, file_handle)
         check_jsonl_sample_records, records = itertools.tee(
             records)
-        jsonl_sample_records = list(check_jsonl_sample_records)
+        # only the first max_records records are sampled, don't parse the rest of the file to check them
+        jsonl_sample_records = list(itertools.islice(
+            check_jsonl_sample_records, max_records))
         if len(jsonl_sample_records) == 0:
             LOGGER.warning('Skipping "%s" file as it is empty', s3_path)
-            skipped_files_count = skipped_files_count + 1
+            count_skipped_file()
         check_key_properties_and_date_overrides_for_jsonl_file(
             table_spec, jsonl_sample_records, s3_path)
 
@@ -333,11 +424,11 @@ def sample_file(table_spec, s3_path, file_handle, sample_rate, extension, config
     if extension == "zip":
         LOGGER.warning(
             'Skipping "%s" file as it contains nested compression.', s3_path)
-        skipped_files_count = skipped_files_count + 1
+        count_skipped_file()
         return []
     LOGGER.warning(
         '"%s" having the ".%s" extension will not be sampled.', s3_path, extension)
-    skipped_files_count = skipped_files_count + 1
+    count_skipped_file()
     return []
 
 # pylint: disable=global-statement
@@ -358,7 +449,6 @@ def get_files_to_sample(config, s3_files, max_files):
              |_ type str(): Type of file which is used for extracted file
              |_ extension str(): extension of file (for normal files only)
     """
-    global skipped_files_count
     sampled_files = []
 
     OTHER_FILES = ["csv", "gz", "jsonl", "txt"]
@@ -372,75 +462,138 @@ def get_files_to_sample(config, s3_files, max_files):
         if file_key:
             file_name = file_key.split("/").pop()
             extension = file_name.split(".").pop().lower()
-            file_handle = get_file_handle(config, file_key)
 
             # Check whether file is without extension or not
             if not extension or file_name.lower() == extension:
                 LOGGER.warning(
                     '"%s" without extension will not be sampled.', file_key)
-                skipped_files_count = skipped_files_count + 1
+                count_skipped_file()
             elif file_key.endswith(".tar.gz"):
                 LOGGER.warning(
                     'Skipping "%s" file as .tar.gz extension is not supported', file_key)
-                skipped_files_count = skipped_files_count + 1
+                count_skipped_file()
             elif extension == "zip":
-                files = compression.infer(
-                    io.BytesIO(file_handle.read()), file_name)
+                file_handle = get_file_handle(
+                    config, file_key, ranged=True, size=s3_file.get('size'))
+                # the ranged handle is seekable, so zipfile only fetches the central directory and the members that
+                # actually get sampled instead of the whole archive
+                files = compression.infer(file_handle, file_name)
 
                 # Add only those extracted files which are supported by tap
                 # Prepare dictionary contains the zip file name, type i.e. unzipped and file object of extracted file
-                sampled_files.extend([{"type": "unzipped", "s3_path": file_key, "file_handle": de_file} for de_file in files if de_file.name.split(
-                    ".")[-1].lower() in OTHER_FILES and not de_file.name.endswith(".tar.gz")])
+                # and the archive they are read from, closed once they are sampled
+                members = [{"type": "unzipped", "s3_path": file_key, "file_handle": de_file, "archive": file_handle}
+                           for de_file in files if de_file.name.split(".")[-1].lower() in OTHER_FILES
+                           and not de_file.name.endswith(".tar.gz")]
+                if not members:
+                    file_handle.close()
+                sampled_files.extend(members)
             elif extension in OTHER_FILES:
-                # Prepare dictionary contains the s3 file path, extension of file and file object
+                file_handle = get_file_handle(
+                    config, file_key, ranged=True, size=s3_file.get('size'),
+                    range_size=get_sample_range_size(config, extension))
+                # Prepare dictionary contains the s3 file path, extension of file, file object and file size
                 sampled_files.append(
-                    {"s3_path": file_key, "file_handle": file_handle, "extension": extension})
+                    {"s3_path": file_key, "file_handle": file_handle, "extension": extension, "size": s3_file.get('size')})
             else:
                 LOGGER.warning(
                     '"%s" having the ".%s" extension will not be sampled.', file_key, extension)
-                skipped_files_count = skipped_files_count + 1
+                count_skipped_file()
 
     return sampled_files
 
 
-# pylint: disable=too-many-arguments,global-statement
+def get_sample_range_size(config, extension):
+    # each probe is fetched with a single range of its own size instead of the first SAMPLE_RANGE_SIZE bytes
+    if config.get('sampling_strategy', 'head') == 'probes' and extension in sampling.PROBE_EXTENSIONS:
+        return config.get('sample_probe_bytes', sampling.SAMPLE_PROBE_BYTES)
+    return SAMPLE_RANGE_SIZE
+
+
+# pylint: disable=too-many-arguments
+def sample_file_with_probes(table_spec, s3_path, file_handle, extension, size, max_records, probe_count, probe_bytes):
+    LOGGER.info('Sampling %s with %s probes of %s bytes', s3_path, probe_count, probe_bytes)
+    if extension == "jsonl":
+        records = sampling.sample_jsonl_probes(
+            s3_path, file_handle, size, max_records, probe_count, probe_bytes)
+        check_key_properties_and_date_overrides_for_jsonl_file(
+            table_spec, records, s3_path)
+        return records
+
+    maximize_csv_field_width()
+    return sampling.sample_csv_probes(table_spec, s3_path, file_handle, size, max_records, probe_count, probe_bytes)
+
+
+# pylint: disable=too-many-arguments
 def sample_files(config, table_spec, s3_files,
-                 sample_rate=1, max_records=1000, max_files=5):
-    global skipped_files_count
+                 sample_rate=1, max_records=1000, max_files=5, probe_count=None, probe_bytes=sampling.SAMPLE_PROBE_BYTES,
+                 max_workers=SAMPLE_FILE_WORKERS):
     LOGGER.info("Sampling files (max files: %s)", max_files)
 
-    for s3_file in itertools.islice(get_files_to_sample(config, s3_files, max_files), max_files):
-
-        s3_path = s3_file.get("s3_path", "")
-        file_handle = s3_file.get("file_handle")
-        file_type = s3_file.get("type")
-        extension = s3_file.get("extension")
+    if probe_count:
+        # probe sampling also spreads the sampled files over all matched files instead of taking the first ones
+        s3_files = sampling.spread_files(s3_files, max_files)
 
-        # Check whether the file is extracted from zip file.
-        if file_type and file_type == "unzipped":
-            # Append the extracted file name with zip file.
-            s3_path += "/" + file_handle.name
-            extension = file_handle.name.split(".")[-1].lower()
+    files_to_sample = list(itertools.islice(get_files_to_sample(config, s3_files, max_files), max_files))
 
-        LOGGER.info('Sampling %s (max records: %s, sample rate: %s)',
-                    s3_path,
-                    max_records,
-                    sample_rate)
-        try:
-            yield from itertools.islice(sample_file(table_spec, s3_path, file_handle, sample_rate, extension, config), max_records)
-        except (UnicodeDecodeError, json.decoder.JSONDecodeError):
-            # UnicodeDecodeError will be raised if non csv file parsed to csv parser
-            # JSONDecodeError will be reaised if non JSONL file parsed to JSON parser
-            # Handled both error and skipping file with wrong extension.
-            LOGGER.warn(
-                "Skipping %s file as parsing failed. Verify an extension of the file.", s3_path)
-            skipped_files_count = skipped_files_count + 1
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        # files are sampled concurrently, their records are still returned in file order. Each one runs in a copy
+        # of the context so that its skipped files are counted for the table.
+        futures = [executor.submit(contextvars.copy_context().run, sample_file_from_entry, config, table_spec,
+                                   s3_file, sample_rate, max_records, probe_count, probe_bytes)
+                   for s3_file in files_to_sample]
+        for future in futures:
+            yield from future.result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+        # zip members are read from the ranged handle of their archive
+        for archive in {s3_file['archive'] for s3_file in files_to_sample if 'archive' in s3_file}:
+            archive.close()
+
+
+# pylint: disable=too-many-arguments
+def sample_file_from_entry(config, table_spec, s3_file, sample_rate, max_records, probe_count, probe_bytes):
+    s3_path = s3_file.get("s3_path", "")
+    file_handle = s3_file.get("file_handle")
+    file_type = s3_file.get("type")
+    extension = s3_file.get("extension")
+    size = s3_file.get("size")
+
+    # Check whether the file is extracted from zip file.
+    if file_type and file_type == "unzipped":
+        # Append the extracted file name with zip file.
+        s3_path += "/" + file_handle.name
+        extension = file_handle.name.split(".")[-1].lower()
+
+    LOGGER.info('Sampling %s (max records: %s, sample rate: %s)',
+                s3_path,
+                max_records,
+                sample_rate)
+    records = []
+    try:
+        if probe_count and size and sampling.supports_probes(table_spec, extension):
+            records = sample_file_with_probes(table_spec, s3_path, file_handle, extension, size, max_records, probe_count, probe_bytes)
+        else:
+            # records sampled before a parsing error are kept, extend appends them one by one
+            records.extend(itertools.islice(sample_file(table_spec, s3_path, file_handle, sample_rate, extension, config, max_records), max_records))
+    except (UnicodeDecodeError, json.decoder.JSONDecodeError):
+        # UnicodeDecodeError will be raised if non csv file parsed to csv parser
+        # JSONDecodeError will be reaised if non JSONL file parsed to JSON parser
+        # Handled both error and skipping file with wrong extension.
+        LOGGER.warn(
+            "Skipping %s file as parsing failed. Verify an extension of the file.", s3_path)
+        count_skipped_file()
+    finally:
+        # sampling of this file is done, drop the rest of the response instead of downloading it
+        if hasattr(file_handle, 'close'):
+            file_handle.close()
+    return records
 
 # pylint: disable=global-statement
 
 
 def get_input_files_for_table(config, table_spec, modified_since=None):
-    global skipped_files_count
     bucket = config['bucket']
 
     to_return = []
@@ -463,6 +616,7 @@ def get_input_files_for_table(config, table_spec, modified_since=None):
 
     matched_files_count = 0
     unmatched_files_count = 0
+    empty_files_count = 0
     max_files_before_log = 30000
     for s3_object in list_files_in_bucket(bucket, table_spec.get('search_prefix'), table_spec.get('recursive_search')):
         key = s3_object['Key']
@@ -470,7 +624,8 @@ def get_input_files_for_table(config, table_spec, modified_since=None):
 
         if s3_object['Size'] == 0:
             LOGGER.warning('Skipping matched file "%s" as it is empty', key)
-            skipped_files_count = skipped_files_count + 1
+            count_skipped_file()
+            empty_files_count += 1
             continue
 
         LOGGER.info(f'matching {os.path.basename(key)}')
@@ -481,7 +636,7 @@ def get_input_files_for_table(config, table_spec, modified_since=None):
                 LOGGER.info('Will download key "%s" as it was last modified %s',
                             key,
                             last_modified)
-                yield {'key': key, 'last_modified': last_modified}
+                yield {'key': key, 'last_modified': last_modified, 'size': s3_object['Size'], 'etag': s3_object.get('ETag')}
         else:
             LOGGER.info('Skipping unmatched file "%s"', key)
             unmatched_files_count += 1
@@ -498,9 +653,9 @@ def get_input_files_for_table(config, table_spec, modified_since=None):
                             matched_files_count, unmatched_files_count)
 
     if matched_files_count == 0:
-        if skipped_files_count > 0 and unmatched_files_count == 0:
+        if empty_files_count > 0 and unmatched_files_count == 0:
             # Symon imports only one file at a time where only one file is uploaded in s3 bucket/prefix location.
-            # If skipped_files_count > 0, it must mean that the file has been skipped due to being empty file.
+            # If empty_files_count > 0, it must mean that the file has been skipped due to being empty file.
             raise SymonException('File is empty.', 'EmptyFile')
         LOGGER.warning("No files found matching pattern {}".format(pattern))
         key = table_spec['table_name']
@@ -546,15 +701,138 @@ def list_files_in_bucket(bucket, search_prefix=None, recursive_search=True):
 
 
 @retry_pattern()
-def get_file_handle(config, s3_path):
+def get_file_handle(config, s3_path, ranged=False, size=None, offset=0, range_size=SAMPLE_RANGE_SIZE):
     bucket = config['bucket']
-    s3_client = boto3.resource('s3')
+    if ranged:
+        # Nothing is fetched until the handle is read, and then only the byte ranges that are actually consumed.
+        # A buffer larger than the range would make every read request at least the buffer size.
+        return io.BufferedReader(S3RangeReader(bucket, s3_path, size, range_size),
+                                 min(SAMPLE_READ_BUFFER_SIZE, range_size))
+
+    s3_client = get_s3_resource()
 
     s3_bucket = s3_client.Bucket(bucket)
     s3_object = s3_bucket.Object(s3_path)
+    if offset:
+        # the rest of the file from a checkpoint
+        return s3_object.get(Range=f'bytes={offset}-')['Body']
     return s3_object.get()['Body']
 
 
+class S3RangeReader(io.RawIOBase):
+    """
+    Seekable, read-only view of an S3 object backed by ranged GETs. The first read requests range_size bytes and
+    every following sequential range doubles in size up to max_range_size, so a reader that stops early (e.g. after
+    sampling max_records rows) only downloads a bounded prefix of the file. Seeking (zip central directory, zip
+    members) restarts at small ranges. Closing the reader closes the in-flight response without draining it.
+    """
+
+    def __init__(self, bucket, key, size=None, range_size=SAMPLE_RANGE_SIZE, max_range_size=SAMPLE_MAX_RANGE_SIZE):
+        super().__init__()
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.initial_range_size = range_size
+        self.range_size = range_size
+        self.max_range_size = max_range_size
+        self.position = 0
+        self.body = None
+        self.body_end = 0
+        self.bytes_fetched = 0
+        self.request_count = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self._get_size()
+
+        if offset != self.position:
+            self._close_body()
+            self.range_size = self.initial_range_size
+            self.position = offset
+        return self.position
+
+    def readinto(self, buffer):
+        if self.body is None or self.position >= self.body_end:
+            if not self._open_range(len(buffer)):
+                return 0
+
+        data = self.body.read(min(len(buffer), self.body_end - self.position))
+        if not data:
+            self._close_body()
+            return 0
+
+        buffer[:len(data)] = data
+        self.position += len(data)
+        self.bytes_fetched += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._close_body()
+            if self.request_count:
+                LOGGER.info('Read %s bytes of "%s" with %s ranged requests',
+                            self.bytes_fetched, self.key, self.request_count)
+        super().close()
+
+    def _open_range(self, min_size):
+        if self.body is not None:
+            # reading continues past the current range, fetch a larger one next
+            self._close_body()
+            self.range_size = min(self.range_size * 2, self.max_range_size)
+
+        if self.size is not None and self.position >= self.size:
+            return False
+
+        end = self.position + max(min_size, self.range_size) - 1
+        if self.size is not None:
+            end = min(end, self.size - 1)
+
+        try:
+            response = self._get_range(self.position, end)
+        except ClientError as err:
+            if is_invalid_range(err):
+                self.size = self.position
+                return False
+            raise
+
+        self.request_count += 1
+        content_range = response.get('ContentRange')
+        if content_range and '/' in content_range:
+            total = content_range.rsplit('/', 1)[-1]
+            if total.isdigit():
+                self.size = int(total)
+        self.body = response['Body']
+        self.body_end = self.position + response['ContentLength']
+        return True
+
+    def _close_body(self):
+        if self.body is not None:
+            self.body.close()
+            self.body = None
+
+    @retry_pattern(giveup=is_invalid_range)
+    def _get_range(self, start, end):
+        s3_object = get_s3_resource().Object(self.bucket, self.key)
+        return s3_object.get(Range=f'bytes={start}-{end}')
+
+    @retry_pattern()
+    def _get_size(self):
+        if self.size is None:
+            self.size = get_s3_resource().Object(self.bucket, self.key).content_length
+        return self.size
+
+
 class EOLType(Enum):
     LF = 1
     CR = 2
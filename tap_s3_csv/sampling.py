@@ -0,0 +1,176 @@
+import csv
+import io
+import itertools
+import json
+import random
+import re
+
+import singer
+
+from tap_s3_csv import csv_iterator, decoding, preprocess
+
+LOGGER = singer.get_logger()
+
+# Probe sampling reads sample_probe_count ranges of sample_probe_bytes bytes spread across each file instead of only
+# the head of the file, so columns that change type further into a file are seen during discovery. The byte and row
+# budget per file stays fixed regardless of the file size.
+SAMPLE_PROBE_COUNT = 10
+SAMPLE_PROBE_BYTES = 256 * 1024
+
+PROBE_EXTENSIONS = ['csv', 'txt', 'jsonl']
+
+LINE_END = re.compile(rb'\r\n|\r|\n')
+
+
+def supports_probes(table_spec, extension):
+    # Probes are resynced on raw \r/\n bytes, which is only valid for ascii compatible encodings
+    return extension in PROBE_EXTENSIONS and decoding.nul_is_single_byte(table_spec.get('encoding', 'utf-8'))
+
+
+def spread_files(s3_files, max_files):
+    """
+    Picks up to max_files files spread evenly over all matched files rather than the first max_files.
+    """
+    s3_files = list(s3_files)
+    if len(s3_files) <= max_files:
+        return s3_files
+    if max_files <= 1:
+        return s3_files[:max_files]
+    last = len(s3_files) - 1
+    return [s3_files[round(i * last / (max_files - 1))] for i in range(max_files)]
+
+
+def get_probe_ranges(size, probe_count, probe_bytes, seed):
+    """
+    Splits the file in probe_count equal strata and places one probe at a random offset inside each stratum. The
+    first probe always starts at byte 0 so that it contains the header. Offsets are seeded by the file key so that
+    repeated discovery runs sample the same bytes.
+    """
+    # the whole file fits in the budget, read it in one go
+    if size <= probe_count * probe_bytes:
+        return [(0, size)]
+
+    stratum = size // probe_count
+    probe_bytes = min(probe_bytes, stratum)
+    rand = random.Random(seed)
+
+    ranges = [(0, probe_bytes)]
+    for i in range(1, probe_count):
+        start = i * stratum + rand.randint(0, stratum - probe_bytes)
+        ranges.append((start, probe_bytes))
+    return ranges
+
+
+def read_probe(file_handle, start, length, size):
+    """
+    Reads a probe and trims it to whole lines: everything before the first line end is dropped when the probe does
+    not start at the beginning of the file, and the partial line at the end is dropped unless the probe reaches the
+    end of the file.
+    """
+    file_handle.seek(start)
+    data = file_handle.read(length)
+    at_eof = start + len(data) >= size
+
+    # the head probe needs at least the whole header line
+    while start == 0 and not at_eof and not LINE_END.search(data):
+        data += file_handle.read(length)
+        at_eof = start + len(data) >= size
+
+    if start > 0:
+        line_end = LINE_END.search(data)
+        data = data[line_end.end():] if line_end else b''
+
+    if not at_eof:
+        end = max(data.rfind(b'\n'), data.rfind(b'\r'))
+        data = data[:end + 1]
+    return data, at_eof
+
+
+def _row_to_record(fieldnames, row):
+    # same shape csv.DictReader produces for short or long rows
+    record = dict(zip(fieldnames, row))
+    if len(row) > len(fieldnames):
+        record[None] = row[len(fieldnames):]
+    else:
+        for fieldname in fieldnames[len(row):]:
+            record[fieldname] = None
+    return record
+
+
+def _get_probe_lines(data, table_spec, at_eof):
+    lines = list(decoding.split_lines(decoding.decode_blocks([data], table_spec.get('encoding', 'utf-8'))))
+    skip_footer_row = table_spec.get('skip_footer_row', 0)
+    if at_eof and skip_footer_row > 0:
+        lines = lines[:-skip_footer_row]
+    return lines
+
+
+def sample_csv_probes(table_spec, s3_path, file_handle, size, max_records, probe_count, probe_bytes):
+    ranges = get_probe_ranges(size, probe_count, probe_bytes, s3_path)
+    rows_per_probe = max(1, -(-max_records // len(ranges)))
+
+    # head probe goes through the regular preprocessing to skip header rows and detect the header
+    head_data, at_eof = read_probe(file_handle, 0, ranges[0][1], size)
+    # footer rows are only at the end of the head probe if it covers the whole file
+    head_spec = table_spec if at_eof else {**table_spec, 'skip_footer_row': 0}
+    head_stream = preprocess.PreprocessStream(io.BytesIO(head_data), head_spec, True)
+    reader = csv_iterator.get_row_iterator(head_stream, table_spec, head_stream.header)
+    fieldnames = reader.fieldnames
+
+    # Skipping the empty line of CSV.
+    records = list(itertools.islice((row for row in reader if len(row) > 0), rows_per_probe))
+
+    for start, length in ranges[1:]:
+        data, at_eof = read_probe(file_handle, start, length, size)
+        rows = csv.reader(
+            _get_probe_lines(data, table_spec, at_eof),
+            delimiter=table_spec.get('delimiter', ','),
+            escapechar=table_spec.get('escape_char', '\\'),
+            quotechar=table_spec.get('quotechar', '"'))
+
+        # A probe can start inside a quoted field that spans lines. Only rows with exactly one value per column are
+        # taken, which skips rows parsed from the middle of a record until the parser is back on a record boundary.
+        probe_records = []
+        try:
+            for row in rows:
+                if len(row) == len(fieldnames):
+                    probe_records.append(_row_to_record(fieldnames, row))
+                    if len(probe_records) >= rows_per_probe:
+                        break
+        except csv.Error:
+            # resyncing inside a quoted field can leave the parser in an invalid state for the rest of the probe
+            pass
+        records.extend(probe_records)
+
+    LOGGER.info("Sampled %s rows from %s with %s probes", len(records), s3_path, len(ranges))
+    return records
+
+
+def sample_jsonl_probes(s3_path, file_handle, size, max_records, probe_count, probe_bytes):
+    ranges = get_probe_ranges(size, probe_count, probe_bytes, s3_path)
+    rows_per_probe = max(1, -(-max_records // len(ranges)))
+
+    records = []
+    for start, length in ranges:
+        data, _ = read_probe(file_handle, start, length, size)
+        probe_records = []
+        for line in decoding.split_lines([data]):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line.decode('utf-8'))
+            except (UnicodeDecodeError, json.decoder.JSONDecodeError):
+                # resynced into the middle of a record
+                if start > 0 and not probe_records:
+                    continue
+                raise
+            # Skipping the empty json.
+            if len(row) == 0:
+                continue
+            probe_records.append(row)
+            if len(probe_records) >= rows_per_probe:
+                break
+        records.extend(probe_records)
+
+    LOGGER.info("Sampled %s rows from %s with %s probes", len(records), s3_path, len(ranges))
+    return records
@@ -0,0 +1,192 @@
+import io
+import tempfile
+import threading
+
+import simplejson as json
+import singer
+
+from tap_s3_csv.utils import IMPORT_PERF_METRICS_LOG_PREFIX
+
+LOGGER = singer.get_logger()
+
+# Bytes all spill buffers of the process may hold in memory together, set with memory_budget_bytes. A buffer that
+# would go over the budget moves its content to a local temp file and keeps writing there.
+MEMORY_BUDGET_BYTES = 256 * 1024 ** 2
+
+# Bytes read at a time when copying a file handle into a buffer
+COPY_SIZE = 1024 ** 2
+
+TEMP_FILE_PREFIX = 'tap-s3-csv-'
+
+
+class MemoryBudget:
+    """
+    Bytes held in memory by the spill buffers sharing the budget, with the peak reached and what was spilled to disk.
+    """
+
+    def __init__(self, limit=MEMORY_BUDGET_BYTES):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.used_bytes = 0
+        self.peak_bytes = 0
+        self.spilled_buffers = 0
+        self.spilled_bytes = 0
+
+    def reserve(self, size):
+        with self.lock:
+            if self.used_bytes + size > self.limit:
+                return False
+            self.used_bytes += size
+            self.peak_bytes = max(self.peak_bytes, self.used_bytes)
+            return True
+
+    def release(self, size):
+        with self.lock:
+            self.used_bytes -= size
+
+    def spill(self, size):
+        # the size bytes in memory of a buffer moved to disk
+        with self.lock:
+            self.used_bytes -= size
+            self.spilled_buffers += 1
+            self.spilled_bytes += size
+
+    def count_spilled(self, size):
+        with self.lock:
+            self.spilled_bytes += size
+
+    def get_metrics(self):
+        return {
+            'memory_budget_bytes': self.limit,
+            'buffer_peak_bytes': self.peak_bytes,
+            'spilled_buffers': self.spilled_buffers,
+            'spilled_bytes': self.spilled_bytes,
+        }
+
+
+_budget = MemoryBudget()
+
+
+def set_memory_budget(limit):
+    if limit is not None:
+        _budget.limit = int(limit)
+
+
+def log_metrics():
+    LOGGER.info('%s %s', IMPORT_PERF_METRICS_LOG_PREFIX, json.dumps(_budget.get_metrics()))
+
+
+class SpillBuffer:
+    """
+    Write once, read many bytes buffer. Written bytes are kept in memory while the memory budget allows and moved
+    to a temp file, deleted on close(), as soon as it doesn't. Once written, the buffer is read as a seekable
+    binary file object, rewound by getfile(), or with read_at().
+    """
+
+    def __init__(self, budget=None):
+        self.budget = _budget if budget is None else budget
+        self.file = io.BytesIO()
+        self.size = 0
+        self.reserved = 0
+        self.spilled = False
+
+    def write(self, data):
+        size = len(data)
+        if not self.spilled:
+            if self.budget.reserve(size):
+                self.reserved += size
+            else:
+                self._spill()
+        if self.spilled:
+            self.budget.count_spilled(size)
+        self.file.seek(0, io.SEEK_END)
+        self.file.write(data)
+        self.size += size
+        return size
+
+    def _spill(self):
+        memory_file = self.file
+        self.file = tempfile.TemporaryFile(prefix=TEMP_FILE_PREFIX)
+        self.file.write(memory_file.getbuffer())
+        memory_file.close()
+        self.budget.spill(self.reserved)
+        self.reserved = 0
+        self.spilled = True
+
+    def copy_from(self, file_handle):
+        for block in iter(lambda: file_handle.read(COPY_SIZE), b''):
+            self.write(block)
+        return self
+
+    def read_at(self, offset, size):
+        self.file.seek(offset)
+        return self.file.read(size)
+
+    def getfile(self):
+        self.file.seek(0)
+        return self
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    def close(self):
+        if self.closed:
+            return
+        self.file.close()
+        self.budget.release(self.reserved)
+        self.reserved = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        # buffers handed to lazily consumed iterators are released once they are garbage collected
+        self.close()
+
+
+class SpillLines:
+    """
+    Append only list of bytes lines stored in a spill buffer.
+    """
+
+    def __init__(self, budget=None):
+        self.buffer = SpillBuffer(budget)
+        self.offsets = [0]
+
+    def append(self, line):
+        self.buffer.write(line)
+        self.offsets.append(self.buffer.size)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start = self.offsets[i]
+        return self.buffer.read_at(start, self.offsets[i + 1] - start)
+
+    def __iter__(self):
+        file_handle = self.buffer.getfile()
+        for start, end in zip(self.offsets, self.offsets[1:]):
+            yield file_handle.read(end - start)
+
+    def close(self):
+        self.buffer.close()
@@ -1,9 +1,12 @@
 import re
 import sys
 import csv
-import io
 import json
 import gzip
+import threading
+import time
+
+import orjson
 
 from singer import metadata
 from singer import utils as singer_utils
@@ -13,10 +16,15 @@ from singer_encodings import compression
 from tap_s3_csv import (
     utils,
     s3,
+    checkpoint,
     csv_iterator,
+    decoding,
     transform,
     messages,
-    preprocess
+    pipeline,
+    file_manifest,
+    preprocess,
+    spill
 )
 from tap_s3_csv.symon_exception import SymonException
 
@@ -24,6 +32,15 @@ LOGGER = singer.get_logger()
 
 BUFFER_SIZE = 100
 
+# orjson reads integers outside of the 64 bit range as floats, lines with such long digit runs are parsed with json.
+# Digits are mapped to b'0' and everything else to b' ', so the run is found with a plain substring search.
+DIGITS_TABLE = bytes(ord('0') if chr(byte).isdigit() and byte < 128 else ord(' ') for byte in range(256))
+LONG_DIGITS = b'0' * 19
+
+# A STATE message holds the bookmarks of every stream, so when streams are synced in parallel a bookmark is
+# updated and the state written under this lock
+STATE_LOCK = threading.Lock()
+
 
 def sync_stream(config, state, table_spec, stream, start_byte, end_byte, range_size, json_lib):
     table_name = table_spec['table_name']
@@ -32,12 +49,39 @@ def sync_stream(config, state, table_spec, stream, start_byte, end_byte, range_s
         bookmark or '1990-01-01T00:00:00Z')
 
     LOGGER.info('Syncing table "%s".', table_name)
-    LOGGER.info('Getting files modified since %s.', modified_since)
 
-    s3_files = s3.get_input_files_for_table(
-        config, table_spec, modified_since)
+    # a resumed file would not know how many lines count against the row_limit of the table
+    checkpoint_seconds = config.get('sync_checkpoint_seconds') if table_spec.get('row_limit') is None else None
+    checkpoint_bookmark = singer.get_bookmark(state, table_name, 'checkpoint') if checkpoint_seconds else None
+
+    manifest = None
+    synced_until = None
+    if config.get('file_manifest', False):
+        manifest_bookmark = singer.get_bookmark(state, table_name, 'files')
+        manifest = file_manifest.FileManifest.from_bookmark(manifest_bookmark)
+        if bookmark and manifest_bookmark is None:
+            # the first run with a manifest takes the files not modified since the modified_since bookmark as synced
+            synced_until = modified_since
+        # every matching file is listed, unchanged files are skipped by their entry in the manifest
+        LOGGER.info('Getting files not in the manifest of %s files.', len(manifest))
+        s3_files = s3.get_input_files_for_table(config, table_spec)
+    elif checkpoint_bookmark:
+        # the file of the checkpoint is resumed even when it was modified before files synced after it by key
+        LOGGER.info('Getting files modified since %s and file %s.', modified_since, checkpoint_bookmark.get('key'))
+        s3_files = [s3_file for s3_file in s3.get_input_files_for_table(config, table_spec)
+                    if modified_since < s3_file['last_modified'] or s3_file['key'] == checkpoint_bookmark.get('key')]
+    else:
+        LOGGER.info('Getting files modified since %s.', modified_since)
+        s3_files = s3.get_input_files_for_table(
+            config, table_spec, modified_since)
+
+    def write_checkpoint(bookmark):
+        with STATE_LOCK:
+            singer.write_bookmark(state, table_name, 'checkpoint', bookmark)
+            messages.write_state(state)
 
     records_streamed = 0
+    unchanged_files = 0
 
     # Original implementation sorted by 'modified_since' so that the modified_since bookmark makes
     # sense. We sort by 'key' because we import multiple part files generated from Spark where the
@@ -45,18 +89,57 @@ def sync_stream(config, state, table_spec, stream, start_byte, end_byte, range_s
     # This means that we can't sync s3 buckets that are larger than
     # we can sort in memory which is suboptimal. If we could bookmark
     # based on anything else then we could just sync files as we see them.
-    for s3_file in sorted(s3_files, key=lambda item: item['key']):
-        LOGGER.info('syncing for file %s', s3_file['key'])
-        records_streamed += sync_table_file(
-            config, s3_file['key'], table_spec, stream, start_byte, end_byte, range_size, json_lib)
+    s3_files = sorted(s3_files, key=lambda item: item['key'])
+
+    # files before the file of the checkpoint are synced without checkpoints, which would replace it
+    checkpoint_key = checkpoint_bookmark.get('key') if checkpoint_bookmark else None
+    if not any(s3_file['key'] == checkpoint_key for s3_file in s3_files):
+        checkpoint_key = None
+
+    for s3_file in s3_files:
+        if manifest is not None:
+            if synced_until is not None and s3_file['last_modified'] <= synced_until:
+                manifest.complete(s3_file)
+            if manifest.is_synced(s3_file):
+                LOGGER.info('Skipping unchanged file %s', s3_file['key'])
+                unchanged_files += 1
+                continue
+            manifest.start(s3_file)
 
-        state = singer.write_bookmark(
-            state, table_name, 'modified_since', s3_file['last_modified'].isoformat())
-        singer.write_state(state)
+        file_checkpoint = None
+        if checkpoint_seconds and checkpoint_key in (None, s3_file['key']):
+            file_checkpoint = checkpoint.FileCheckpoint(
+                s3_file, write_checkpoint, checkpoint_seconds, singer.get_bookmark(state, table_name, 'checkpoint'))
 
-    if s3.skipped_files_count:
-        LOGGER.warn("%s files got skipped during the last sync.",
-                    s3.skipped_files_count)
+        if file_checkpoint is not None and file_checkpoint.is_at_end():
+            # every record was written before the run stopped, a ranged GET from the end of the file would fail
+            LOGGER.info('Skipping file %s, its checkpoint is at the end of the file', s3_file['key'])
+        else:
+            LOGGER.info('syncing for file %s', s3_file['key'])
+            records_streamed += sync_table_file(
+                config, s3_file['key'], table_spec, stream, start_byte, end_byte, range_size, json_lib,
+                file_checkpoint)
+
+        with STATE_LOCK:
+            if file_checkpoint is not None:
+                # the checkpoint the file was resumed from or wrote
+                singer.clear_bookmark(state, table_name, 'checkpoint')
+                checkpoint_key = None
+            if modified_since < s3_file['last_modified']:
+                state = singer.write_bookmark(
+                    state, table_name, 'modified_since', s3_file['last_modified'].isoformat())
+            if manifest is None:
+                messages.write_state(state)
+            else:
+                manifest.complete(s3_file)
+                if manifest.is_write_due():
+                    state = write_file_manifest(state, table_name, manifest)
+
+    if manifest is not None:
+        manifest.retain(s3_file['key'] for s3_file in s3_files)
+        with STATE_LOCK:
+            state = write_file_manifest(state, table_name, manifest)
+        LOGGER.info('Skipped %s unchanged files of table "%s".', unchanged_files, table_name)
 
     LOGGER.info('Wrote %s records for table "%s".',
                 records_streamed, table_name)
@@ -64,7 +147,14 @@ def sync_stream(config, state, table_spec, stream, start_byte, end_byte, range_s
     return records_streamed
 
 
-def sync_table_file(config, s3_path, table_spec, stream, byte_start, byte_end, range_size, json_lib='simple'):
+def write_file_manifest(state, table_name, manifest):
+    state = singer.write_bookmark(state, table_name, 'files', manifest.to_bookmark())
+    messages.write_state(state)
+    return state
+
+
+def sync_table_file(config, s3_path, table_spec, stream, byte_start, byte_end, range_size, json_lib='simple',
+                    file_checkpoint=None):
     extension = s3_path.split(".")[-1].lower()
     LOGGER.info('extension: %s', extension)
 
@@ -72,13 +162,14 @@ def sync_table_file(config, s3_path, table_spec, stream, byte_start, byte_end, r
     # added .csv_part* case to support tqp multi part file import
     if not extension or s3_path.lower() == extension:
         LOGGER.warning('"%s" without extension will not be synced.', s3_path)
-        s3.skipped_files_count = s3.skipped_files_count + 1
+        s3.count_skipped_file()
         return 0
     try:
         if extension == "zip":
             return sync_compressed_file(config, s3_path, table_spec, stream, byte_start, byte_end, range_size)
         if extension in ["csv", "gz", "jsonl", "txt"] or re.match(r'csv_part\d+', extension):
-            return handle_file(config, s3_path, table_spec, stream, extension, None, byte_start, byte_end, range_size, json_lib)
+            return handle_file(config, s3_path, table_spec, stream, extension, None, byte_start, byte_end, range_size, json_lib,
+                               file_checkpoint)
         LOGGER.warning(
             '"%s" having the ".%s" extension will not be synced.', s3_path, extension)
     except (UnicodeDecodeError, json.decoder.JSONDecodeError):
@@ -87,12 +178,13 @@ def sync_table_file(config, s3_path, table_spec, stream, byte_start, byte_end, r
         # Handled both error and skipping file with wrong extension.
         LOGGER.warning(
             "Skipping %s file as parsing failed. Verify an extension of the file.", s3_path)
-        s3.skipped_files_count = s3.skipped_files_count + 1
+        s3.count_skipped_file()
     return 0
 
 
 # pylint: disable=too-many-arguments
-def handle_file(config, s3_path, table_spec, stream, extension, file_handler=None, start_byte=None, end_byte=None, range_size=1024*1024, json_lib='simple'):
+def handle_file(config, s3_path, table_spec, stream, extension, file_handler=None, start_byte=None, end_byte=None, range_size=1024*1024, json_lib='simple',
+                file_checkpoint=None):
     """
     Used to sync normal supported files
     """
@@ -100,96 +192,132 @@ def handle_file(config, s3_path, table_spec, stream, extension, file_handler=Non
     # Check whether file is without extension or not
     if not extension or s3_path.lower() == extension:
         LOGGER.warning('"%s" without extension will not be synced.', s3_path)
-        s3.skipped_files_count = s3.skipped_files_count + 1
+        s3.count_skipped_file()
         return 0
 
     if extension == "gz":
         return sync_gz_file(config, s3_path, table_spec, stream, file_handler)
 
     if extension in ["csv", "txt"] or re.search(r'\.csv_part\d*$', s3_path):
-        fieldnames = None
-
-        col_order = stream.get('column_order', None)
-
-        if file_handler:
-            # If file is extracted from zip or gz use file object else get file object from s3 bucket
-            file_handle = file_handler
-        # support parallel import for both csv, txt files.
-        elif start_byte is not None and end_byte is not None:
-            if (col_order is None):
-                col_order = get_cols_from_metadata(stream)
-
-            if len(col_order) == 0:
-                raise Exception("Failed to get cols order")
-
-            file_handle = s3.get_csv_file(
-                config['bucket'], s3_path, start_byte, end_byte, range_size)
-            LOGGER.info('using S3 Get Range method for csv import')
-            # csv.DictReader will parse the first non-empty row as header if fieldnames == None, else as the first record.
-            # For parallel threads, non-first threads will not be able to grab headers from the first part of the data,
-            # so we need to pass in fieldnames. First thread needs to handle first row if table_spec.has_header == True in order to avoid
-            # having first row parsed as record when it's actually header. Set handle_first_row param for PreprocessStream to True
-            # for this case so that the file/stream pointer is moved to skip first row.
-
-            # with import file copy for sftp, catalog is different from csv one, column_order is not present, so using cols_from_metadata
-            file_handle = preprocess.PreprocessStream(
-                file_handle, table_spec, start_byte == 0 and table_spec.get('has_header', True))
+        metrics = pipeline.PipelineMetrics()
+        download = None
+        try:
+            fieldnames = None
+
+            col_order = stream.get('column_order', None)
+
+            if file_handler:
+                # If file is extracted from zip or gz use file object else get file object from s3 bucket
+                file_handle = file_handler
+            # support parallel import for both csv, txt files.
+            elif start_byte is not None and end_byte is not None:
+                if (col_order is None):
+                    col_order = get_cols_from_metadata(stream)
+
+                if len(col_order) == 0:
+                    raise Exception("Failed to get cols order")
+
+                file_handle = s3.get_csv_file(
+                    config['bucket'], s3_path, start_byte, end_byte, range_size)
+                LOGGER.info('using S3 Get Range method for csv import')
+                # csv.DictReader will parse the first non-empty row as header if fieldnames == None, else as the first record.
+                # For parallel threads, non-first threads will not be able to grab headers from the first part of the data,
+                # so we need to pass in fieldnames. First thread needs to handle first row if table_spec.has_header == True in order to avoid
+                # having first row parsed as record when it's actually header. Set handle_first_row param for PreprocessStream to True
+                # for this case so that the file/stream pointer is moved to skip first row.
+
+                # with import file copy for sftp, catalog is different from csv one, column_order is not present, so using cols_from_metadata
+                file_handle = preprocess.PreprocessStream(
+                    file_handle, table_spec, start_byte == 0 and table_spec.get('has_header', True))
 
-            fieldnames = col_order
+                fieldnames = col_order
 
-        else:
-            file_handle = s3.get_file_handle(config, s3_path)
-            LOGGER.info(
-                f'col_order is present: {col_order is not None and len(col_order) > 0}')
-            if col_order is not None and len(col_order) > 0:
-                # if filename is multipart file and part 2 or more, then has_header should be False as TQP part file export does not have header
-                if re.search(r'\.csv_part\d*$', s3_path):
-                    LOGGER.info(
-                        f'Using column order from stream metadata for {s3_path}')
+            else:
+                # offsets of records can only be found from the raw bytes when line endings are single bytes
+                if file_checkpoint and not decoding.nul_is_single_byte(table_spec.get('encoding', 'utf-8')):
+                    file_checkpoint = None
+                offset = file_checkpoint.offset if file_checkpoint else 0
+                file_handle = download = prefetch(config, s3.get_file_handle(config, s3_path, offset=offset), metrics)
+                if file_checkpoint:
+                    file_handle = file_checkpoint.track(file_handle)
+                LOGGER.info(
+                    f'col_order is present: {col_order is not None and len(col_order) > 0}')
+                if offset:
+                    # resuming from a checkpoint, the header rows are before the offset and the columns come from the catalog
+                    if col_order is None or len(col_order) == 0:
+                        col_order = get_cols_from_metadata(stream)
+                    if len(col_order) == 0:
+                        raise Exception("Failed to get cols order")
                     file_handle = preprocess.PreprocessStream(
-                        file_handle, table_spec, False)
+                        file_handle, {**table_spec, 'skip_header_row': 0}, False)
+                    fieldnames = col_order
+                elif col_order is not None and len(col_order) > 0:
+                    # if filename is multipart file and part 2 or more, then has_header should be False as TQP part file export does not have header
+                    if re.search(r'\.csv_part\d*$', s3_path):
+                        LOGGER.info(
+                            f'Using column order from stream metadata for {s3_path}')
+                        file_handle = preprocess.PreprocessStream(
+                            file_handle, table_spec, False)
+                    else:
+                        # same as above but for single thread. Set handle_first_row param to True if table_spec.has_header == True to avoid
+                        # having header row parsed as first record
+                        file_handle = preprocess.PreprocessStream(
+                            file_handle, table_spec, table_spec.get('has_header', True))
+                    fieldnames = col_order
                 else:
-                    # same as above but for single thread. Set handle_first_row param to True if table_spec.has_header == True to avoid
-                    # having header row parsed as first record
+                    # If col_order isn't present, that means we didn't do discovery with this tap - this occurs during TQP imports
+                    # Pass parameters to PreprocessStream to guarantee header property is set, so we can use it in place of 'col_order'
                     file_handle = preprocess.PreprocessStream(
-                        file_handle, table_spec, table_spec.get('has_header', True))
-                fieldnames = col_order
-            else:
-                # If col_order isn't present, that means we didn't do discovery with this tap - this occurs during TQP imports
-                # Pass parameters to PreprocessStream to guarantee header property is set, so we can use it in place of 'col_order'
-                file_handle = preprocess.PreprocessStream(
-                    file_handle, table_spec, True, s3_path, config)
-                fieldnames = file_handle.header
-                # write fieldnames to column order so that if multi part file type, subsequent parts can use it
-                stream['column_order'] = fieldnames
-
-        return sync_csv_file(config, file_handle, s3_path, table_spec, stream, json_lib, fieldnames)
+                        file_handle, table_spec, True)
+                    fieldnames = file_handle.header
+                    # write fieldnames to column order so that if multi part file type, subsequent parts can use it
+                    stream['column_order'] = fieldnames
+
+            return sync_csv_file(config, file_handle, s3_path, table_spec, stream, json_lib, fieldnames, metrics,
+                                 file_checkpoint)
+        finally:
+            # stops the download thread when the file was not read to the end
+            if isinstance(download, pipeline.PrefetchReader):
+                download.close()
 
     if extension == "jsonl":
 
+        metrics = pipeline.PipelineMetrics()
         # If file is extracted from zip or gz use file object else get file object from s3 bucket
-        file_handle = file_handler if file_handler else s3.get_file_handle(
-            config, s3_path)._raw_stream
-        records = sync_jsonl_file(
-            config, file_handle, s3_path, table_spec, stream)
+        file_handle = file_handler if file_handler else prefetch(config, s3.get_file_handle(
+            config, s3_path)._raw_stream, metrics)
+        try:
+            records = sync_jsonl_file(
+                config, file_handle, s3_path, table_spec, stream, json_lib, metrics)
+        finally:
+            if isinstance(file_handle, pipeline.PrefetchReader):
+                file_handle.close()
         if records == 0:
             # Only space isn't the valid JSON but it is a valid CSV header hence skipping the jsonl file with only space.
-            s3.skipped_files_count = s3.skipped_files_count + 1
+            s3.count_skipped_file()
             LOGGER.warning('Skipping "%s" file as it is empty', s3_path)
         return records
 
     if extension == "zip":
         LOGGER.warning(
             'Skipping "%s" file as it contains nested compression.', s3_path)
-        s3.skipped_files_count = s3.skipped_files_count + 1
+        s3.count_skipped_file()
         return 0
 
     LOGGER.warning(
         '"%s" having the ".%s" extension will not be synced.', s3_path, extension)
-    s3.skipped_files_count = s3.skipped_files_count + 1
+    s3.count_skipped_file()
     return 0
 
 
+def prefetch(config, file_handle, metrics):
+    # S3 bodies are read ahead on a download thread, unless sync_prefetch_blocks is 0
+    prefetch_blocks = config.get('sync_prefetch_blocks', pipeline.PREFETCH_BLOCKS)
+    if not prefetch_blocks or not hasattr(file_handle, 'read'):
+        return file_handle
+    return pipeline.PrefetchReader(file_handle, metrics, prefetch_blocks)
+
+
 def get_cols_from_metadata(stream):
     try:
         mdata = metadata.to_map(stream['metadata'])
@@ -210,39 +338,42 @@ def sync_gz_file(config, s3_path, table_spec, stream, file_handler):
     if s3_path.endswith(".tar.gz"):
         LOGGER.warning(
             'Skipping "%s" file as .tar.gz extension is not supported', s3_path)
-        s3.skipped_files_count = s3.skipped_files_count + 1
+        s3.count_skipped_file()
         return 0
 
     # If file is extracted from zip use file object else get file object from s3 bucket
     file_object = file_handler if file_handler else s3.get_file_handle(
         config, s3_path)
 
-    file_bytes = file_object.read()
-    gz_file_obj = gzip.GzipFile(fileobj=io.BytesIO(file_bytes))
+    # the compressed file is buffered (spilled to disk above the memory budget) to read the file name from the
+    # gzip header first, then decompressed while it is synced
+    with spill.SpillBuffer() as compressed:
+        compressed.copy_from(file_object)
 
-    # pylint: disable=duplicate-code
-    try:
-        gz_file_name = utils.get_file_name_from_gzfile(
-            fileobj=io.BytesIO(file_bytes))
-    except AttributeError as err:
-        # If a file is compressed using gzip command with --no-name attribute,
-        # It will not return the file name and timestamp. Hence we will skip such files.
-        # We also seen this issue occur when tar is used to compress the file
-        LOGGER.warning(
-            'Skipping "%s" file as we did not get the original file name', s3_path)
-        s3.skipped_files_count = s3.skipped_files_count + 1
-        return 0
-
-    if gz_file_name:
-
-        if gz_file_name.endswith(".gz"):
+        # pylint: disable=duplicate-code
+        try:
+            gz_file_name = utils.get_file_name_from_gzfile(
+                fileobj=compressed.getfile())
+        except AttributeError as err:
+            # If a file is compressed using gzip command with --no-name attribute,
+            # It will not return the file name and timestamp. Hence we will skip such files.
+            # We also seen this issue occur when tar is used to compress the file
             LOGGER.warning(
-                'Skipping "%s" file as it contains nested compression.', s3_path)
-            s3.skipped_files_count = s3.skipped_files_count + 1
+                'Skipping "%s" file as we did not get the original file name', s3_path)
+            s3.count_skipped_file()
             return 0
 
-        gz_file_extension = gz_file_name.split(".")[-1].lower()
-        return handle_file(config, s3_path + "/" + gz_file_name, table_spec, stream, gz_file_extension, io.BytesIO(gz_file_obj.read()))
+        if gz_file_name:
+
+            if gz_file_name.endswith(".gz"):
+                LOGGER.warning(
+                    'Skipping "%s" file as it contains nested compression.', s3_path)
+                s3.count_skipped_file()
+                return 0
+
+            gz_file_obj = gzip.GzipFile(fileobj=compressed.getfile())
+            gz_file_extension = gz_file_name.split(".")[-1].lower()
+            return handle_file(config, s3_path + "/" + gz_file_name, table_spec, stream, gz_file_extension, gz_file_obj)
 
     raise Exception('"{}" file has some error(s)'.format(s3_path))
 
@@ -253,27 +384,72 @@ def sync_compressed_file(config, s3_path, table_spec, stream):
     records_streamed = 0
     s3_file_handle = s3.get_file_handle(config, s3_path)
 
-    decompressed_files = compression.infer(
-        io.BytesIO(s3_file_handle.read()), s3_path)
+    # zip archives are read from their central directory at the end, so the whole archive is buffered
+    with spill.SpillBuffer() as archive:
+        decompressed_files = compression.infer(
+            archive.copy_from(s3_file_handle).getfile(), s3_path)
 
-    for decompressed_file in decompressed_files:
-        extension = decompressed_file.name.split(".")[-1].lower()
+        for decompressed_file in decompressed_files:
+            extension = decompressed_file.name.split(".")[-1].lower()
 
-        if extension in ["csv", "jsonl", "gz", "txt"]:
-            # Append the extracted file name with zip file.
-            s3_file_path = s3_path + "/" + decompressed_file.name
+            if extension in ["csv", "jsonl", "gz", "txt"]:
+                # Append the extracted file name with zip file.
+                s3_file_path = s3_path + "/" + decompressed_file.name
 
-            records_streamed += handle_file(config, s3_file_path, table_spec,
-                                            stream, extension, decompressed_file)
+                records_streamed += handle_file(config, s3_file_path, table_spec,
+                                                stream, extension, decompressed_file)
 
     return records_streamed
 
 
-def sync_csv_file(config, file_handle, s3_path, table_spec, stream, json_lib='simple', fieldnames=None):
+def get_csv_transform_plan(stream, memo_size=0):
+    mdata = metadata.to_map(stream['metadata'])
+    auto_fields, filter_fields, source_type_map = transform.resolve_filter_fields(
+        mdata)
+
+    tfm = transform.Transformer(
+        source_type_map, column_date_format=stream.get('column_date_format'), memo_size=memo_size)
+    # modify schema in-place to put null as the last type to check for
+    # e.g. ['null', 'integer'] -> ['integer', 'null']
+    tfm.transform_schema_recur(stream['schema'])
+    return tfm, tfm.compile_plan(stream['schema'], auto_fields, filter_fields)
+
+
+def csv_row_transformer(tfm, plan):
+    def transform_row(row):
+        record = plan.transform(row)
+        tfm.cleanup()
+        return record
+    return transform_row
+
+
+def get_csv_row_transformer(stream, memo_size, skip_filtered_fields):
+    # builds the row transform and plan of a transform worker process
+    tfm, plan = get_csv_transform_plan(stream, memo_size)
+    if skip_filtered_fields:
+        plan.skip_filtered_fields()
+    return csv_row_transformer(tfm, plan), plan
+
+
+def write_batches(table_name, batches, json_lib, metrics, file_checkpoint=None):
+    records_synced = 0
+    for records in batches:
+        start = time.perf_counter()
+        messages.write_records(table_name, records, json_lib)
+        if file_checkpoint:
+            file_checkpoint.written(len(records))
+        metrics.busy_seconds['write'] += time.perf_counter() - start
+        records_synced += len(records)
+    return records_synced
+
+
+def sync_csv_file(config, file_handle, s3_path, table_spec, stream, json_lib='simple', fieldnames=None, metrics=None,
+                  file_checkpoint=None):
     LOGGER.info('Syncing file "%s".', s3_path)
 
     row_limit = table_spec.get('row_limit', None)
     table_name = table_spec['table_name']
+    metrics = metrics or pipeline.PipelineMetrics()
 
     # We observed data who's field size exceeded the default maximum of
     # 131072. We believe the primary consequence of the following setting
@@ -283,88 +459,108 @@ def sync_csv_file(config, file_handle, s3_path, table_spec, stream, json_lib='si
     # need to be fixed. The other consequence of this could be larger
     # memory consumption but that's acceptable as well.
     csv.field_size_limit(sys.maxsize)
+
+    memo_size = config.get('conversion_memo_size', 0)
+    tfm, plan = get_csv_transform_plan(stream, memo_size)
+
+    # deselected columns are dropped by the reader rather than after the record is built
     iterator = csv_iterator.get_row_iterator(
-        file_handle, table_spec, fieldnames, row_limit)
+        file_handle, table_spec, fieldnames, row_limit, plan.filtered_fields)
+    projected = isinstance(iterator, csv_iterator.ProjectedReader)
+    if projected:
+        plan.skip_filtered_fields()
 
     records_synced = 0
-    records_buffer = []
 
     if iterator:
-        mdata = metadata.to_map(stream['metadata'])
-        auto_fields, filter_fields, source_type_map = transform.resolve_filter_fields(
-            mdata)
-
-        tfm = transform.Transformer(source_type_map)
-        # modify schema in-place to put null as the last type to check for
-        # e.g. ['null', 'integer'] -> ['integer', 'null']
-        tfm.transform_schema_recur(stream['schema'])
-
+        transform_stage = pipeline.TransformStage(
+            csv_row_transformer(tfm, plan), metrics, config.get('sync_transform_workers', 1),
+            get_csv_row_transformer, (stream, memo_size, projected))
+        batches = pipeline.iter_batches(iterator, BUFFER_SIZE, metrics)
+        if file_checkpoint and file_checkpoint.offsets is not None:
+            batches = file_checkpoint.iter_batches(batches, lambda: file_handle.lines_skipped + iterator.line_num)
+        else:
+            file_checkpoint = None
         try:
-            for row in iterator:
-                # Skipping the empty line of CSV
-                if len(row) == 0:
-                    continue
-                # LOGGER.info(f'row: {row}')
-                to_write = tfm.transform(
-                    row, stream['schema'], auto_fields, filter_fields)
-                tfm.cleanup()
-
-                records_buffer.append(to_write)
-
-                if len(records_buffer) >= BUFFER_SIZE:
-                    messages.write_records(
-                        table_name, records_buffer, json_lib)
-                    records_synced += len(records_buffer)
-                    records_buffer.clear()
+            records_synced = write_batches(table_name, transform_stage.map(batches), json_lib, metrics, file_checkpoint)
         except UnicodeError:
             raise SymonException(
                 "Sorry, we can't decode your file. Please try using UTF-8 or UTF-16 encoding for your file.", 'UnsupportedEncoding')
+        finally:
+            transform_stage.close()
+
+        plan.add_memo_counts(transform_stage.memo_counts)
+        log_memo_hit_rates(s3_path, plan)
+        metrics.log(s3_path, records_synced)
     else:
         LOGGER.warning('Skipping "%s" file as it is empty', s3_path)
-        s3.skipped_files_count = s3.skipped_files_count + 1
-
-    if len(records_buffer) > 0:
-        messages.write_records(table_name, records_buffer, json_lib)
-        records_synced += len(records_buffer)
+        s3.count_skipped_file()
 
     return records_synced
 
 
-def sync_jsonl_file(config, iterator, s3_path, table_spec, stream):
-    LOGGER.info('Syncing file "%s".', s3_path)
+def log_memo_hit_rates(s3_path, plan):
+    hit_rates = plan.get_memo_hit_rates()
+    if hit_rates:
+        LOGGER.info('%s %s', utils.IMPORT_PERF_METRICS_LOG_PREFIX, json.dumps(
+            {'file': s3_path, 'conversion_memo_hit_rates': hit_rates}))
 
-    table_name = table_spec['table_name']
 
-    records_synced = 0
-    records_buffer = []
+def parse_jsonl_line(line):
+    """
+    Parses a jsonl line with orjson, blank lines give an empty row. Lines orjson rejects are parsed with json
+    instead, so the values only json accepts (NaN, lone surrogates...) and the errors raised stay the same.
+    """
+    try:
+        if LONG_DIGITS not in line.translate(DIGITS_TABLE):
+            return orjson.loads(line)
+    except orjson.JSONDecodeError:
+        pass
+
+    decoded_row = line.decode('utf-8')
+    if not decoded_row.strip():
+        return {}
+    return json.loads(decoded_row)
+
 
+def get_jsonl_transform_plan(stream, memo_size=0):
     mdata = metadata.to_map(stream['metadata'])
     auto_fields, filter_fields, source_type_map = transform.resolve_filter_fields(
         mdata)
 
-    for row in iterator:
-        decoded_row = row.decode('utf-8')
-        if decoded_row.strip():
-            row = json.loads(decoded_row)
-            # Skipping the empty json row.
-            if len(row) == 0:
-                continue
-        else:
-            continue
+    transformer = transform.Transformer(source_type_map, column_date_format=stream.get('column_date_format'),
+                                        memo_size=memo_size)
+    return transformer, transformer.compile_plan(stream['schema'], auto_fields, filter_fields)
+
 
-        with transform.Transformer(source_type_map) as transformer:
-            to_write = transformer.transform(
-                row, stream['schema'], auto_fields, filter_fields)
+def get_jsonl_row_transformer(stream, memo_size):
+    # builds the row transform and plan of a transform worker process
+    _, plan = get_jsonl_transform_plan(stream, memo_size)
+    return plan.transform, plan
 
-        records_buffer.append(to_write)
 
-        if len(records_buffer) >= BUFFER_SIZE:
-            messages.write_records(table_name, records_buffer)
-            records_synced += len(records_buffer)
-            records_buffer.clear()
+def sync_jsonl_file(config, iterator, s3_path, table_spec, stream, json_lib='simple', metrics=None):
+    LOGGER.info('Syncing file "%s".', s3_path)
+
+    table_name = table_spec['table_name']
+    metrics = metrics or pipeline.PipelineMetrics()
+
+    memo_size = config.get('conversion_memo_size', 0)
+    transformer, plan = get_jsonl_transform_plan(stream, memo_size)
+
+    with transformer:
+        transform_stage = pipeline.TransformStage(
+            plan.transform, metrics, config.get('sync_transform_workers', 1),
+            get_jsonl_row_transformer, (stream, memo_size))
+        try:
+            # Skipping the blank line and the empty json row.
+            records_synced = write_batches(table_name, transform_stage.map(
+                pipeline.iter_batches(map(parse_jsonl_line, iterator), BUFFER_SIZE, metrics)), json_lib, metrics)
+        finally:
+            transform_stage.close()
 
-    if len(records_buffer) > 0:
-        messages.write_records(table_name, records_buffer)
-        records_synced += len(records_buffer)
+        plan.add_memo_counts(transform_stage.memo_counts)
+        log_memo_hit_rates(s3_path, plan)
 
+    metrics.log(s3_path, records_synced)
     return records_synced
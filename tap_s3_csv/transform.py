@@ -1,13 +1,17 @@
 from dataclasses import replace
 import datetime
 import decimal
+import functools
 import logging
 import re
 
+import ciso8601
 import singer.metadata
 from singer.logger import get_logger
 from singer.utils import (strftime, strptime_to_utc)
 
+from tap_s3_csv import conversion
+
 LOGGER = get_logger()
 
 NO_INTEGER_DATETIME_PARSING = 'no-integer-datetime-parsing'
@@ -21,7 +25,87 @@ VALID_DATETIME_FORMATS = [
 ]
 
 
-def string_to_datetime(value):
+# Discovered date formats (column_date_format) whose values ciso8601 parses
+ISO_DATE_FORMATS = ['YYYY-MM-DD']
+
+DATE_DIRECTIVE_GROUPS = {
+    '%Y': r'(\d{4})',
+    '%m': r'(\d{1,2})',
+    '%d': r'(\d{1,2})',
+}
+
+# Time part of every format conversion.generate_date_format_mapping pairs with a date base, hours to offset
+DATE_TIME_PATTERN = r'(?:[ T](\d{1,2}):(\d{1,2}):(\d{1,2})(?:\.(\d{1,6}))?(?:Z|([+-])(\d{2}):?(\d{2}))?)?'
+
+
+def _to_utc(dtime):
+    # same as singer's strptime_to_utc
+    if dtime.tzinfo is None:
+        return dtime.replace(tzinfo=datetime.timezone.utc)
+    return dtime.astimezone(datetime.timezone.utc)
+
+
+def _parse_iso_date(value):
+    # ciso8601 also parses reduced and week dates and hour 24 (as midnight of the next day), which dateutil reads
+    # differently or rejects
+    if value[4:5] != '-' or value[7:8] != '-' or value[11:13] == '24':
+        return None
+    try:
+        return _to_utc(ciso8601.parse_datetime(value))
+    except (ValueError, OverflowError):
+        return None
+
+
+def _compile_date_pattern(base_fmt):
+    pattern = re.escape(base_fmt)
+    for directive, group in DATE_DIRECTIVE_GROUPS.items():
+        pattern = pattern.replace(re.escape(directive), group)
+    # the date groups in the order they appear in the format
+    order = sorted(DATE_DIRECTIVE_GROUPS, key=base_fmt.index)
+    return re.compile(pattern + DATE_TIME_PATTERN, re.IGNORECASE), [order.index(directive) for directive in ['%Y', '%m', '%d']]
+
+
+@functools.lru_cache(maxsize=None)
+def get_date_parser(date_format):
+    """
+    Returns a function parsing values of a column discovered with date_format (e.g. 'MM/DD/YYYY') into a UTC
+    datetime, or returning None when a value does not have that format. ISO dates are parsed with ciso8601, other
+    formats with one precompiled pattern covering the date alone and every time suffix discovery accepts.
+    """
+    if date_format in ISO_DATE_FORMATS:
+        return _parse_iso_date
+
+    base_fmts = [fmt for fmt, name in conversion.DATE_BASES.items() if name == date_format]
+    if not base_fmts:
+        return None
+    pattern, date_groups = _compile_date_pattern(base_fmts[0])
+
+    def parse(value):
+        match = pattern.fullmatch(value)
+        if not match:
+            return None
+        groups = match.groups()
+        hour, minute, second, fraction, sign, offset_hours, offset_minutes = groups[3:]
+        try:
+            dtime = datetime.datetime(
+                int(groups[date_groups[0]]), int(groups[date_groups[1]]), int(groups[date_groups[2]]),
+                int(hour or 0), int(minute or 0), int(second or 0), int(fraction.ljust(6, '0')) if fraction else 0)
+            if sign:
+                offset = datetime.timedelta(hours=int(offset_hours), minutes=int(offset_minutes))
+                dtime = dtime.replace(tzinfo=datetime.timezone(-offset if sign == '-' else offset))
+            return _to_utc(dtime)
+        except (ValueError, OverflowError):
+            return None
+    return parse
+
+
+def string_to_datetime(value, parse_date=None):
+    # the discovered format of the column is tried before the generic parser
+    if parse_date is not None and type(value) is str:
+        dtime = parse_date(value)
+        if dtime is not None:
+            return strftime(dtime)
+
     try:
         return strftime(strptime_to_utc(value))
     except Exception as ex:
@@ -37,6 +121,117 @@ def unix_seconds_to_datetime(value):
     return strftime(datetime.datetime.fromtimestamp(int(value), datetime.timezone.utc))
 
 
+# Returned by the value converters when a value does not convert, None being a valid result
+_FAILED = object()
+
+# csv rows only hold these types, which string source types pass through unchanged
+_PASS_THROUGH_TYPES = frozenset([str, type(None)])
+
+# With a memo_size, the conversions of columns that are not passed through are memoized per column. Every
+# MEMO_CHECK_ROWS rows, columns whose hit rate over those rows is below MEMO_MIN_HIT_RATE stop being memoized.
+MEMO_CHECK_ROWS = 1000
+MEMO_MIN_HIT_RATE = 0.5
+
+
+def _to_string(data):
+    if data is None:
+        return _FAILED
+    try:
+        return str(data)
+    except:
+        return _FAILED
+
+
+def _to_integer(data):
+    if isinstance(data, str):
+        data = data.replace(",", "")
+
+    try:
+        return int(data)
+    except:
+        return _FAILED
+
+
+def _to_number(data):
+    if isinstance(data, str):
+        data = data.replace(",", "")
+
+    try:
+        return float(data)
+    except:
+        return _FAILED
+
+
+def _to_boolean(data):
+    if isinstance(data, str) and data.lower() == "false":
+        return False
+
+    try:
+        return bool(data)
+    except:
+        return _FAILED
+
+
+def _to_null(data):
+    if data is None or data == '' or data == '<null>':
+        return None
+    return _FAILED
+
+
+def _to_decimal(data):
+    if data is None:
+        return _FAILED
+
+    if isinstance(data, (str, float, int)):
+        try:
+            return str(decimal.Decimal(str(data)))
+        except:
+            return _FAILED
+    elif isinstance(data, decimal.Decimal):
+        try:
+            if data.is_snan():
+                return 'NaN'
+            else:
+                return str(data)
+        except:
+            return _FAILED
+
+    return _FAILED
+
+
+def _fail(data):
+    return _FAILED
+
+
+VALUE_CONVERTERS = {
+    'string': _to_string,
+    'integer': _to_integer,
+    'number': _to_number,
+    'boolean': _to_boolean,
+    'null': _to_null,
+}
+
+
+def _string_or_null(data):
+    # the converter of the 'string' source type every discovered csv column has
+    if type(data) is str:
+        return data
+    result = _to_string(data)
+    return _to_null(data) if result is _FAILED else result
+
+
+def _source_type_converter(source_type):
+    if source_type == 'string':
+        return _string_or_null
+    convert = VALUE_CONVERTERS.get(source_type, _fail)
+
+    def convert_source_type(data):
+        result = convert(data)
+        # if source_type is available, it will only have one value i.e. 'string', but it should also be nullable
+        return _to_null(data) if result is _FAILED else result
+    return convert_source_type
+
+
 def breadcrumb_path(breadcrumb):
     """
     Transform breadcrumb into familiar object dot-notation
@@ -60,6 +255,16 @@ class SchemaMismatch(Exception):
 
         super().__init__(msg)
 
+    def __reduce__(self):
+        # raised in a transform worker process, rebuilt from its message in the sync process
+        return _schema_mismatch_from_message, (str(self),)
+
+
+def _schema_mismatch_from_message(message):
+    error = SchemaMismatch.__new__(SchemaMismatch)
+    Exception.__init__(error, message)
+    return error
+
 
 class SchemaKey:
     ref = '$ref'
@@ -94,8 +299,13 @@ class Error:
 
 
 class Transformer:
-    def __init__(self, source_type_map, integer_datetime_fmt=NO_INTEGER_DATETIME_PARSING, pre_hook=None):
+    def __init__(self, source_type_map, integer_datetime_fmt=NO_INTEGER_DATETIME_PARSING, pre_hook=None,
+                 column_date_format=None, memo_size=0):
         self.integer_datetime_fmt = integer_datetime_fmt
+        self.memo_size = memo_size
+        # date parsers of the top level properties, from the column_date_format found by discovery
+        self.date_parsers = {column: get_date_parser(date_format)
+                             for column, date_format in (column_date_format or {}).items()}
         self.pre_hook = pre_hook
         self.removed = set()
         self.filtered = set()
@@ -163,6 +373,66 @@ class Transformer:
 
         return transformed_data
 
+    def compile_plan(self, schema, auto_fields, filter_fields):
+        """
+        Compiles the schema, metadata filters and source types of a stream once into a TransformPlan, which
+        transforms records the same way transform does.
+        """
+        return TransformPlan(self, schema, auto_fields, filter_fields)
+
+    def compile_converter(self, schema, key):
+        """
+        Returns a callable converting the values of the top level property key the way transform_recur does, which
+        returns _FAILED when the value does not match the schema, or None when values are left as they are.
+        """
+        source_type = self.source_type_map.get(key)
+
+        if 'anyOf' in schema or self.pre_hook or not isinstance(schema.get('type', []), list):
+            return self._generic_converter(schema, key, source_type)
+        if 'type' not in schema:
+            return None
+
+        types = schema['type']
+        if source_type:
+            # every type gets the same result when a source type is given
+            return _source_type_converter(source_type) if types else _fail
+
+        attempts = []
+        for typ in types:
+            if typ == 'null':
+                attempts.append(_to_null)
+            elif schema.get('format') == 'date-time':
+                attempts.append(self._datetime_converter(key))
+            elif schema.get('format') == 'singer.decimal':
+                attempts.append(_to_decimal)
+            elif typ in ['object', 'array']:
+                return self._generic_converter(schema, key, source_type)
+            else:
+                attempts.append(VALUE_CONVERTERS.get(typ, _fail))
+
+        if len(attempts) == 1:
+            return attempts[0]
+
+        def convert(data):
+            for attempt in attempts:
+                result = attempt(data)
+                if result is not _FAILED:
+                    return result
+            return _FAILED
+        return convert
+
+    def _generic_converter(self, schema, key, source_type):
+        def convert(data):
+            success, result = self.transform_recur(data, schema, [key], source_type)
+            return result if success else _FAILED
+        return convert
+
+    def _datetime_converter(self, key):
+        def convert_datetime(data):
+            data = self._transform_datetime(data, key)
+            return _FAILED if data is None else data
+        return convert_datetime
+
     def transform_recur(self, data, schema, path, source_type=None):
         if 'anyOf' in schema:
             return self._transform_anyof(data, schema, path)
@@ -272,15 +542,16 @@ class Transformer:
 
         return all(successes), result
 
-    def _transform_datetime(self, value):
+    def _transform_datetime(self, value, key=None):
         if value is None or value == '':
             return None  # Short circuit in the case of null or empty string
 
         if self.integer_datetime_fmt not in VALID_DATETIME_FORMATS:
             raise Exception('Invalid integer datetime parsing option')
 
+        parse_date = self.date_parsers.get(key)
         if self.integer_datetime_fmt == NO_INTEGER_DATETIME_PARSING:
-            return string_to_datetime(value)
+            return string_to_datetime(value, parse_date)
         else:
             try:
                 if self.integer_datetime_fmt == UNIX_SECONDS_INTEGER_DATETIME_PARSING:
@@ -288,53 +559,13 @@ class Transformer:
                 else:
                     return unix_milliseconds_to_datetime(value)
             except:
-                return string_to_datetime(value)
+                return string_to_datetime(value, parse_date)
 
     def _get_transformvalue_by_type(self, data, type):
-        if type == 'string':
-            if data is not None:
-                try:
-                    return True, str(data)
-                except:
-                    return False, None
-            else:
-                return False, None
-
-        elif type == 'integer':
-            if isinstance(data, str):
-                data = data.replace(",", "")
-
-            try:
-                return True, int(data)
-            except:
-                return False, None
-
-        elif type == 'number':
-            if isinstance(data, str):
-                data = data.replace(",", "")
-
-            try:
-                return True, float(data)
-            except:
-                return False, None
-
-        elif type == 'boolean':
-            if isinstance(data, str) and data.lower() == "false":
-                return True, False
-
-            try:
-                return True, bool(data)
-            except:
-                return False, None
-
-        elif type == 'null':
-            if data is None or data == '' or data == '<null>':
-                return True, None
-            else:
-                return False, None
-
-        else:
+        result = VALUE_CONVERTERS.get(type, _fail)(data)
+        if result is _FAILED:
             return False, None
+        return True, result
 
     def _transform(self, data, typ, schema, path, source_type=None):
         if source_type:
@@ -355,30 +586,18 @@ class Transformer:
                 return False, None
 
         elif schema.get('format') == 'date-time':
-            data = self._transform_datetime(data)
+            # only top level properties have a discovered date format
+            data = self._transform_datetime(data, path[0] if len(path) == 1 else None)
             if data is None:
                 return False, None
 
             return True, data
         elif schema.get('format') == 'singer.decimal':
-            if data is None:
+            data = _to_decimal(data)
+            if data is _FAILED:
                 return False, None
 
-            if isinstance(data, (str, float, int)):
-                try:
-                    return True, str(decimal.Decimal(str(data)))
-                except:
-                    return False, None
-            elif isinstance(data, decimal.Decimal):
-                try:
-                    if data.is_snan():
-                        return True, 'NaN'
-                    else:
-                        return True, str(data)
-                except:
-                    return False, None
-
-            return False, None
+            return True, data
         elif typ == 'object':
             # Objects do not necessarily specify properties
             return self._transform_object(data,
@@ -393,6 +612,183 @@ class Transformer:
             return self._get_transformvalue_by_type(data, typ)
 
 
+class TransformPlan:
+    """
+    Transforms the records of a stream with one converter per top level property, compiled once from the schema,
+    instead of walking the schema for every value. Rows of strings whose properties all have the 'string' source
+    type, as discovered csv tables have, are passed through without converting anything. Records the plan cannot
+    handle, and records that fail to convert, go through Transformer.transform so the output and the SchemaMismatch
+    raised are the same.
+    """
+
+    def __init__(self, transformer, schema, auto_fields, filter_fields):
+        self.transformer = transformer
+        self.schema = schema
+        self.auto_fields = auto_fields
+        self.filter_fields = filter_fields
+
+        self.converters = None
+        self.filtered_fields = {}
+        self.memos = {}
+        self.memo_stats = {}
+        # hits and lookups of every memo when check_memos and get_memo_counts last looked at them
+        self.memo_check_counts = {}
+        self.memo_sent_counts = {}
+        # hits and lookups of the memos of the transform workers, per column
+        self.worker_memo_counts = {}
+        self.rows = 0
+        if not self._is_compilable():
+            return
+
+        self.converters = {key: transformer.compile_converter(sub_schema, key)
+                           for key, sub_schema in schema['properties'].items()}
+        self.fields = frozenset(self.converters)
+        # converters still needed for rows of strings
+        self.string_converters = [(key, convert) for key, convert in self.converters.items()
+                                  if convert is not None and convert is not _string_or_null]
+
+        # memos only see rows of strings, so their values are always hashable
+        if transformer.memo_size:
+            self.memos = {key: functools.lru_cache(transformer.memo_size, typed=True)(convert)
+                          for key, convert in self.string_converters}
+            self.string_converters = [(key, self.memos[key]) for key, _ in self.string_converters]
+            self.memo_stats = {key: {'hits': 0, 'lookups': 0, 'disabled': False} for key in self.memos}
+
+        # top level properties dropped by filter_data_by_metadata
+        for breadcrumb in filter_fields:
+            if breadcrumb not in auto_fields:
+                self.filtered_fields[breadcrumb[1]] = breadcrumb_path(breadcrumb)
+
+    def _is_compilable(self):
+        schema = self.schema
+        if self.transformer.pre_hook or 'anyOf' in schema or 'format' in schema:
+            return False
+        if not schema.get('properties') or SchemaKey.pattern_properties in schema:
+            return False
+        # nested filters apply inside values
+        if any(len(breadcrumb) != 2 or breadcrumb[0] != 'properties' for breadcrumb in self.filter_fields):
+            return False
+
+        # the object type has to be the first one a dict can match
+        types = schema.get('type')
+        if not isinstance(types, list) or 'object' not in types:
+            return False
+        return all(typ == 'null' for typ in types[:types.index('object')])
+
+    def transform(self, data):
+        if self.converters is None or type(data) is not dict:
+            self.transformer.errors.clear()
+            return self.transformer.transform(data, self.schema, self.auto_fields, self.filter_fields)
+
+        if self.filtered_fields:
+            for field_name in self.filtered_fields.keys() & data.keys():
+                data.pop(field_name)
+                # Track that a field was filtered because the customer
+                # didn't select it or the tap declared it as unsupported.
+                self.transformer.filtered.add(self.filtered_fields[field_name])
+
+        if data.keys() <= self.fields and _PASS_THROUGH_TYPES.issuperset(map(type, data.values())):
+            if not self.string_converters:
+                return data
+            if self.memos:
+                self.rows += 1
+                if self.rows % MEMO_CHECK_ROWS == 0:
+                    self.check_memos()
+            result = dict(data)
+            for key, convert in self.string_converters:
+                if key in result:
+                    value = convert(result[key])
+                    if value is _FAILED:
+                        return self._transform_failed(data)
+                    result[key] = value
+            return result
+
+        result = {}
+        converters = self.converters
+        for key, value in data.items():
+            if key in converters:
+                convert = converters[key]
+                if convert is not None:
+                    value = convert(value)
+                    if value is _FAILED:
+                        return self._transform_failed(data)
+                result[key] = value
+            else:
+                # same as Transformer._transform_object, the field is not in the schema
+                self.transformer.removed.add(str(key))
+        return result
+
+    def skip_filtered_fields(self):
+        # the reader already leaves the filtered fields out of the records
+        self.filtered_fields = {}
+
+    def _update_memo_stats(self):
+        # hits and lookups of every memo so far, disabled memos keep theirs
+        for key, memo in self.memos.items():
+            info = memo.cache_info()
+            stats = self.memo_stats[key]
+            stats['hits'], stats['lookups'] = info.hits, info.hits + info.misses
+
+    def _get_memo_window(self, last_counts):
+        # hits and lookups of every memo since the counts in last_counts, which are moved to the current ones
+        self._update_memo_stats()
+        window = {}
+        for key, stats in self.memo_stats.items():
+            last_hits, last_lookups = last_counts.get(key, (0, 0))
+            window[key] = (stats['hits'] - last_hits, stats['lookups'] - last_lookups)
+            last_counts[key] = (stats['hits'], stats['lookups'])
+        return window
+
+    def check_memos(self):
+        disabled = set()
+        for key, (hits, lookups) in self._get_memo_window(self.memo_check_counts).items():
+            if key in self.memos and lookups and hits < lookups * MEMO_MIN_HIT_RATE:
+                self.memo_stats[key]['disabled'] = True
+                self.memos[key].cache_clear()
+                disabled.add(key)
+
+        if disabled:
+            # high cardinality columns go back to converting every value
+            self.string_converters = [(key, convert.__wrapped__ if key in disabled else convert)
+                                      for key, convert in self.string_converters]
+            for key in disabled:
+                del self.memos[key]
+
+    def get_memo_counts(self):
+        """
+        Returns the hits and lookups of every memo since the last call, for a transform worker to send them back.
+        """
+        if not self.memo_stats:
+            return {}
+        return {key: counts for key, counts in self._get_memo_window(self.memo_sent_counts).items() if counts[1]}
+
+    def add_memo_counts(self, counts):
+        for key, (hits, lookups) in counts.items():
+            worker_hits, worker_lookups = self.worker_memo_counts.get(key, (0, 0))
+            self.worker_memo_counts[key] = (worker_hits + hits, worker_lookups + lookups)
+
+    def get_memo_hit_rates(self):
+        """
+        Returns the hit rate of the memo of every memoized column, over the rows seen until it was disabled,
+        including the rows transformed by workers.
+        """
+        self._update_memo_stats()
+        hit_rates = {}
+        for key, stats in self.memo_stats.items():
+            worker_hits, worker_lookups = self.worker_memo_counts.get(key, (0, 0))
+            lookups = stats['lookups'] + worker_lookups
+            hit_rates[key] = round((stats['hits'] + worker_hits) / lookups, 3) if lookups else None
+        return hit_rates
+
+    def _transform_failed(self, data):
+        # the generic transform collects the errors of the record, or matches one of the other types of the schema
+        self.transformer.errors.clear()
+        success, result = self.transformer.transform_recur(data, self.schema, [])
+        if not success:
+            raise SchemaMismatch(self.transformer.errors)
+        return result
+
+
 def resolve_filter_fields(metadata=None):
     autos = set()
     filters = set()
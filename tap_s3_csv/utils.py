@@ -1,6 +1,8 @@
 import gzip
 import struct
 
+IMPORT_PERF_METRICS_LOG_PREFIX = "IMPORT_PERF_METRICS:"
+
 
 def get_file_name_from_gzfile(filename=None, fileobj=None):
     """Reading headers of GzipFile and returning filename."""
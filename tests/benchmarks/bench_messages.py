@@ -0,0 +1,33 @@
+"""
+Microbenchmark of RECORD message serialization: the per message format_message path against
+messages.serialize_records, for both json libraries.
+
+    python tests/benchmarks/bench_messages.py [records] [columns]
+"""
+import sys
+import timeit
+
+from tap_s3_csv import messages
+
+
+def format_records(stream_name, records, json_lib):
+    # what write_records did before serialize_records
+    return ''.join(f'{messages.format_message(messages.record_message(stream_name, record), json_lib)}\n'
+                   for record in records).encode('utf-8')
+
+
+def main():
+    record_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    column_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    records = [{f'column_{j}': f'value {i} {j}' for j in range(column_count)} for i in range(record_count)]
+
+    for json_lib in ['simple', 'orjson']:
+        assert format_records('table', records, json_lib) == messages.serialize_records('table', records, json_lib)
+        before = min(timeit.repeat(lambda: format_records('table', records, json_lib), number=1, repeat=5))
+        after = min(timeit.repeat(lambda: messages.serialize_records('table', records, json_lib), number=1, repeat=5))
+        print(f'{json_lib:>7}: format_message {record_count / before:>10,.0f} records/s, '
+              f'serialize_records {record_count / after:>10,.0f} records/s ({before / after:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
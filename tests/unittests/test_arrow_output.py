@@ -0,0 +1,108 @@
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from tap_s3_csv import arrow_output, messages
+from tap_s3_csv.symon_exception import SymonException
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'id': {'type': ['null', 'integer', 'string']},
+        'price': {'type': ['null', 'number', 'string']},
+        'active': {'type': ['null', 'boolean', 'string']},
+        'name': {'type': ['null', 'string']},
+        'created': {'type': ['null', 'string'], 'format': 'date-time'},
+    }
+}
+
+
+@unittest.skipIf(pa is None, 'pyarrow is not installed')
+class TestArrowOutput(unittest.TestCase):
+
+    def test_record_batches_follow_the_schema_message(self):
+        stdout = io.TextIOWrapper(io.BytesIO(), encoding='utf-8')
+        with mock.patch('sys.stdout', stdout):
+            with messages.batch_output({'output_mode': 'arrow', 'arrow_batch_rows': 2}):
+                messages.write_schema('table', SCHEMA, ['id'])
+                messages.write_records('table', [{'id': 1, 'price': 1.5, 'active': True, 'name': 'a'},
+                                                 {'id': 2, 'price': 2.0, 'active': False, 'name': None}])
+                messages.write_records('table', [{'id': 3, 'price': 3.25, 'active': True, 'name': 'c'}])
+                messages.write_state({'table': 1})
+
+        output = list(arrow_output.read_arrow_output(io.BytesIO(stdout.buffer.getvalue())))
+        self.assertEqual([message['type'] for message in output], ['SCHEMA', 'RECORD_BATCH', 'RECORD_BATCH', 'STATE'])
+
+        batches = [message['batch'] for message in output if message['type'] == 'RECORD_BATCH']
+        self.assertEqual(output[1]['stream'], 'table')
+        self.assertEqual(batches[0].schema.names, ['id', 'price', 'active', 'name', 'created'])
+        self.assertEqual(batches[0].schema.types, [pa.int64(), pa.float64(), pa.bool_(), pa.string(), pa.string()])
+        self.assertEqual(pa.Table.from_batches(batches).column('id').to_pylist(), [1, 2, 3])
+        self.assertEqual(batches[1].to_pylist(),
+                         [{'id': 3, 'price': 3.25, 'active': True, 'name': 'c', 'created': None}])
+
+    def test_interleaved_streams_write_full_batches(self):
+        stdout = io.TextIOWrapper(io.BytesIO(), encoding='utf-8')
+        with mock.patch('sys.stdout', stdout):
+            with messages.batch_output({'output_mode': 'arrow', 'arrow_batch_rows': 4}):
+                messages.write_schema('first', SCHEMA, ['id'])
+                messages.write_schema('second', SCHEMA, ['id'])
+                for i in range(5):
+                    messages.write_records('first', [{'id': i}, {'id': i + 100}])
+                    messages.write_records('second', [{'id': -i}])
+                messages.write_state({'first': 1})
+                messages.write_records('second', [{'id': 10}])
+
+        output = list(arrow_output.read_arrow_output(io.BytesIO(stdout.buffer.getvalue())))
+        self.assertEqual([(message['type'], message.get('stream')) for message in output],
+                         [('SCHEMA', 'first'), ('SCHEMA', 'second'),
+                          ('RECORD_BATCH', 'first'), ('RECORD_BATCH', 'first'), ('RECORD_BATCH', 'first'),
+                          ('RECORD_BATCH', 'second'), ('RECORD_BATCH', 'second'), ('STATE', None),
+                          ('RECORD_BATCH', 'second')])
+        self.assertEqual([message['batch'].num_rows for message in output if message['type'] == 'RECORD_BATCH'],
+                         [4, 4, 2, 4, 1, 1])
+
+        def get_ids(stream_name):
+            return [record['id'] for message in output if message.get('stream') == stream_name
+                    and message['type'] == 'RECORD_BATCH' for record in message['batch'].to_pylist()]
+        self.assertEqual(get_ids('first'), [id for i in range(5) for id in (i, i + 100)])
+        self.assertEqual(get_ids('second'), [0, -1, -2, -3, -4, 10])
+
+        # one IPC stream per stream before the STATE message
+        data = stdout.buffer.getvalue()
+        self.assertEqual(data.count(b'singer.stream'), 3)
+
+    def test_values_that_do_not_fit_the_column_type_are_written_as_text(self):
+        schema = arrow_output.get_arrow_schema('table', SCHEMA)
+        batch = arrow_output.to_record_batch([{'id': 1, 'price': 2.5}, {'id': 'n/a', 'price': 3, 'extra': [1]}],
+                                             schema)
+
+        self.assertEqual(batch.schema.field('id').type, pa.string())
+        self.assertEqual(batch.schema.field('price').type, pa.float64())
+        self.assertEqual(batch.column(batch.schema.get_field_index('id')).to_pylist(), ['1', 'n/a'])
+        self.assertEqual(batch.column(batch.schema.get_field_index('extra')).to_pylist(), [None, '[1]'])
+
+    def test_output_is_redirected_to_output_path(self):
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, 'output')
+            with messages.redirect_output(path), messages.batch_output({'output_mode': 'arrow'}):
+                messages.write_schema('table', SCHEMA, ['id'])
+                messages.write_records('table', [{'id': 1}])
+
+            with open(path, 'rb') as output_file:
+                output = list(arrow_output.read_arrow_output(output_file))
+        self.assertEqual([message['type'] for message in output], ['SCHEMA', 'RECORD_BATCH'])
+        self.assertIsNone(messages._output)
+
+    def test_requires_pyarrow(self):
+        with mock.patch('tap_s3_csv.arrow_output.pa', None):
+            with self.assertRaises(SymonException) as err:
+                arrow_output.ArrowStager(messages.write_bytes)
+        self.assertEqual(err.exception.code, 'ArrowOutputUnavailable')
@@ -0,0 +1,187 @@
+import datetime
+import io
+import unittest
+from unittest import mock
+
+from tap_s3_csv import checkpoint, decoding, sync
+
+STREAM = {
+    'stream': 'table',
+    'tap_stream_id': 'table',
+    'schema': {
+        'type': 'object',
+        'properties': {
+            'id': {'type': ['null', 'integer']},
+            'name': {'type': ['null', 'string']},
+        }
+    },
+    'metadata': [
+        {'breadcrumb': [], 'metadata': {'selected': True}},
+        {'breadcrumb': ['properties', 'id'], 'metadata': {'inclusion': 'available', 'source_type': 'integer'}},
+        {'breadcrumb': ['properties', 'name'], 'metadata': {'inclusion': 'available', 'source_type': 'string'}},
+    ]
+}
+
+S3_FILE = {'key': 'file.csv', 'etag': '"abc"', 'size': 0}
+
+JANUARY_2 = datetime.datetime(2024, 1, 2, tzinfo=datetime.timezone.utc)
+JANUARY_3 = datetime.datetime(2024, 1, 3, tzinfo=datetime.timezone.utc)
+
+
+def get_data(rows):
+    line_ends = [b'\n', b'\r\n', b'\r']
+    lines = [b'skipped', b'id,name']
+    for i in range(rows):
+        name = b'"name\r\n%d"' % i if i % 7 == 0 else b'name %d' % i
+        lines.append(b'%d,%s' % (i, name) + line_ends[i % 3] * (1 + (i % 11 == 0)))
+    return b'\n'.join(lines[:2]) + b'\n' + b''.join(lines[2:])
+
+
+class SmallReads(io.BytesIO):
+    # splits the file in blocks of a few bytes, and line endings across blocks
+    def read(self, size=-1):
+        return super().read(7)
+
+
+class TestLineOffsets(unittest.TestCase):
+
+    def test_offsets_of_every_line(self):
+        data = b'a\r\nb\rc\n\nd\r\r\ne'
+        expected = [0, 3, 5, 7, 8, 10, 12, 13]
+        for block_size in range(1, len(data) + 1):
+            offsets = checkpoint.LineOffsets(io.BytesIO(data), 5)
+            lines = list(decoding.split_lines(decoding.iter_blocks(offsets, block_size)))
+            self.assertEqual(lines, [b'a', b'b', b'c', b'', b'd', b'', b'e'])
+            self.assertEqual([offsets.get_offset(line) - 5 for line in range(len(lines) + 1)], expected)
+
+
+class TestFileCheckpoint(unittest.TestCase):
+
+    def sync(self, data, file_checkpoint, stream=None):
+        def get_file_handle(config, s3_path, offset=0):
+            return SmallReads(data[offset:])
+
+        with mock.patch('tap_s3_csv.sync.s3.get_file_handle', side_effect=get_file_handle), \
+                mock.patch('tap_s3_csv.sync.messages.write_records') as write_records:
+            rows = sync.handle_file({}, 'file.csv', {'table_name': 'table', 'skip_header_row': 1},
+                                    dict(stream or STREAM), 'csv', file_checkpoint=file_checkpoint)
+        records = [record for call in write_records.call_args_list for record in call.args[1]]
+        self.assertEqual(rows, len(records))
+        return records
+
+    def test_resuming_from_every_checkpoint(self):
+        data = get_data(1000)
+        bookmarks = []
+        records = self.sync(data, checkpoint.FileCheckpoint(S3_FILE, bookmarks.append, 0))
+        self.assertEqual(len(records), 1000)
+        self.assertEqual(records[7], {'id': 7, 'name': 'name7'})
+        self.assertEqual(len(bookmarks), 10)
+
+        for stream in [{**STREAM, 'column_order': ['id', 'name']}, STREAM]:
+            for bookmark in bookmarks:
+                resumed = checkpoint.FileCheckpoint(S3_FILE, lambda bookmark: None, 0, bookmark)
+                self.assertEqual(self.sync(data, resumed, stream), records[bookmark['rows']:])
+                self.assertEqual(resumed.rows, 1000)
+
+    def test_checkpoints_are_written_once_per_interval(self):
+        bookmarks = []
+        self.sync(get_data(1000), checkpoint.FileCheckpoint(S3_FILE, bookmarks.append, 3600))
+        self.assertEqual(bookmarks, [])
+
+    def test_checkpoint_of_another_etag_is_not_resumed(self):
+        bookmark = {'key': 'file.csv', 'etag': 'other', 'offset': 100, 'rows': 10}
+        file_checkpoint = checkpoint.FileCheckpoint(S3_FILE, lambda bookmark: None, 0, bookmark)
+        self.assertEqual((file_checkpoint.offset, file_checkpoint.rows), (0, 0))
+
+    @mock.patch('tap_s3_csv.sync.messages.write_state')
+    @mock.patch('tap_s3_csv.sync.s3.get_input_files_for_table')
+    def test_sync_stream_resumes_and_clears_the_checkpoint(self, mocked_list_files, mocked_write_state):
+        bookmark = {'key': 'file.csv', 'etag': 'abc', 'offset': 100, 'rows': 10}
+        state = {'bookmarks': {'table': {'checkpoint': bookmark}}}
+        mocked_list_files.return_value = [{**S3_FILE, 'size': 1000, 'last_modified': JANUARY_2}]
+
+        with mock.patch('tap_s3_csv.sync.sync_table_file', return_value=5) as mocked_sync_file:
+            sync.sync_stream({'sync_checkpoint_seconds': 60}, state, {'table_name': 'table'}, {}, None, None, None,
+                             'simple')
+
+        self.assertEqual(mocked_sync_file.call_args.args[8].offset, 100)
+        self.assertEqual(state, {'bookmarks': {'table': {'modified_since': '2024-01-02T00:00:00+00:00'}}})
+
+    @mock.patch('tap_s3_csv.sync.messages.write_state')
+    @mock.patch('tap_s3_csv.sync.s3.get_input_files_for_table')
+    def test_checkpoints_are_opt_in(self, mocked_list_files, mocked_write_state):
+        mocked_list_files.return_value = [{**S3_FILE, 'size': 1000, 'last_modified': JANUARY_2}]
+        with mock.patch('tap_s3_csv.sync.sync_table_file', return_value=5) as mocked_sync_file:
+            sync.sync_stream({}, {}, {'table_name': 'table'}, {}, None, None, None, 'simple')
+        self.assertIsNone(mocked_sync_file.call_args.args[8])
+
+    @mock.patch('tap_s3_csv.sync.messages.write_state')
+    @mock.patch('tap_s3_csv.sync.s3.get_input_files_for_table')
+    def test_checkpoint_at_the_end_of_the_file_is_cleared_without_a_download(self, mocked_list_files,
+                                                                            mocked_write_state):
+        bookmark = {'key': 'file.csv', 'etag': 'abc', 'offset': 1000, 'rows': 10}
+        state = {'bookmarks': {'table': {'checkpoint': bookmark}}}
+        mocked_list_files.return_value = [{**S3_FILE, 'size': 1000, 'last_modified': JANUARY_2}]
+
+        with mock.patch('tap_s3_csv.sync.sync_table_file') as mocked_sync_file:
+            self.assertEqual(sync.sync_stream({'sync_checkpoint_seconds': 60}, state, {'table_name': 'table'}, {},
+                                              None, None, None, 'simple'), 0)
+
+        mocked_sync_file.assert_not_called()
+        self.assertEqual(state, {'bookmarks': {'table': {'modified_since': '2024-01-02T00:00:00+00:00'}}})
+
+    @mock.patch('tap_s3_csv.sync.messages.write_state')
+    @mock.patch('tap_s3_csv.sync.s3.get_input_files_for_table')
+    def test_file_of_the_checkpoint_is_resumed_when_modified_before_the_bookmark(self, mocked_list_files,
+                                                                                 mocked_write_state):
+        # a.csv was modified after file.csv but synced before it by key, then the run stopped in file.csv
+        bookmark = {'key': 'file.csv', 'etag': 'abc', 'offset': 100, 'rows': 10}
+        state = {'bookmarks': {'table': {'modified_since': '2024-01-03T00:00:00+00:00', 'checkpoint': bookmark}}}
+        mocked_list_files.return_value = [
+            {'key': 'a.csv', 'etag': '"a"', 'size': 1000, 'last_modified': JANUARY_3},
+            {**S3_FILE, 'size': 1000, 'last_modified': JANUARY_2},
+            {'key': 'other.csv', 'etag': '"b"', 'size': 1000, 'last_modified': JANUARY_2}]
+
+        with mock.patch('tap_s3_csv.sync.sync_table_file', return_value=5) as mocked_sync_file:
+            sync.sync_stream({'sync_checkpoint_seconds': 60}, state, {'table_name': 'table'}, {}, None, None, None,
+                             'simple')
+
+        self.assertEqual([call.args[1] for call in mocked_sync_file.call_args_list], ['file.csv'])
+        self.assertEqual(mocked_sync_file.call_args.args[8].offset, 100)
+        # the bookmark is not moved back to the file of the checkpoint
+        self.assertEqual(state, {'bookmarks': {'table': {'modified_since': '2024-01-03T00:00:00+00:00'}}})
+
+    @mock.patch('tap_s3_csv.sync.messages.write_state')
+    @mock.patch('tap_s3_csv.sync.s3.get_input_files_for_table')
+    def test_files_before_the_file_of_the_checkpoint_keep_it(self, mocked_list_files, mocked_write_state):
+        bookmark = {'key': 'file.csv', 'etag': 'abc', 'offset': 100, 'rows': 10}
+        state = {'bookmarks': {'table': {'modified_since': '2024-01-02T00:00:00+00:00', 'checkpoint': bookmark}}}
+        # a.csv was modified since the last run and is synced before file.csv
+        mocked_list_files.return_value = [
+            {'key': 'a.csv', 'etag': '"a"', 'size': 1000, 'last_modified': JANUARY_3},
+            {**S3_FILE, 'size': 1000, 'last_modified': JANUARY_2}]
+        checkpoints = []
+
+        def sync_table_file(*args):
+            checkpoints.append(args[8])
+            self.assertEqual(state['bookmarks']['table']['checkpoint'], bookmark)
+            return 5
+
+        with mock.patch('tap_s3_csv.sync.sync_table_file', side_effect=sync_table_file):
+            sync.sync_stream({'sync_checkpoint_seconds': 60}, state, {'table_name': 'table'}, {}, None, None, None,
+                             'simple')
+
+        self.assertIsNone(checkpoints[0])
+        self.assertEqual((checkpoints[1].key, checkpoints[1].offset), ('file.csv', 100))
+        self.assertNotIn('checkpoint', state['bookmarks']['table'])
+
+    @mock.patch('tap_s3_csv.sync.messages.write_state')
+    @mock.patch('tap_s3_csv.sync.s3.get_input_files_for_table')
+    def test_tables_with_a_row_limit_are_synced_without_checkpoints(self, mocked_list_files, mocked_write_state):
+        bookmark = {'key': 'file.csv', 'etag': 'abc', 'offset': 100, 'rows': 10}
+        state = {'bookmarks': {'table': {'checkpoint': bookmark}}}
+        mocked_list_files.return_value = [{**S3_FILE, 'size': 1000, 'last_modified': JANUARY_2}]
+        with mock.patch('tap_s3_csv.sync.sync_table_file', return_value=5) as mocked_sync_file:
+            sync.sync_stream({'sync_checkpoint_seconds': 60}, state, {'table_name': 'table', 'row_limit': 100}, {},
+                             None, None, None, 'simple')
+        self.assertIsNone(mocked_sync_file.call_args.args[8])
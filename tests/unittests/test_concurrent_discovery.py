@@ -0,0 +1,71 @@
+import threading
+import time
+import unittest
+from unittest import mock
+from tap_s3_csv import discover, s3
+
+
+def mock_discover_schema(config, table_spec):
+    # later tables finish first
+    time.sleep(table_spec['delay'])
+    return {'type': 'object', 'properties': {table_spec['table_name']: {'type': ['null', 'string']}}}, {}
+
+
+class TestConcurrentDiscovery(unittest.TestCase):
+
+    @mock.patch("tap_s3_csv.discover.discover_schema", side_effect=mock_discover_schema)
+    def test_streams_keep_config_order(self, mocked_discover_schema):
+        tables = [{'table_name': f'table_{i}', 'key_properties': [], 'delay': (5 - i) / 100} for i in range(5)]
+        streams = discover.discover_streams({'tables': tables})
+        self.assertEqual([stream['stream'] for stream in streams], [table['table_name'] for table in tables])
+        self.assertEqual(streams[0]['column_order'], ['table_0'])
+
+    @mock.patch("tap_s3_csv.s3.sample_file")
+    def test_sampled_records_keep_file_order(self, mocked_sample_file):
+        def sample_file(table_spec, s3_path, file_handle, sample_rate, extension, config, max_records):
+            time.sleep(0.05 if s3_path == 'a.csv' else 0)
+            return iter([{'file': s3_path}])
+        mocked_sample_file.side_effect = sample_file
+
+        s3_files = [{'key': 'a.csv'}, {'key': 'b.csv'}, {'key': 'c.csv'}]
+        with mock.patch("tap_s3_csv.s3.get_file_handle"):
+            records = list(s3.sample_files({'bucket': 'bucket'}, {}, s3_files))
+        self.assertEqual(records, [{'file': 'a.csv'}, {'file': 'b.csv'}, {'file': 'c.csv'}])
+
+    @mock.patch("tap_s3_csv.s3.get_file_handle")
+    def test_no_handle_for_skipped_files(self, mocked_get_file_handle):
+        s3_files = [{'key': 'no_extension'}, {'key': 'data.tar.gz'}, {'key': 'data.xlsx'}, {'key': 'data.csv'}]
+        files = s3.get_files_to_sample({'bucket': 'bucket'}, s3_files, 5)
+        self.assertEqual([file['s3_path'] for file in files], ['data.csv'])
+        mocked_get_file_handle.assert_called_once_with({'bucket': 'bucket'}, 'data.csv', ranged=True, size=None,
+                                                       range_size=s3.SAMPLE_RANGE_SIZE)
+
+    @mock.patch("tap_s3_csv.s3.LOGGER")
+    @mock.patch("tap_s3_csv.s3.get_file_handle")
+    @mock.patch("tap_s3_csv.s3.sample_file")
+    @mock.patch("tap_s3_csv.s3.get_input_files_for_table")
+    def test_skipped_files_are_counted_per_table(self, mocked_list_files, mocked_sample_file, mocked_get_file_handle,
+                                                 mocked_logger):
+        # both tables sample their files at the same time
+        barrier = threading.Barrier(2)
+        mocked_list_files.side_effect = lambda config, table_spec: iter(table_spec['files'])
+
+        def sample_file(table_spec, s3_path, file_handle, sample_rate, extension, config, max_records):
+            if s3_path.endswith('first.csv'):
+                barrier.wait(timeout=5)
+            if s3_path.startswith('empty'):
+                s3.count_skipped_file()
+                return iter([])
+            return iter([{'id': '1'}])
+        mocked_sample_file.side_effect = sample_file
+
+        tables = [
+            {'table_name': 'a', 'key_properties': [], 'files': [
+                {'key': 'a/first.csv'}, {'key': 'empty_1.csv'}, {'key': 'empty_2.csv'}, {'key': 'a.xlsx'}]},
+            {'table_name': 'b', 'key_properties': [], 'files': [{'key': 'b/first.csv'}]},
+        ]
+        discover.discover_streams({'bucket': 'bucket', 'tables': tables})
+
+        skipped_warnings = [call.args for call in mocked_logger.warning.call_args_list
+                            if 'files got skipped' in call.args[0]]
+        self.assertEqual(skipped_warnings, [("%s files got skipped during the last sampling.", 3)])
@@ -104,3 +104,78 @@ class TestConversion(unittest.TestCase):
         res = conversion.generate_schema(samples, table_spec)
         expected_result = {'name': {'type': ['null', 'string']}, 'id': {'type': ['null', 'integer', 'string']}, 'marks': {'anyOf': [{'type': 'array', 'items': {'type': ['null', 'number', 'string']}}, {'type': ['null', 'string']}]}, 'students': {'anyOf': [{'type': 'object', 'properties': {}}, {'type': ['null', 'string']}]}, 'created_at': {'anyOf': [{'type': ['null', 'string'], 'format': 'date-time'}, {'type': ['null', 'string']}]}, 'tota': {'anyOf': [{'type': 'array', 'items': ['null', 'string']}, {'type': ['null', 'string']}]}}
         self.assertEqual(res, expected_result)
+
+
+class TestSchemaInference(unittest.TestCase):
+
+    def test_candidate_date_formats_match_first_values(self):
+        column = conversion.pd.Series(['2024-01-13 10:00:00Z', '2024-01-14 10:00:00Z'], name='created_at')
+        formats = [fmt for fmt, _ in conversion.get_candidate_date_formats(column)]
+        self.assertEqual(formats, ['%Y-%m-%d %H:%M:%SZ', '%Y-%m-%d %H:%M:%S%z',
+                                   '%m-%d-%Y %H:%M:%SZ', '%m-%d-%Y %H:%M:%S%z',
+                                   '%d-%m-%Y %H:%M:%SZ', '%d-%m-%Y %H:%M:%S%z'])
+        self.assertEqual(conversion.get_candidate_date_formats(column.replace('2024-01-13 10:00:00Z', 'abc')), [])
+
+    def test_values_pandas_parses_with_any_format_keep_the_date_type(self):
+        # pd.to_datetime parses the NaT strings and today/now with any format
+        expected = ({'c0': {'type': ['null', 'string'], 'format': 'date-time'}}, {'c0': 'YYYY-MM-DD'})
+        for values in [['2024-01-13', 'NaN', '2024-02-01'], ['2024-01-13', 'today'], ['NaT', '2024-01-13'],
+                       ['2024-01-13', 'now', 'nan', 'NAT', '2024-01-14', '2024-01-15', 'NaN']]:
+            self.assertEqual(conversion.generate_schema([{'c0': value} for value in values], {}, False), expected)
+
+    def test_generate_schema(self):
+        samples = [
+            {'id': '1,000', 'created_at': '01/13/2024', 'flag': 'true', 'name': 'Bob'},
+            {'id': '2', 'created_at': '<NULL>', 'flag': '', 'name': None},
+            {'id': '', 'created_at': '12/31/2024', 'flag': 'False', 'name': 'Alexander'},
+        ]
+        schema, date_format_map = conversion.generate_schema(samples, {}, True)
+        self.assertEqual(schema, {
+            'id': {'type': ['null', 'number', 'string'], 'maxLength': 5},
+            'created_at': {'type': ['null', 'string'], 'format': 'date-time', 'maxLength': 10},
+            'flag': {'type': ['null', 'boolean', 'string'], 'maxLength': 5},
+            'name': {'type': ['null', 'string'], 'maxLength': 9},
+        })
+        self.assertEqual(date_format_map, {'created_at': 'MM/DD/YYYY'})
+
+    def test_schema_inferrer_matches_single_batch(self):
+        samples = [{'id': str(i), 'amount': '1,5' if i % 3 else '', 'flag': 'TRUE' if i % 2 else 'false'} for i in range(20)]
+        samples += [{'id': '20', 'amount': '7', 'flag': 'maybe', 'created_at': '2024-01-13'},
+                    {'id': '21', 'amount': '8', 'flag': '', 'created_at': '2024-01-14'}]
+        expected = conversion.generate_schema(samples, {}, True)
+
+        inferrer = conversion.SchemaInferrer(batch_size=3)
+        inferrer.update_batch(samples)
+        self.assertEqual(inferrer.get_schema(True), expected)
+        self.assertEqual(inferrer.row_count, 22)
+        self.assertEqual(expected[0]['flag'], {'type': ['null', 'string'], 'maxLength': 5})
+        self.assertEqual(expected[0]['created_at'], {'type': ['null', 'string'], 'format': 'date-time', 'maxLength': 10})
+        self.assertEqual(expected[1], {'created_at': 'YYYY-MM-DD'})
+
+    def test_column_dtype_matches_dataframe(self):
+        for samples in [[{'c0': 1}, {'c0': 2 ** 70}, {}], [{'c0': 1.5}, {'c0': 2 ** 70}], [{'c0': 2 ** 70}, {}],
+                        [{'c0': 1}, {}], [{'c0': 1}, {'c0': 2}], [{'c0': 1.5}, {'c0': 2}]]:
+            inferrer = conversion.SchemaInferrer(batch_size=2)
+            inferrer.update_batch(samples)
+            self.assertEqual(inferrer.columns['c0'].get_dtype(), conversion.pd.DataFrame(samples)['c0'].dtype.name)
+
+        # an int outside of int64 and a missing value
+        self.assertEqual(conversion.generate_schema([{'c0': 1}, {'c0': 2 ** 70}, {}], {}, False),
+                         ({'c0': {'type': ['null', 'number', 'string']}}, {}))
+
+    def test_schema_inferrer_drops_date_formats_seen_failing_later(self):
+        inferrer = conversion.SchemaInferrer(batch_size=1)
+        inferrer.update_batch([{'date': '01/02/2024'}, {'date': '13/02/2024'}])
+        self.assertEqual(inferrer.get_schema(False)[1], {'date': 'DD/MM/YYYY'})
+
+    @mock.patch("tap_s3_csv.conversion.PARALLEL_INFERENCE_MIN_COLUMNS", 2)
+    def test_parallel_inference_matches_serial(self):
+        samples = [{f'col_{j}': [str(i), f'{i}.5', '2024-01-13', 'TRUE', 'text', ''][(i + j) % 6] for j in range(30)}
+                   for i in range(40)]
+        expected = conversion.generate_schema(samples, {}, True)
+
+        inferrer = conversion.SchemaInferrer(batch_size=15, max_workers=2)
+        inferrer.update_batch(samples)
+        self.assertEqual(inferrer.get_schema(True), expected)
+        self.assertEqual(list(expected[0]), [f'col_{j}' for j in range(30)])
+        self.assertIsNone(inferrer.pool)
@@ -0,0 +1,65 @@
+import io
+import unittest
+from tap_s3_csv import decoding, csv_iterator, preprocess
+
+
+class TestDecoding(unittest.TestCase):
+
+    def test_split_lines_matches_bytes_splitlines(self):
+        data = b'a,b\r\nc,d\re,f\n\ng,h\r\n'
+        # split every possible way, including between \r and \n
+        for i in range(1, len(data)):
+            blocks = [data[:i], data[i:]]
+            self.assertEqual(list(decoding.split_lines(blocks)), data.splitlines())
+
+    def test_split_lines_keeps_other_separators(self):
+        blocks = ['a\x0cb c\nd']
+        self.assertEqual(list(decoding.split_lines(blocks)), ['a\x0cb c', 'd'])
+
+    def test_decode_blocks_strips_nul_bytes(self):
+        blocks = [b'a\x00b,', b'c\x00\n']
+        self.assertEqual(''.join(decoding.decode_blocks(blocks, 'utf-8')), 'ab,c\n')
+
+    def test_decode_blocks_utf16_split_across_blocks(self):
+        data = 'colé,b\n1\x00,2\n'.encode('utf-16')
+        blocks = [data[i:i + 3] for i in range(0, len(data), 3)]
+        lines = list(decoding.split_lines(decoding.decode_blocks(blocks, 'utf-16')))
+        self.assertEqual(lines, ['colé,b', '1,2'])
+
+    def test_row_iterator_reads_file_objects(self):
+        file_handle = io.BytesIO('id,name\n1,é\n'.encode('utf-16'))
+        reader = csv_iterator.get_row_iterator(file_handle, {'encoding': 'utf-16'})
+        self.assertEqual(list(reader), [{'id': '1', 'name': 'é'}])
+
+
+class TestPreprocessStream(unittest.TestCase):
+
+    def test_has_header_false_replays_first_row(self):
+        file_handle = io.BytesIO(b'skipped\n1,2\n3,4\n')
+        table_spec = {'has_header': False, 'skip_header_row': 1}
+        stream = preprocess.PreprocessStream(file_handle, table_spec, True)
+        self.assertEqual(stream.header, ['col_0', 'col_1'])
+
+        reader = csv_iterator.get_row_iterator(stream, table_spec, stream.header)
+        self.assertEqual(list(reader), [{'col_0': '1', 'col_1': '2'}, {'col_0': '3', 'col_1': '4'}])
+        # buffered blocks are released once the first row is handled
+        self.assertEqual(stream.blocks.consumed, [])
+
+
+class TestProjectedReader(unittest.TestCase):
+
+    def test_projected_records_match_dict_reader(self):
+        data = b'a,b,c,d\n1,2,3,4\n\n5,6\n7,8,9,10,11,12\n'
+        excluded = {'b', 'd'}
+        expected = [{key: value for key, value in record.items() if key not in excluded}
+                    for record in csv_iterator.get_row_iterator(io.BytesIO(data))]
+
+        reader = csv_iterator.get_row_iterator(io.BytesIO(data), excluded_fields=excluded)
+        self.assertIsInstance(reader, csv_iterator.ProjectedReader)
+        records = list(reader)
+        self.assertEqual([list(record.items()) for record in records], [list(record.items()) for record in expected])
+        self.assertEqual(records[2], {'a': '7', 'c': '9', None: ['11', '12']})
+
+    def test_no_projection_when_every_field_is_excluded(self):
+        reader = csv_iterator.get_row_iterator(io.BytesIO(b'a\n1\n'), excluded_fields={'a'})
+        self.assertNotIsInstance(reader, csv_iterator.ProjectedReader)
@@ -0,0 +1,94 @@
+import io
+import json
+import tempfile
+import unittest
+from unittest import mock
+from tap_s3_csv import dialect, discover, discovery_cache
+
+
+def mock_discover_schema(config, table_spec):
+    return {'type': 'object', 'properties': {'id': {'type': ['null', 'number', 'string']}}}, {}
+
+
+@mock.patch("tap_s3_csv.discover.discover_schema", side_effect=mock_discover_schema)
+@mock.patch("tap_s3_csv.s3.get_input_files_for_table")
+class TestDiscoveryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def discover(self, etag, invalidate=False):
+        config = {'bucket': 'bucket', 'discovery_cache_path': self.cache_dir.name,
+                  'discovery_cache_invalidate': invalidate,
+                  'tables': [{'table_name': 'table', 'search_pattern': 'file.csv', 'key_properties': []}]}
+        cache = discovery_cache.get_discovery_cache(config)
+        with mock.patch("tap_s3_csv.s3.get_input_files_for_table",
+                        return_value=[{'key': 'file.csv', 'etag': etag, 'size': 10}]):
+            cached_tables = cache.load_tables(config)
+        # dialect detection
+        if 'table' not in cached_tables:
+            config['tables'][0]['delimiter'] = ';'
+        return cached_tables, discover.discover_streams(config, cache), config['tables'][0]
+
+    def test_hit_skips_sampling_and_restores_dialect(self, mocked_get_input_files, mocked_discover_schema):
+        cached_tables, streams, _ = self.discover('"etag-1"')
+        self.assertEqual(cached_tables, set())
+        self.assertEqual(mocked_discover_schema.call_count, 1)
+
+        cached_tables, cached_streams, table_spec = self.discover('"etag-1"')
+        self.assertEqual(cached_tables, {'table'})
+        # breadcrumb tuples come back as lists, both serialize the same way in the catalog
+        self.assertEqual(json.dumps(cached_streams), json.dumps(streams))
+        self.assertEqual(table_spec['delimiter'], ';')
+        self.assertEqual(mocked_discover_schema.call_count, 1)
+
+    def test_changed_file_or_invalidate_is_a_miss(self, mocked_get_input_files, mocked_discover_schema):
+        self.discover('"etag-1"')
+        cached_tables, _, _ = self.discover('"etag-2"')
+        self.assertEqual(cached_tables, set())
+
+        cached_tables, _, _ = self.discover('"etag-2"', invalidate=True)
+        self.assertEqual(cached_tables, set())
+        self.assertEqual(mocked_discover_schema.call_count, 3)
+
+
+@mock.patch("tap_s3_csv.dialect.s3.get_file_handle", side_effect=lambda *args, **kwargs: io.BytesIO(b'id;name\n1;a\n'))
+class TestDialectCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def detect(self, etag, table_spec=None):
+        config = {'bucket': 'bucket', 'discovery_cache_path': self.cache_dir.name}
+        table_spec = table_spec or {'table_name': 'table'}
+        s3_file = {'key': 'file.csv', 'etag': etag, 'size': 12}
+        dialect.detect_dialect(config, s3_file, table_spec, discovery_cache.get_discovery_cache(config))
+        return table_spec
+
+    def test_detected_dialect_is_cached_by_etag(self, mocked_get_file_handle):
+        detected = {'table_name': 'table', 'encoding': 'utf-8', 'delimiter': ';', 'quotechar': '"'}
+        self.assertEqual(self.detect('"etag-1"'), detected)
+        mocked_get_file_handle.assert_called_once_with(mock.ANY, 'file.csv', ranged=True, size=12)
+
+        # e.g. the sync run after discovery
+        self.assertEqual(self.detect('"etag-1"'), detected)
+        self.assertEqual(mocked_get_file_handle.call_count, 1)
+
+        self.detect('"etag-2"')
+        self.assertEqual(mocked_get_file_handle.call_count, 2)
+
+    def test_only_detected_keys_are_restored(self, mocked_get_file_handle):
+        self.detect('"etag-1"', {'table_name': 'table', 'encoding': 'latin-1'})
+        table_spec = self.detect('"etag-1"', {'table_name': 'table', 'encoding': 'latin-1'})
+        self.assertEqual(table_spec, {'table_name': 'table', 'encoding': 'latin-1', 'delimiter': ';', 'quotechar': '"'})
+        self.assertEqual(mocked_get_file_handle.call_count, 1)
+
+        # other dialect options are another entry
+        self.detect('"etag-1"', {'table_name': 'table', 'encoding': 'utf-8'})
+        self.assertEqual(mocked_get_file_handle.call_count, 2)
@@ -0,0 +1,93 @@
+import datetime
+import unittest
+from unittest import mock
+
+from tap_s3_csv import file_manifest, sync
+
+
+def get_s3_file(key, etag='"a"', size=10, day=1):
+    return {'key': key, 'etag': etag, 'size': size,
+            'last_modified': datetime.datetime(2024, 1, day, tzinfo=datetime.timezone.utc)}
+
+
+class TestFileManifest(unittest.TestCase):
+
+    def test_keys_are_front_coded(self):
+        keys = ['data/2024/part-00000.csv', 'data/2024/part-00001.csv', 'data/2025/part-00000.csv', 'other.csv']
+        prefix_lengths, suffixes = file_manifest.encode_keys(keys)
+        self.assertEqual(prefix_lengths, [0, 19, 8, 0])
+        self.assertEqual(suffixes, ['data/2024/part-00000.csv', '1.csv', '5/part-00000.csv', 'other.csv'])
+        self.assertEqual(file_manifest.decode_keys(prefix_lengths, suffixes), keys)
+
+    def test_bookmark_round_trip(self):
+        manifest = file_manifest.FileManifest()
+        manifest.complete(get_s3_file('b.csv', size=20))
+        manifest.start(get_s3_file('a.csv', etag='"x-2"'))
+        bookmark = manifest.to_bookmark()
+        self.assertEqual(bookmark, {'version': 1, 'key_prefix_lengths': [0, 0], 'key_suffixes': ['a.csv', 'b.csv'],
+                                    'etags': ['x-2', 'a'], 'sizes': [10, 20], 'statuses': 'pc'})
+
+        manifest = file_manifest.FileManifest.from_bookmark(bookmark)
+        self.assertTrue(manifest.is_synced(get_s3_file('b.csv', size=20)))
+        self.assertFalse(manifest.is_synced(get_s3_file('b.csv', size=21)))
+        self.assertFalse(manifest.is_synced(get_s3_file('b.csv', etag='"b"', size=20)))
+        # partially synced
+        self.assertFalse(manifest.is_synced(get_s3_file('a.csv', etag='"x-2"')))
+
+    def test_other_versions_are_ignored(self):
+        manifest = file_manifest.FileManifest.from_bookmark({'version': 0, 'keys': ['a.csv']})
+        self.assertEqual(len(manifest), 0)
+
+
+@mock.patch('tap_s3_csv.sync.messages.write_state')
+@mock.patch('tap_s3_csv.sync.sync_table_file', return_value=1)
+@mock.patch('tap_s3_csv.sync.s3.get_input_files_for_table')
+class TestSyncWithFileManifest(unittest.TestCase):
+
+    def sync(self, state, s3_files, mocked_list_files, mocked_sync_file):
+        mocked_list_files.return_value = s3_files
+        mocked_sync_file.reset_mock()
+        sync.sync_stream({'file_manifest': True}, state, {'table_name': 'table'}, {}, None, None, None, 'simple')
+        return [call.args[1] for call in mocked_sync_file.call_args_list]
+
+    def test_unchanged_files_are_skipped(self, mocked_list_files, mocked_sync_file, mocked_write_state):
+        state = {}
+        s3_files = [get_s3_file('b.csv'), get_s3_file('a.csv'), get_s3_file('c.csv')]
+        self.assertEqual(self.sync(state, s3_files, mocked_list_files, mocked_sync_file), ['a.csv', 'b.csv', 'c.csv'])
+        # listed without the modified_since filter
+        self.assertEqual(mocked_list_files.call_args.args[2:], ())
+        self.assertEqual(state['bookmarks']['table']['files']['statuses'], 'ccc')
+
+        # b.csv is uploaded again, c.csv is deleted, d.csv is new
+        s3_files = [get_s3_file('a.csv'), get_s3_file('b.csv', etag='"b"', day=2), get_s3_file('d.csv')]
+        self.assertEqual(self.sync(state, s3_files, mocked_list_files, mocked_sync_file), ['b.csv', 'd.csv'])
+        manifest = file_manifest.FileManifest.from_bookmark(state['bookmarks']['table']['files'])
+        self.assertEqual(sorted(manifest.entries), ['a.csv', 'b.csv', 'd.csv'])
+        self.assertTrue(all(manifest.is_synced(s3_file) for s3_file in s3_files))
+
+    def test_partially_synced_files_are_synced_again(self, mocked_list_files, mocked_sync_file, mocked_write_state):
+        manifest = file_manifest.FileManifest()
+        manifest.complete(get_s3_file('a.csv'))
+        manifest.start(get_s3_file('b.csv'))
+        state = {'bookmarks': {'table': {'files': manifest.to_bookmark()}}}
+
+        self.assertEqual(self.sync(state, [get_s3_file('a.csv'), get_s3_file('b.csv')], mocked_list_files,
+                                   mocked_sync_file), ['b.csv'])
+
+    def test_files_before_the_modified_since_bookmark_are_taken_as_synced(self, mocked_list_files, mocked_sync_file,
+                                                                           mocked_write_state):
+        state = {'bookmarks': {'table': {'modified_since': '2024-01-02T00:00:00+00:00'}}}
+        s3_files = [get_s3_file('a.csv', day=1), get_s3_file('b.csv', day=2), get_s3_file('c.csv', day=3)]
+        self.assertEqual(self.sync(state, s3_files, mocked_list_files, mocked_sync_file), ['c.csv'])
+        self.assertEqual(state['bookmarks']['table']['files']['statuses'], 'ccc')
+
+    def test_state_is_written_once_per_interval(self, mocked_list_files, mocked_sync_file, mocked_write_state):
+        s3_files = [get_s3_file(f'{i}.csv') for i in range(5)]
+        with mock.patch('tap_s3_csv.file_manifest.STATE_INTERVAL_SECONDS', 3600):
+            self.sync({}, s3_files, mocked_list_files, mocked_sync_file)
+        self.assertEqual(mocked_write_state.call_count, 1)
+
+        mocked_write_state.reset_mock()
+        with mock.patch('tap_s3_csv.file_manifest.STATE_INTERVAL_SECONDS', 0):
+            self.sync({}, s3_files, mocked_list_files, mocked_sync_file)
+        self.assertEqual(mocked_write_state.call_count, 6)
@@ -1,3 +1,5 @@
+import io
+import json
 import unittest
 from unittest import mock
 from tap_s3_csv import s3
@@ -277,4 +279,36 @@ class TestJsonlSupport(unittest.TestCase):
         stream = {'stream': 'jsonl_table', 'tap_stream_id': 'jsonl_table', "schema": {},"metadata": [{"breadcrumb": [],"metadata": {"table-key-properties": []}}]}
 
         expected_output = sync.sync_jsonl_file(config, iterator, s3_path, table_spec, stream)
-        self.assertEqual(expected_output, 0)
\ No newline at end of file
+        self.assertEqual(expected_output, 0)
+
+class TestJsonlParsing(unittest.TestCase):
+
+    def test_parse_jsonl_line_matches_json(self):
+        lines = [b'{"id": 1, "name": "\\u00e9"}\n', b'{"id": 123456789012345678901234}\n', b'{"id": NaN}\n',
+                 b'{}\n', b'[1, 2]\n']
+        for line in lines:
+            self.assertEqual(repr(sync.parse_jsonl_line(line)), repr(json.loads(line.decode('utf-8'))))
+        self.assertEqual(sync.parse_jsonl_line(b'   \r\n'), {})
+        with self.assertRaises(UnicodeDecodeError):
+            sync.parse_jsonl_line(b'{"id": "\xff"}\n')
+
+    @mock.patch("tap_s3_csv.sync.messages.write_records")
+    def test_sync_jsonl_file_uses_json_lib(self, mocked_write_records):
+        stream = {'schema': {'type': ['object'], 'properties': {'id': {'type': ['null', 'string']}}},
+                  'metadata': [{'breadcrumb': ['properties', 'id'], 'metadata': {'source_type': 'string'}}]}
+        records = sync.sync_jsonl_file({}, [b'{"id": 1}\n', b'\n', b'{"id": "a"}\n'], 'test.jsonl',
+                                       {'table_name': 'test'}, stream, 'orjson')
+        self.assertEqual(records, 2)
+        mocked_write_records.assert_called_once_with('test', [{'id': '1'}, {'id': 'a'}], 'orjson')
+
+    def test_sync_jsonl_file_writes_ints_outside_of_64_bits_with_orjson(self):
+        stream = {'schema': {'type': ['object'], 'properties': {'id': {'type': ['null', 'integer']}}},
+                  'metadata': [{'breadcrumb': ['properties', 'id'], 'metadata': {'source_type': 'integer'}}]}
+        stdout = io.TextIOWrapper(io.BytesIO(), encoding='utf-8')
+        with mock.patch('sys.stdout', stdout):
+            records = sync.sync_jsonl_file({}, [b'{"id": 123456789012345678901234}\n'], 'test.jsonl',
+                                           {'table_name': 'test'}, stream, 'orjson')
+            stdout.flush()
+        self.assertEqual(records, 1)
+        self.assertEqual(stdout.buffer.getvalue(),
+                         b'{"type": "RECORD", "stream": "test", "record": {"id": 123456789012345678901234}}\n')
@@ -0,0 +1,127 @@
+import decimal
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+import urllib.parse
+from unittest import mock
+from tap_s3_csv import messages
+
+
+class TestRecordSerialization(unittest.TestCase):
+
+    def test_serialize_records_matches_format_message(self):
+        records = [{'id': 1, 'name': 'é"\n', 'nested': {'a': [1, None]}}, {'amount': 1.5, 'flag': True}]
+        for json_lib in ['simple', 'orjson']:
+            expected = ''.join(f'{messages.format_message(messages.record_message("tablé", record), json_lib)}\n'
+                               for record in records).encode('utf-8')
+            self.assertEqual(messages.serialize_records('tablé', records, json_lib), expected)
+
+        self.assertEqual(messages.serialize_records('table', [{'amount': decimal.Decimal('1.10')}]),
+                         b'{"type": "RECORD", "stream": "table", "record": {"amount": 1.10}}\n')
+        self.assertEqual(messages.serialize_records('table', []), b'')
+
+    def test_ints_outside_of_64_bits_fall_back_to_simplejson(self):
+        records = [{'id': 123456789012345678901234}, {'id': 1}]
+        self.assertEqual(messages.serialize_records('table', records, 'orjson'),
+                         messages.serialize_records('table', records))
+        self.assertEqual(messages.serialize_batch_lines(records, 'orjson'),
+                         b'{"id": 123456789012345678901234}\n{"id": 1}\n')
+        self.assertEqual(messages.format_message(messages.record_message('table', records[0]), 'orjson'),
+                         '{"type": "RECORD", "stream": "table", "record": {"id": 123456789012345678901234}}')
+
+    def test_write_records_writes_bytes_after_pending_text(self):
+        stdout = io.TextIOWrapper(io.BytesIO(), encoding='utf-8')
+        with mock.patch('sys.stdout', stdout):
+            stdout.write('{"type": "STATE"}\n')
+            messages.write_records('table', [{'id': 1}], 'orjson')
+            self.assertEqual(stdout.buffer.getvalue(),
+                             b'{"type": "STATE"}\n{"type":"RECORD","stream":"table","record":{"id":1}}\n')
+
+
+class BlockingStream(io.BytesIO):
+    def __init__(self):
+        super().__init__()
+        self.released = threading.Event()
+        self.chunks = []
+
+    def write(self, data):
+        self.released.wait()
+        self.chunks.append(data)
+        return super().write(data)
+
+
+class TestBackgroundWriter(unittest.TestCase):
+
+    def test_writes_messages_in_order_in_large_chunks(self):
+        stream = BlockingStream()
+        writer = messages.BackgroundWriter(stream, queue_size=2, flush_bytes=1024, flush_seconds=60)
+        data = [b'%d\n' % i for i in range(1000)]
+
+        # the queue fills up while the target does not read
+        threading.Timer(0.2, stream.released.set).start()
+        for item in data:
+            writer.write(item)
+        writer.close()
+
+        self.assertEqual(stream.getvalue(), b''.join(data))
+        self.assertLess(len(stream.chunks), 10)
+        metrics = writer.get_metrics()
+        self.assertEqual(metrics['output_bytes'], len(b''.join(data)))
+        self.assertGreater(metrics['output_queue_blocked_seconds'], 0)
+
+    def test_state_follows_queued_records(self):
+        stdout = io.TextIOWrapper(io.BytesIO(), encoding='utf-8')
+        with mock.patch('sys.stdout', stdout):
+            with messages.background_writer():
+                messages.write_records('table', [{'id': 1}], 'orjson')
+                messages.write_state({'table': 1})
+            self.assertEqual(stdout.buffer.getvalue(),
+                             b'{"type":"RECORD","stream":"table","record":{"id":1}}\n'
+                             b'{"type": "STATE", "value": {"table": 1}}\n')
+        self.assertIsNone(messages._writer)
+
+    def test_write_errors_reach_the_producer(self):
+        stream = mock.Mock()
+        stream.write.side_effect = BrokenPipeError()
+        writer = messages.BackgroundWriter(stream, flush_bytes=1)
+        writer.write(b'1\n')
+        with self.assertRaises(BrokenPipeError):
+            writer.close()
+
+
+class TestBatchOutput(unittest.TestCase):
+
+    def test_batches_are_announced_before_state(self):
+        stdout = io.TextIOWrapper(io.BytesIO(), encoding='utf-8')
+        with tempfile.TemporaryDirectory() as root, mock.patch('sys.stdout', stdout):
+            with messages.batch_output({'output_mode': 'batch', 'batch_root': root, 'batch_max_rows': 3}):
+                messages.write_records('table', [{'id': 1}, {'id': 2}], 'orjson')
+                messages.write_records('table', [{'id': 3}, {'id': 4}], 'orjson')
+                messages.write_state({'table': 1})
+                messages.write_records('table', [{'id': 5}], 'orjson')
+
+            lines = [json.loads(line) for line in stdout.buffer.getvalue().splitlines()]
+            self.assertEqual([line['type'] for line in lines], ['BATCH', 'STATE', 'BATCH'])
+            self.assertEqual(lines[0]['encoding'], {'format': 'jsonl', 'compression': 'gzip'})
+
+            records = []
+            for line in lines:
+                if line['type'] == 'BATCH':
+                    with gzip.open(urllib.parse.urlparse(line['manifest'][0]).path, 'rt') as batch_file:
+                        records.append([json.loads(record) for record in batch_file])
+            self.assertEqual(records, [[{'id': 1}, {'id': 2}, {'id': 3}, {'id': 4}], [{'id': 5}]])
+
+    def test_failed_sync_discards_staged_records(self):
+        stdout = io.TextIOWrapper(io.BytesIO(), encoding='utf-8')
+        with tempfile.TemporaryDirectory() as root, mock.patch('sys.stdout', stdout):
+            with self.assertRaises(ValueError):
+                with messages.batch_output({'output_mode': 'batch', 'batch_root': root}):
+                    messages.write_records('table', [{'id': 1}])
+                    raise ValueError()
+            self.assertEqual(os.listdir(root), [])
+            self.assertEqual(stdout.buffer.getvalue(), b'')
+        self.assertIsNone(messages._batch_stager)
@@ -0,0 +1,55 @@
+import gzip
+import io
+import json
+import unittest
+from unittest import mock
+
+from tap_s3_csv import messages, output_compression
+from tap_s3_csv.symon_exception import SymonException
+
+
+class TestCompressedOutput(unittest.TestCase):
+
+    def test_gzip_output_is_decodable_by_gzip(self):
+        stdout = io.TextIOWrapper(io.BytesIO(), encoding='utf-8')
+        with mock.patch('sys.stdout', stdout):
+            with messages.compressed_output('gzip'), messages.background_writer():
+                messages.write_records('table', [{'id': i, 'name': 'abc'} for i in range(1000)], 'orjson')
+                messages.write_state({'table': 1})
+
+        lines = gzip.decompress(stdout.buffer.getvalue()).splitlines()
+        self.assertEqual(len(lines), 1001)
+        self.assertEqual(json.loads(lines[-1]), {'type': 'STATE', 'value': {'table': 1}})
+        self.assertLess(len(stdout.buffer.getvalue()), sum(map(len, lines)) / 5)
+
+    def test_flushed_blocks_are_decodable_before_the_end_of_the_stream(self):
+        stream = io.BytesIO()
+        output = output_compression.CompressedOutput(stream, 'gzip')
+        output.write(b'{"type": "STATE", "value": {}}\n')
+        output.flush()
+
+        decoded = io.BytesIO()
+        output_compression.decompress(io.BytesIO(stream.getvalue()), decoded, 'gzip')
+        self.assertEqual(decoded.getvalue(), b'{"type": "STATE", "value": {}}\n')
+
+    def test_decompress_reads_concatenated_members(self):
+        decoded = io.BytesIO()
+        output_compression.decompress(io.BytesIO(gzip.compress(b'a\n') + gzip.compress(b'b\n')), decoded, 'gzip')
+        self.assertEqual(decoded.getvalue(), b'a\nb\n')
+
+    def test_unsupported_compression(self):
+        with self.assertRaises(SymonException) as err:
+            output_compression.CompressedOutput(io.BytesIO(), 'lz4')
+        self.assertEqual(err.exception.code, 'UnsupportedOutputCompression')
+
+    @unittest.skipIf(output_compression.zstandard is None, 'zstandard is not installed')
+    def test_zstd_round_trip(self):
+        stream = io.BytesIO()
+        output = output_compression.CompressedOutput(stream, 'zstd')
+        output.write(b'a\n' * 1000)
+        output.flush()
+        output.close()
+
+        decoded = io.BytesIO()
+        output_compression.decompress(io.BytesIO(stream.getvalue()), decoded, 'zstd')
+        self.assertEqual(decoded.getvalue(), b'a\n' * 1000)
@@ -0,0 +1,69 @@
+import datetime
+import io
+import json
+import time
+import unittest
+from unittest import mock
+
+import tap_s3_csv
+from tap_s3_csv import messages
+
+TABLES = ['orders', 'customers', 'products']
+
+
+def get_catalog():
+    return {'streams': [{
+        'tap_stream_id': table,
+        'stream': table,
+        'schema': {'type': 'object', 'properties': {'id': {'type': ['null', 'integer']}, 'name': {'type': ['null', 'string']}}},
+        'metadata': [{'breadcrumb': [], 'metadata': {'selected': table != 'products', 'table-key-properties': ['id']}}],
+    } for table in TABLES]}
+
+
+def list_files(config, table_spec, modified_since=None):
+    return [{'key': f"{table_spec['table_name']}/{i}.csv",
+             'last_modified': datetime.datetime(2024, 1, i + 1, tzinfo=datetime.timezone.utc)} for i in range(3)]
+
+
+def sync_file(config, s3_path, table_spec, stream, *args):
+    for batch in range(2):
+        # gives the other stream a chance to write in between
+        time.sleep(0.01)
+        messages.write_records(table_spec['table_name'], [{'id': batch, 'name': s3_path}] * 5)
+    return 10
+
+
+class TestParallelSync(unittest.TestCase):
+
+    @mock.patch('tap_s3_csv.sync.sync_table_file', side_effect=sync_file)
+    @mock.patch('tap_s3_csv.sync.s3.get_input_files_for_table', side_effect=list_files)
+    def test_streams_are_synced_concurrently(self, mocked_list_files, mocked_sync_file):
+        config = {'bucket': 'bucket', 'tables': [{'table_name': table} for table in TABLES], 'sync_max_workers': 2}
+        stdout = io.TextIOWrapper(io.BytesIO(), encoding='utf-8')
+        with mock.patch('sys.stdout', stdout), mock.patch('tap_s3_csv.LOGGER.info') as mocked_info:
+            tap_s3_csv.do_sync(config, get_catalog(), {})
+
+        output = [json.loads(line) for line in stdout.buffer.getvalue().splitlines()]
+        schemas = [message['stream'] for message in output if message['type'] == 'SCHEMA']
+        self.assertEqual(sorted(schemas), ['customers', 'orders'])
+        for table in ['orders', 'customers']:
+            positions = [i for i, message in enumerate(output) if message.get('stream') == table]
+            # the SCHEMA comes before the records of its stream
+            self.assertEqual(output[positions[0]]['type'], 'SCHEMA')
+            self.assertEqual(len(positions), 1 + 3 * 2 * 5)
+
+        # every bookmark in the last state, and the bookmarks of a stream only ever move forward
+        states = [message['value'] for message in output if message['type'] == 'STATE']
+        self.assertEqual(states[-1]['bookmarks'], {
+            'orders': {'modified_since': '2024-01-03T00:00:00+00:00'},
+            'customers': {'modified_since': '2024-01-03T00:00:00+00:00'},
+        })
+        for table in ['orders', 'customers']:
+            bookmarks = [state['bookmarks'][table]['modified_since'] for state in states
+                         if table in state.get('bookmarks', {})]
+            self.assertEqual(bookmarks, sorted(bookmarks))
+
+        # counts are reported in the order of the catalog
+        export_log = next(call.args[0] for call in mocked_info.call_args_list if call.args[0].startswith('EXPORTS'))
+        self.assertTrue(export_log.startswith("EXPORTS tap-s3-csv data_props: {'name': '', 'row': 60, 'col': 4}"))
+        self.assertLess(export_log.index("'orders'"), export_log.index("'customers'"))
@@ -0,0 +1,120 @@
+import io
+import unittest
+from unittest import mock
+
+from tap_s3_csv import pipeline, sync, transform
+
+STREAM = {
+    'stream': 'table',
+    'tap_stream_id': 'table',
+    'schema': {
+        'type': 'object',
+        'properties': {
+            'id': {'type': ['null', 'integer', 'string']},
+            'name': {'type': ['null', 'string']},
+        }
+    },
+    'metadata': [
+        {'breadcrumb': [], 'metadata': {'selected': True}},
+        {'breadcrumb': ['properties', 'id'], 'metadata': {'inclusion': 'available', 'source_type': 'integer'}},
+        {'breadcrumb': ['properties', 'name'], 'metadata': {'inclusion': 'available', 'source_type': 'string'}},
+    ]
+}
+
+
+class FailingBody:
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def read(self, size):
+        data = self.data.read(size)
+        if not data:
+            raise ConnectionError('connection reset')
+        return data
+
+
+class TestPrefetchReader(unittest.TestCase):
+
+    def test_reads_the_whole_body(self):
+        data = bytes(range(256)) * 1000
+        reader = pipeline.PrefetchReader(io.BytesIO(data), pipeline.PipelineMetrics(), queue_size=2, block_size=1000)
+        self.assertEqual(b''.join(iter(lambda: reader.read(300), b'')), data)
+        reader.close()
+
+    def test_iterates_lines(self):
+        reader = pipeline.PrefetchReader(io.BytesIO(b'{"a": 1}\r\n{"a": 2}\n'), pipeline.PipelineMetrics(),
+                                         block_size=3)
+        self.assertEqual(list(reader), [b'{"a": 1}', b'{"a": 2}'])
+        reader.close()
+
+    def test_download_errors_are_raised_to_the_reader(self):
+        reader = pipeline.PrefetchReader(FailingBody(b'abc'), pipeline.PipelineMetrics())
+        self.assertEqual(reader.read(10), b'abc')
+        with self.assertRaises(ConnectionError):
+            reader.read(10)
+        reader.close()
+
+    def test_close_stops_a_blocked_download(self):
+        reader = pipeline.PrefetchReader(io.BytesIO(b'x' * 100000), pipeline.PipelineMetrics(), queue_size=1,
+                                         block_size=10)
+        reader.read(10)
+        reader.close()
+        self.assertFalse(reader.thread.is_alive())
+
+
+class TestTransformStage(unittest.TestCase):
+
+    def sync_csv(self, config, data):
+        with mock.patch('tap_s3_csv.sync.messages.write_records') as write_records:
+            rows = sync.sync_csv_file(config, io.BytesIO(data), 'file.csv', {'table_name': 'table'},
+                                      {**STREAM, 'schema': {**STREAM['schema']}})
+        return rows, [record for call in write_records.call_args_list for record in call.args[1]]
+
+    def test_worker_processes_write_the_same_records_in_order(self):
+        data = b'id,name\n' + b''.join(b'%d,name %d\n' % (i, i) for i in range(1000)) + b'1001,\n'
+        rows, records = self.sync_csv({}, data)
+        worker_rows, worker_records = self.sync_csv({'sync_transform_workers': 2}, data)
+
+        self.assertEqual(rows, 1001)
+        self.assertEqual(worker_rows, rows)
+        self.assertEqual(worker_records, records)
+        self.assertEqual(records[:2], [{'id': 0, 'name': 'name 0'}, {'id': 1, 'name': 'name 1'}])
+        self.assertEqual(records[-1], {'id': 1001, 'name': ''})
+
+    def test_worker_processes_are_shared_by_the_files_of_the_run(self):
+        self.addCleanup(pipeline.shutdown_transform_workers)
+        config = {'sync_transform_workers': 2}
+        self.assertEqual(self.sync_csv(config, b'id,name\n1,a\n')[1], [{'id': 1, 'name': 'a'}])
+        executor = pipeline._executor
+
+        # another stream with other columns gets its own row transformer on the same workers
+        stream = {**STREAM, 'schema': {'type': 'object', 'properties': {'id': {'type': ['null', 'string']}}},
+                  'metadata': [{'breadcrumb': ['properties', 'id'], 'metadata': {'source_type': 'string'}}]}
+        with mock.patch('tap_s3_csv.sync.messages.write_records') as write_records:
+            sync.sync_csv_file(config, io.BytesIO(b'id\n2\n'), 'other.csv', {'table_name': 'other'}, stream)
+        self.assertEqual(write_records.call_args.args[1], [{'id': '2'}])
+        self.assertEqual(self.sync_csv(config, b'id,name\n3,c\n')[1], [{'id': 3, 'name': 'c'}])
+        self.assertIs(pipeline._executor, executor)
+
+        pipeline.shutdown_transform_workers()
+        self.assertIsNone(pipeline._executor)
+
+    def test_memo_hit_rates_of_the_workers_are_logged(self):
+        self.addCleanup(pipeline.shutdown_transform_workers)
+        data = b'id,name\n' + b''.join(b'%d,name\n' % (i % 5) for i in range(1000))
+        with mock.patch('tap_s3_csv.sync.log_memo_hit_rates') as mocked_log:
+            self.sync_csv({'sync_transform_workers': 2, 'conversion_memo_size': 16}, data)
+        hit_rates = mocked_log.call_args.args[1].get_memo_hit_rates()
+        # each worker misses the 5 values once
+        self.assertGreaterEqual(hit_rates['id'], 0.99)
+        self.assertLess(hit_rates['id'], 1)
+
+    def test_schema_mismatch_in_a_worker_is_raised(self):
+        with self.assertRaises(transform.SchemaMismatch) as err:
+            self.sync_csv({'sync_transform_workers': 2}, b'id,name\n1,a\nx,b\n')
+        self.assertIn('id: data does not match', str(err.exception))
+
+    def test_iter_batches_skips_empty_rows(self):
+        rows = [{'a': 1}, {}, {'a': 2}, {'a': 3}]
+        self.assertEqual(list(pipeline.iter_batches(rows, 2, pipeline.PipelineMetrics())),
+                         [[{'a': 1}, {'a': 2}], [{'a': 3}]])
@@ -0,0 +1,139 @@
+import io
+import itertools
+import gzip
+import unittest
+import zipfile
+from unittest import mock
+from botocore.exceptions import ClientError
+from tap_s3_csv import s3
+
+
+class MockedS3Object():
+    def __init__(self, data):
+        self.data = data
+        self.ranges = []
+        self.content_length = len(data)
+
+    def get(self, Range):
+        start, end = [int(part) for part in Range[len('bytes='):].split('-')]
+        self.ranges.append((start, end))
+        body = self.data[start:end + 1]
+        return {'Body': io.BytesIO(body), 'ContentLength': len(body),
+                'ContentRange': f'bytes {start}-{end}/{len(self.data)}'}
+
+
+def mock_resource(s3_object):
+    resource = mock.MagicMock()
+    resource.Object.return_value = s3_object
+    return resource
+
+
+class TestS3RangeReader(unittest.TestCase):
+
+    def test_reads_object_with_growing_ranges(self):
+        data = bytes(range(256)) * 40
+        s3_object = MockedS3Object(data)
+        with mock.patch("tap_s3_csv.s3.boto3.resource", return_value=mock_resource(s3_object)):
+            reader = s3.S3RangeReader('bucket', 'key', range_size=100, max_range_size=400)
+            self.assertEqual(b''.join(iter(lambda: reader.read(50), b'')), data)
+
+        sizes = [end - start + 1 for start, end in s3_object.ranges]
+        self.assertEqual(sizes[:4], [100, 200, 400, 400])
+
+    def test_stops_fetching_when_reader_stops(self):
+        data = b'id,name\n' + b'1,abc\n' * 400000
+        s3_object = MockedS3Object(data)
+        with mock.patch("tap_s3_csv.s3.boto3.resource", return_value=mock_resource(s3_object)):
+            file_handle = s3.get_file_handle({'bucket': 'bucket'}, 'file.csv', ranged=True, size=len(data))
+            records = list(itertools.islice(s3.sample_file({}, 'file.csv', file_handle, 1, 'csv', max_records=10), 10))
+            file_handle.close()
+
+        self.assertEqual(records[0], {'id': '1', 'name': 'abc'})
+        self.assertEqual(s3_object.ranges, [(0, s3.SAMPLE_RANGE_SIZE - 1)])
+
+    def test_samples_gz_file_from_ranged_handle(self):
+        compressed = io.BytesIO()
+        with gzip.GzipFile(filename='data.csv', mode='wb', fileobj=compressed) as gz_file:
+            gz_file.write(b'id,name\n1,abc\n2,def\n')
+        s3_object = MockedS3Object(compressed.getvalue())
+        with mock.patch("tap_s3_csv.s3.boto3.resource", return_value=mock_resource(s3_object)):
+            file_handle = s3.get_file_handle({'bucket': 'bucket'}, 'data.csv.gz', ranged=True)
+            records = list(s3.sample_file({}, 'data.csv.gz', file_handle, 1, 'gz'))
+
+        self.assertEqual(records, [{'id': '1', 'name': 'abc'}, {'id': '2', 'name': 'def'}])
+
+    def test_invalid_range_is_end_of_file_without_retries(self):
+        s3_object = mock.MagicMock()
+        s3_object.get.side_effect = ClientError({'Error': {'Code': 'InvalidRange'}}, 'GetObject')
+        with mock.patch("tap_s3_csv.s3.boto3.resource", return_value=mock_resource(s3_object)), \
+                mock.patch("time.sleep") as mocked_sleep:
+            reader = s3.S3RangeReader('bucket', 'key')
+            self.assertEqual(reader.read(10), b'')
+
+        self.assertEqual(s3_object.get.call_count, 1)
+        mocked_sleep.assert_not_called()
+
+    def test_zip_handle_is_closed_after_its_members_are_sampled(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr('first.csv', 'id\n1\n')
+            zip_file.writestr('second.csv', 'id\n2\n')
+        s3_object = MockedS3Object(archive.getvalue())
+        handles = []
+        open_handle = s3.get_file_handle
+
+        def get_file_handle(*args, **kwargs):
+            handles.append(open_handle(*args, **kwargs))
+            return handles[-1]
+
+        with mock.patch("tap_s3_csv.s3.boto3.resource", return_value=mock_resource(s3_object)), \
+                mock.patch("tap_s3_csv.s3.get_file_handle", side_effect=get_file_handle):
+            records = list(s3.sample_files({'bucket': 'bucket'}, {}, [{'key': 'data.zip', 'size': len(s3_object.data)}]))
+
+        self.assertEqual(records, [{'id': '1'}, {'id': '2'}])
+        self.assertEqual(len(handles), 1)
+        self.assertTrue(handles[0].closed)
+
+
+class TestProbeSampling(unittest.TestCase):
+
+    def test_probes_see_values_past_the_head_of_the_file(self):
+        data = b'id,name\n' + b'1,abc\n' * 200000 + b'"x\ny",def\n' + b'xyz,"g\nh"\n' * 200000
+        s3_object = MockedS3Object(data)
+        with mock.patch("tap_s3_csv.s3.boto3.resource", return_value=mock_resource(s3_object)):
+            file_handle = s3.get_file_handle({'bucket': 'bucket'}, 'file.csv', ranged=True, size=len(data))
+            records = s3.sample_file_with_probes({}, 'file.csv', file_handle, 'csv', len(data), 100, 4, 1024)
+
+        self.assertEqual(records[0], {'id': '1', 'name': 'abc'})
+        # quoted line breaks are dropped the same way the head sampling path drops them
+        self.assertIn({'id': 'xyz', 'name': 'gh'}, records)
+        # every record is resynced to a record boundary
+        self.assertTrue(all(set(record) == {'id', 'name'} for record in records))
+        self.assertLessEqual(len(records), 100)
+
+    def test_each_probe_requests_its_own_bytes(self):
+        data = b'id,name\n' + b'1,abc\n' * 200000
+        s3_object = MockedS3Object(data)
+        config = {'bucket': 'bucket', 'sampling_strategy': 'probes', 'sample_probe_count': 4,
+                  'sample_probe_bytes': 1024}
+        s3_files = [{'key': 'file.csv', 'size': len(data)}]
+        with mock.patch("tap_s3_csv.s3.boto3.resource", return_value=mock_resource(s3_object)):
+            s3_file = s3.get_files_to_sample(config, s3_files, 1)[0]
+            s3.sample_file_with_probes({}, 'file.csv', s3_file['file_handle'], 'csv', len(data), 100, 4, 1024)
+
+        expected = [(start, start + length - 1) for start, length in
+                    s3.sampling.get_probe_ranges(len(data), 4, 1024, 'file.csv')]
+        self.assertEqual(s3_object.ranges, expected)
+
+    def test_probe_ranges_cover_the_whole_file(self):
+        ranges = s3.sampling.get_probe_ranges(1000, 4, 10, 'key')
+        self.assertEqual(ranges[0], (0, 10))
+        for i, (start, length) in enumerate(ranges):
+            self.assertEqual(length, 10)
+            self.assertTrue(i * 250 <= start <= (i + 1) * 250 - 10)
+        self.assertEqual(ranges, s3.sampling.get_probe_ranges(1000, 4, 10, 'key'))
+        self.assertEqual(s3.sampling.get_probe_ranges(40, 4, 10, 'key'), [(0, 40)])
+
+    def test_spread_files(self):
+        self.assertEqual(s3.sampling.spread_files(range(10), 3), [0, 4, 9])
+        self.assertEqual(s3.sampling.spread_files(range(2), 3), [0, 1])
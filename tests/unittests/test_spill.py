@@ -0,0 +1,91 @@
+import gzip
+import io
+import unittest
+import zipfile
+from unittest import mock
+
+from tap_s3_csv import spill, sync
+
+
+class TestSpillBuffer(unittest.TestCase):
+
+    def test_buffer_stays_in_memory_within_the_budget(self):
+        budget = spill.MemoryBudget(100)
+        with spill.SpillBuffer(budget) as buffer:
+            buffer.write(b'a' * 40)
+            buffer.write(b'b' * 40)
+            self.assertFalse(buffer.spilled)
+            self.assertEqual(budget.used_bytes, 80)
+            self.assertEqual(buffer.getfile().read(), b'a' * 40 + b'b' * 40)
+        self.assertEqual(budget.used_bytes, 0)
+        self.assertEqual(budget.get_metrics(), {
+            'memory_budget_bytes': 100, 'buffer_peak_bytes': 80, 'spilled_buffers': 0, 'spilled_bytes': 0})
+
+    def test_buffer_spills_to_disk_above_the_budget(self):
+        budget = spill.MemoryBudget(100)
+        with spill.SpillBuffer(budget) as buffer:
+            buffer.write(b'a' * 60)
+            buffer.write(b'b' * 60)
+            buffer.write(b'c' * 10)
+            self.assertTrue(buffer.spilled)
+            self.assertEqual(budget.used_bytes, 0)
+            self.assertEqual(buffer.read_at(55, 10), b'a' * 5 + b'b' * 5)
+            self.assertEqual(buffer.getfile().read(), b'a' * 60 + b'b' * 60 + b'c' * 10)
+        self.assertTrue(buffer.closed)
+        self.assertEqual(budget.get_metrics(), {
+            'memory_budget_bytes': 100, 'buffer_peak_bytes': 60, 'spilled_buffers': 1, 'spilled_bytes': 130})
+
+    def test_buffers_share_the_budget(self):
+        budget = spill.MemoryBudget(100)
+        with spill.SpillBuffer(budget) as first, spill.SpillBuffer(budget) as second:
+            first.copy_from(io.BytesIO(b'a' * 70))
+            second.copy_from(io.BytesIO(b'b' * 70))
+            self.assertFalse(first.spilled)
+            self.assertTrue(second.spilled)
+        self.assertEqual(budget.used_bytes, 0)
+
+    def test_lines(self):
+        lines = spill.SpillLines(spill.MemoryBudget(10))
+        for line in [b'id,name\r\n', b'1,a\r\n', b'2,b\r\n']:
+            lines.append(line)
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[1], b'1,a\r\n')
+        self.assertEqual(list(lines), [b'id,name\r\n', b'1,a\r\n', b'2,b\r\n'])
+        lines.close()
+
+
+class TestSpilledFiles(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('tap_s3_csv.spill._budget', spill.MemoryBudget(16))
+        self.budget = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch('tap_s3_csv.sync.handle_file', return_value=2)
+    def test_gz_file_is_synced_from_a_spilled_buffer(self, mocked_handle_file):
+        compressed = io.BytesIO()
+        with gzip.GzipFile('data.csv', 'wb', fileobj=compressed) as gz_file:
+            gz_file.write(b'id\n1\n2\n')
+        compressed.seek(0)
+
+        mocked_handle_file.side_effect = lambda *args: args[5].read().count(b'\n') - 1
+        self.assertEqual(sync.sync_gz_file({}, 'path/data.csv.gz', {}, {}, compressed), 2)
+        self.assertEqual(mocked_handle_file.call_args.args[1], 'path/data.csv.gz/data.csv')
+        self.assertEqual(self.budget.spilled_buffers, 1)
+        self.assertEqual(self.budget.used_bytes, 0)
+
+    @mock.patch('tap_s3_csv.sync.handle_file')
+    @mock.patch('tap_s3_csv.sync.s3.get_file_handle')
+    def test_zip_file_is_synced_from_a_spilled_buffer(self, mocked_get_file_handle, mocked_handle_file):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr('first.csv', 'id\n1\n')
+            zip_file.writestr('second.csv', 'id\n2\n3\n')
+        mocked_get_file_handle.return_value = io.BytesIO(archive.getvalue())
+        mocked_handle_file.side_effect = lambda *args: args[5].read().count(b'\n') - 1
+
+        self.assertEqual(sync.sync_compressed_file({}, 'path/data.zip', {}, {}), 3)
+        self.assertEqual([call.args[1] for call in mocked_handle_file.call_args_list],
+                         ['path/data.zip/first.csv', 'path/data.zip/second.csv'])
+        self.assertEqual(self.budget.spilled_buffers, 1)
+        self.assertEqual(self.budget.used_bytes, 0)
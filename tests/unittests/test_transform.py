@@ -0,0 +1,113 @@
+import unittest
+from unittest import mock
+from tap_s3_csv import transform
+
+
+SCHEMA = {
+    'type': ['object'],
+    'properties': {
+        'id': {'type': ['number', 'string', 'null']},
+        'name': {'type': ['string', 'null']},
+        'created_at': {'type': ['string', 'null'], 'format': 'date-time'},
+        'hidden': {'type': ['string', 'null']},
+    }
+}
+SOURCE_TYPE_MAP = {'name': 'string', 'created_at': 'string', 'hidden': 'string'}
+AUTO_FIELDS = frozenset([('properties', 'id')])
+FILTER_FIELDS = frozenset([('properties', 'hidden')])
+
+
+class TestTransformPlan(unittest.TestCase):
+
+    def transform_both(self, row):
+        expected = transform.Transformer(SOURCE_TYPE_MAP).transform(dict(row), SCHEMA, AUTO_FIELDS, FILTER_FIELDS)
+        plan = transform.Transformer(SOURCE_TYPE_MAP).compile_plan(SCHEMA, AUTO_FIELDS, FILTER_FIELDS)
+        return expected, plan.transform(dict(row))
+
+    def test_plan_matches_transform(self):
+        rows = [
+            {'id': '1,000', 'name': 'abc', 'created_at': '2024-01-13', 'hidden': 'x'},
+            {'id': '', 'name': None, 'created_at': None},
+            {'id': '2', 'name': 'def', None: ['extra']},
+            {'id': 3, 'name': {'nested': True}, 'created_at': 1700000000},
+        ]
+        for row in rows:
+            expected, actual = self.transform_both(row)
+            self.assertEqual(list(actual.items()), list(expected.items()))
+        self.assertEqual(actual, {'id': 3.0, 'name': "{'nested': True}", 'created_at': '1700000000'})
+
+    def test_rows_of_strings_pass_through(self):
+        transformer = transform.Transformer({'id': 'string', 'name': 'string', 'created_at': 'string', 'hidden': 'string'})
+        plan = transformer.compile_plan(SCHEMA, frozenset(), frozenset())
+        row = {'id': '1', 'name': None}
+        self.assertIs(plan.transform(row), row)
+
+    def test_plan_raises_same_schema_mismatch(self):
+        row = {'id': 'abc', 'name': 'x'}
+        schema = {'type': ['object'], 'properties': {'id': {'type': ['number']}, 'name': {'type': ['string']}}}
+        with self.assertRaises(transform.SchemaMismatch) as expected:
+            transform.Transformer({}).transform(dict(row), schema, frozenset(), frozenset())
+        with self.assertRaises(transform.SchemaMismatch) as actual:
+            transform.Transformer({}).compile_plan(schema, frozenset(), frozenset()).transform(dict(row))
+        self.assertEqual(str(actual.exception), str(expected.exception))
+
+    @mock.patch("tap_s3_csv.transform.MEMO_CHECK_ROWS", 10)
+    def test_memo_turns_off_for_high_cardinality_columns(self):
+        schema = {'type': ['object'], 'properties': {'status': {'type': ['boolean', 'string']},
+                                                      'amount': {'type': ['number', 'string']}}}
+        plan = transform.Transformer({}, memo_size=16).compile_plan(schema, frozenset(), frozenset())
+        rows = [{'status': 'false', 'amount': str(i)} for i in range(30)]
+        self.assertEqual([plan.transform(dict(row)) for row in rows],
+                         [{'status': False, 'amount': float(i)} for i in range(30)])
+
+        self.assertEqual(list(plan.memos), ['status'])
+        self.assertTrue(plan.memo_stats['amount']['disabled'])
+        self.assertEqual(plan.get_memo_hit_rates(), {'status': round(29 / 30, 3), 'amount': 0.0})
+
+    @mock.patch("tap_s3_csv.transform.MEMO_CHECK_ROWS", 100)
+    def test_memo_counts_of_a_worker_cover_every_row(self):
+        schema = {'type': ['object'], 'properties': {'status': {'type': ['boolean', 'string']}}}
+        plan = transform.Transformer({}, memo_size=16).compile_plan(schema, frozenset(), frozenset())
+        # the last 40 rows of every 100 have distinct values: each batch of 10 rows on its own would disable the memo
+        rows = [{'status': 'false' if i % 100 < 60 else str(i)} for i in range(3000)]
+        totals = [0, 0]
+        for start in range(0, len(rows), 10):
+            for row in rows[start:start + 10]:
+                plan.transform(dict(row))
+            for hits, lookups in plan.get_memo_counts().values():
+                totals[0] += hits
+                totals[1] += lookups
+
+        self.assertIn('status', plan.memos)
+        self.assertEqual(totals[1], 3000)
+        self.assertEqual(totals, [plan.memo_stats['status']['hits'], plan.memo_stats['status']['lookups']])
+
+
+class TestDateParsing(unittest.TestCase):
+
+    def test_date_parsers_match_generic_parser(self):
+        values = {
+            'YYYY-MM-DD': ['2024-01-13', '2024-01-13T10:11:12.5Z', '2024-01-13 10:11:12-05:30'],
+            'MM/DD/YYYY': ['01/13/2024', '1/13/2024 10:11:12', '01/13/2024T10:11:12.123456+01:00'],
+            'DD-MM-YYYY': ['13-01-2024', '13-01-2024 10:11:12Z'],
+        }
+        for date_format, format_values in values.items():
+            parse_date = transform.get_date_parser(date_format)
+            for value in format_values:
+                self.assertIsNotNone(parse_date(value))
+                self.assertEqual(transform.string_to_datetime(value, parse_date), transform.string_to_datetime(value))
+
+    def test_hour_24_is_left_to_the_generic_parser(self):
+        for date_format, value in [('YYYY-MM-DD', '2024-01-01T24:00:00'), ('YYYY-MM-DD', '2024-01-01 24:00:00Z'),
+                                   ('MM/DD/YYYY', '01/01/2024 24:00:00')]:
+            parse_date = transform.get_date_parser(date_format)
+            self.assertIsNone(parse_date(value))
+            self.assertEqual(transform.string_to_datetime(value, parse_date), transform.string_to_datetime(value))
+
+    def test_discovered_format_decides_day_and_month(self):
+        transformer = transform.Transformer({}, column_date_format={'date': 'DD/MM/YYYY'})
+        schema = {'type': ['object'], 'properties': {'date': {'type': ['string', 'null'], 'format': 'date-time'}}}
+        plan = transformer.compile_plan(schema, frozenset(), frozenset())
+        self.assertEqual(plan.transform({'date': '01/02/2024'}), {'date': '2024-02-01T00:00:00.000000Z'})
+        # values without the discovered format go through the generic parser
+        self.assertEqual(plan.transform({'date': 'Feb 1 2024'}), {'date': '2024-02-01T00:00:00.000000Z'})